@@ -1,27 +1,142 @@
-from src.utils import random_alphanumeric
-from src.task1.kinesis import task1_kinesis
-from src.task2.autoscaling import task2_autoscaling
-
 from argparse import ArgumentParser
+from importlib import import_module
+from src.backends import Backend, BACKENDS
+
+def buffering_hints( args ):
+    hints = dict( IntervalInSeconds=args.bufferingInterval, SizeInMBs=args.bufferingSize )
+    return { key: value for key, value in hints.items() if value is not None }
+
+def task1_arguments( args, backend ):
+    return [ args.name + "Task1", 10 ], dict( batchSize=args.batchSize, shardCount=args.shards,
+        engine=args.engine, maxInFlight=args.inFlight, consume=args.consume, aggregate=args.aggregate,
+        payloadSize=args.payloadSize, rate=args.rate, rateUnit=args.rateUnit, profile=args.profile,
+        workers=args.workers, verify=args.verify, inputPath=args.inputPath, compression=args.compression, s3Compression=args.s3Compression,
+        bufferingHints=buffering_hints( args ), sleepInterval=args.interval )
+
+def task2_arguments( args, backend ):
+    options = dict( maxBatchSize=args.rebuildBatchSize, minInService=args.minInService, maxFailures=args.maxFailures )
+    return [ args.name ], dict( { key: value for key, value in options.items() if value is not None }, create=backend.inProcess )
+
+# task name -> ( module, function, arguments ), the module of a task and its dependencies
+# (boto3, troposphere) are only imported once the task is selected and the arguments parsed
+TASKS = {
+    'task1': ( "src.task1.kinesis", "task1_kinesis", task1_arguments ),
+    'task2': ( "src.task2.autoscaling", "task2_autoscaling", task2_arguments )
+}
+DEFAULT_TASK = "task1" # task2 reboots real instances outside of the moto backend, it only runs when asked for
+
+def load_task( name ):
+    """[ import the module of a task ]
+
+    Arguments:
+        name {[String]} -- [ task name of TASKS ]
+
+    Returns:
+        [ tuple ] -- [ ( task function, arguments function ) ]
+    """
+    module, function, arguments = TASKS[ name ]
+    return getattr( import_module( module ), function ), arguments
 
 parser = ArgumentParser()
 parser.add_argument("--name", action="store", required=True,
                     help="Project name")
 
-parser.add_argument("--task", action="store",
+parser.add_argument("--task", action="store", choices=list( TASKS ), default=DEFAULT_TASK,
                     help="Task to run")
 
+parser.add_argument("--backend", action="store", choices=BACKENDS, default="localstack",
+                    help="Run against the localstack container, the aws configuration of the environment or in-process moto mocks")
+
+parser.add_argument("--batch-size", action="store", type=int, dest="batchSize",
+                    help="Send task1 records with put_records in batches of this size")
+
+parser.add_argument("--shards", action="store", type=int, default=1,
+                    help="Number of task1 kinesis stream shards")
+
+parser.add_argument("--engine", action="store", choices=["thread", "async"], default="thread",
+                    help="Task1 producer engine")
+
+parser.add_argument("--in-flight", action="store", type=int, default=8, dest="inFlight",
+                    help="Requests kept in flight by the async producer engine")
+
+parser.add_argument("--consume", action="store_true",
+                    help="Read the task1 stream back and report consumer lag")
+
+parser.add_argument("--aggregate", action="store_true",
+                    help="Pack task1 records into KPL aggregated records")
+
+parser.add_argument("--payload-size", action="store", type=int, default=10, dest="payloadSize",
+                    help="Bytes of each task1 random payload")
+
+parser.add_argument("--rate", action="store", type=float,
+                    help="Target task1 rate in --rate-unit per second, instead of a record every 0.2s")
+
+parser.add_argument("--rate-unit", action="store", choices=["records", "bytes"], default="records", dest="rateUnit",
+                    help="Unit of --rate and of the load profile rates")
+
+parser.add_argument("--profile", action="store",
+                    help="Task1 load profile: constant, ramp:START:END:SECONDS, step:SECOND=RATE,..., sine:MEAN:AMPLITUDE:PERIOD or csv:PATH[:loop]")
+
+parser.add_argument("--workers", action="store", type=int, default=1,
+                    help="Task1 producer processes, each writing to its own slice of the stream")
+
+parser.add_argument("--verify", action="store_true",
+                    help="Check that firehose delivered every task1 record to S3 and report the delivery latency, needs a --payload-size of at least 35")
+
+parser.add_argument("--input", action="store", dest="inputPath",
+                    help="Put the lines of this file or pipe, - for stdin, to the task1 stream instead of random payloads")
+
+parser.add_argument("--interval", action="store", type=float, default=0.2,
+                    help="Seconds between two task1 puts without --rate or --profile")
+
+parser.add_argument("--buffering-interval", action="store", type=int, dest="bufferingInterval",
+                    help="Seconds firehose buffers task1 records before writing to S3 (default: 60)")
+
+parser.add_argument("--buffering-size", action="store", type=int, dest="bufferingSize",
+                    help="MiB firehose buffers task1 records before writing to S3 (default: 50)")
+
+parser.add_argument("--compression", action="store", choices=["none", "gzip", "zstd"], default="none",
+                    help="Compress each task1 kinesis record, one frame per KPL aggregated record with --aggregate")
+
+parser.add_argument("--s3-compression", action="store", choices=["UNCOMPRESSED", "GZIP"], dest="s3Compression",
+                    help="Firehose compression of the task1 S3 objects of raw records, compressed records are delivered as they are")
+
+parser.add_argument("--metrics-port", action="store", type=int, dest="metricsPort",
+                    help="Serve AWS call metrics in the Prometheus text format on this port")
+
+parser.add_argument("--metrics-json", action="store", dest="metricsJson",
+                    help="Dump AWS call metrics to this json file every 10s and at exit")
+
+parser.add_argument("--rebuild-batch-size", action="store", type=int, dest="rebuildBatchSize",
+                    help="Task2 instances rebuilt at once (default: rollingRebuild.MAX_BATCH_SIZE)")
+
+parser.add_argument("--min-in-service", action="store", type=int, dest="minInService",
+                    help="Task2 instances kept in service while rebuilding (default: rollingRebuild.MIN_INSTANCES_IN_SERVICE)")
+
+parser.add_argument("--max-failures", action="store", type=int, dest="maxFailures",
+                    help="Task2 instances allowed to fail before the rebuild aborts (default: rollingRebuild.DEFAULT_MAX_FAILURES)")
+
 args = parser.parse_args()
 
 if __name__ == '__main__':
-    if args.task is None:
-        print("run both tasks")
-        task1_kinesis( args.name + "Task1" , 10 )
-    elif args.task == "task1":
-        task1_kinesis( args.name + "Task1" , 10 )
-    elif args.task == "task2":
-        # TODO: task2
-        task2_autoscaling( args.name )
-        pass
-    else:
-        print("Unknown task: {}".format(args.task))
\ No newline at end of file
+    task, arguments = load_task( args.task )
+    from src.clients import close_clients
+    from src.instrumentation import instrumentation
+    from src.waiter import waiter
+
+    backend = Backend( args.backend ).start()
+    try:
+        if args.metricsPort is not None:
+            instrumentation.serve_prometheus( args.metricsPort )
+        if args.metricsJson:
+            instrumentation.start_json_dump( args.metricsJson )
+        taskArgs, taskKwargs = arguments( args, backend )
+        task( *taskArgs, **taskKwargs )
+    finally:
+        # a failed run is the one whose waits and AWS calls matter most
+        waiter.report()
+        instrumentation.report()
+        instrumentation.stop()
+        backend.report()
+        close_clients()
+        backend.stop()
\ No newline at end of file
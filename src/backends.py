@@ -0,0 +1,92 @@
+from src.clock import VirtualClock, use_clock
+from src.stateCache import stateCache, DEFAULT_STATE_PATH
+
+BACKENDS = [ "localstack", "aws", "moto" ]
+MOTO_REGION = "us-west-2"
+# the state cache of a backend only holds the resources of that backend, None keeps it in memory
+STATE_PATHS = {
+    'localstack': DEFAULT_STATE_PATH,
+    'aws': ".task-state-aws.json",
+    'moto': None
+}
+
+class Backend:
+    """AWS endpoints the tasks run against
+
+    localstack points the localstack services at the setup.sh container, autoscaling and
+    ec2 at the aws configuration of the environment. aws points every service at the aws
+    configuration of the environment. moto mocks every service in process, including
+    autoscaling and ec2, and swaps the clock for a VirtualClock so waits, backoffs and
+    producer intervals cost no real time: no container, no network and no credentials.
+    The in-process state only lives as long as the backend, and only in this process.
+    boto3 is only imported once a backend starts, so a CLI can list BACKENDS cheaply"""
+
+    def __init__(self, name="localstack", registry=None):
+        if name not in BACKENDS:
+            raise Exception("Unknown backend {}, expect one of {}".format( name, ", ".join( BACKENDS ) ))
+        self.name = name
+        self.registry = registry
+        self.mock = None
+        self.clock = None
+        self.previous = None
+
+    @property
+    def inProcess(self):
+        return self.name == "moto"
+
+    def start(self):
+        """[ point the client registry and the state cache at the backend ]
+
+        Raises:
+            Exception: [ moto is not installed ]
+
+        Returns:
+            [ Backend ] -- [ self ]
+        """
+        global current
+        from src.clients import registry as defaultRegistry, LOCALSTACK_ENDPOINTS, LOCALSTACK_REGION
+
+        self.registry = self.registry or defaultRegistry
+        if self.name == "moto":
+            try:
+                from moto import mock_aws
+            except ImportError:
+                raise Exception("The moto backend needs the moto package: pipenv install moto")
+            self.mock = mock_aws()
+            self.mock.start()
+            endpoints = self.registry.configure( {}, MOTO_REGION, MOTO_REGION )
+            self.clock = VirtualClock()
+            previousClock = use_clock( self.clock )
+        elif self.name == "aws":
+            endpoints = self.registry.configure( {}, None )
+            previousClock = None
+        else:
+            endpoints = self.registry.configure( LOCALSTACK_ENDPOINTS, LOCALSTACK_REGION )
+            previousClock = None
+        statePath = stateCache.use_path( STATE_PATHS[ self.name ] )
+        self.previous = ( endpoints, previousClock, statePath, current )
+        current = self
+        return self
+
+    def stop(self):
+        """restore the endpoints, clock and state cache in use before start"""
+        global current
+        if self.previous is None:
+            return
+        endpoints, previousClock, statePath, previousBackend = self.previous
+        self.registry.configure( *endpoints )
+        if previousClock is not None:
+            use_clock( previousClock )
+        stateCache.use_path( statePath )
+        if self.mock is not None:
+            self.mock.stop()
+            self.mock = None
+        current = previousBackend
+        self.previous = None
+
+    def report(self):
+        """print the time skipped by the virtual clock"""
+        if self.clock is not None:
+            print( "{} backend skipped {:.1f}s of sleeps".format( self.name, self.clock.slept ) )
+
+current = Backend()
@@ -0,0 +1,142 @@
+import threading
+import time
+import boto3
+from botocore.config import Config
+from src.instrumentation import instrumentation as defaultInstrumentation
+
+LOCALSTACK_ENDPOINTS = {
+    'kinesis': 'http://localhost:4568',
+    'cloudformation': 'http://localhost:4581',
+    's3': 'http://localhost:4572',
+    'firehose': 'http://localhost:4573'
+}
+LOCALSTACK_REGION = 'us-west-2'
+
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_MODE = 'standard'
+
+_DEFAULT = object()
+
+class ClientRegistry:
+    """Thread safe registry of boto3 clients keyed by service, endpoint, region and pool size
+
+    Building a client loads the botocore service model and opens a new connection pool,
+    so clients are built once on a shared session and reused by every caller until close.
+    With an Instrumentation every client built is attached to it. Services listed in endpoints
+    default to their endpoint and regionName, the others to defaultRegionName, None leaving
+    them to the aws configuration of the environment"""
+
+    def __init__(self, maxPoolConnections=DEFAULT_MAX_POOL_CONNECTIONS, tcpKeepalive=True,
+                 maxAttempts=DEFAULT_MAX_ATTEMPTS, retryMode=DEFAULT_RETRY_MODE, instrumentation=None,
+                 endpoints=LOCALSTACK_ENDPOINTS, regionName=LOCALSTACK_REGION, defaultRegionName=None ):
+        self.endpoints = dict( endpoints )
+        self.regionName = regionName
+        self.defaultRegionName = defaultRegionName
+        self.maxPoolConnections = maxPoolConnections
+        self.tcpKeepalive = tcpKeepalive
+        self.maxAttempts = maxAttempts
+        self.retryMode = retryMode
+        self.instrumentation = instrumentation
+        self.lock = threading.Lock()
+        self.session = None
+        self.clients = {}
+
+    def configure(self, endpoints, regionName, defaultRegionName=None):
+        """[ point the registry at other endpoints, the clients already built are closed ]
+
+        Arguments:
+            endpoints {[ dict ]} -- [ service name to endpoint url ]
+            regionName {[String]} -- [ region of the services of endpoints ]
+
+        Keyword Arguments:
+            defaultRegionName {[String]} -- [ region of the other services ] (default: {None})
+
+        Returns:
+            [ tuple ] -- [ previous ( endpoints, regionName, defaultRegionName ) ]
+        """
+        self.close()
+        with self.lock:
+            previous = ( self.endpoints, self.regionName, self.defaultRegionName )
+            self.endpoints = dict( endpoints )
+            self.regionName = regionName
+            self.defaultRegionName = defaultRegionName
+            return previous
+
+    def config(self, maxPoolConnections):
+        """[ botocore config shared by the clients ]
+
+        Arguments:
+            maxPoolConnections {[ int ]} -- [ connection pool size ]
+
+        Returns:
+            [ botocore.config.Config ] -- [ client config ]
+        """
+        return Config(
+            max_pool_connections=maxPoolConnections,
+            tcp_keepalive=self.tcpKeepalive,
+            retries={ 'max_attempts': self.maxAttempts, 'mode': self.retryMode }
+        )
+
+    def get_client(self, service, endpointUrl=_DEFAULT, regionName=_DEFAULT, maxPoolConnections=None):
+        """[ get or create the client of a service ]
+
+        Services of the registry endpoints default to their endpoint and region,
+        other services default to defaultRegionName or the aws configuration of the environment
+
+        Arguments:
+            service {[String]} -- [ boto3 service name ]
+
+        Keyword Arguments:
+            endpointUrl {[String]} -- [ endpoint url ] (default: {registry endpoint of the service})
+            regionName {[String]} -- [ region ] (default: {registry region of the service})
+            maxPoolConnections {[int]} -- [ connection pool size ] (default: {registry maxPoolConnections})
+
+        Returns:
+            [ botocore.client ] -- [ shared client ]
+        """
+        if endpointUrl is _DEFAULT:
+            endpointUrl = self.endpoints.get( service )
+        if regionName is _DEFAULT:
+            regionName = self.regionName if service in self.endpoints else self.defaultRegionName
+        maxPoolConnections = maxPoolConnections or self.maxPoolConnections
+
+        key = ( service, endpointUrl, regionName, maxPoolConnections )
+        with self.lock:
+            client = self.clients.get( key )
+            if client is None:
+                start = time.perf_counter()
+                if self.session is None:
+                    self.session = boto3.session.Session()
+                client = self.session.client( service, endpoint_url=endpointUrl, region_name=regionName,
+                    config=self.config( maxPoolConnections ) )
+                if self.instrumentation is not None:
+                    self.instrumentation.client_created( service, time.perf_counter() - start )
+                    self.instrumentation.attach( client )
+                self.clients[ key ] = client
+            return client
+
+    def close(self):
+        """close the connection pools of every client and forget them"""
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients = {}
+            self.session = None
+
+registry = ClientRegistry( instrumentation=defaultInstrumentation )
+
+def get_client( service, **kwargs ):
+    """[ get the shared client of a service from the default registry ]
+
+    Arguments:
+        service {[String]} -- [ boto3 service name ]
+
+    Returns:
+        [ botocore.client ] -- [ shared client ]
+    """
+    return registry.get_client( service, **kwargs )
+
+def close_clients():
+    """close every client of the default registry"""
+    registry.close()
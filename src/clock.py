@@ -0,0 +1,99 @@
+import threading
+import time as systemTime
+
+class SystemClock:
+    """Wall clock, sleeps for real"""
+
+    def time(self):
+        return systemTime.time()
+
+    def monotonic(self):
+        return systemTime.monotonic()
+
+    def sleep(self, seconds):
+        systemTime.sleep( seconds )
+
+    def wait(self, event, seconds):
+        return event.wait( seconds )
+
+    async def async_sleep(self, seconds):
+        # asyncio is already loaded by the caller, importing it here keeps it out of a cold CLI start
+        import asyncio
+        await asyncio.sleep( seconds )
+
+class VirtualClock:
+    """Clock whose sleeps return at once and move the time forward instead
+
+    Polling loops, backoffs and rate limits then run at the speed of the calls they
+    make, eg. against in-process mocks, while still seeing the time pass. The time is
+    shared by every thread, so concurrent sleeps add up rather than overlap"""
+
+    def __init__(self, start=None):
+        self.now = systemTime.time() if start is None else start
+        self.start = self.now
+        self.slept = 0
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now - self.start
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += max( seconds, 0 )
+            self.slept += max( seconds, 0 )
+        # let the other threads run as a real sleep would
+        systemTime.sleep( 0 )
+
+    def wait(self, event, seconds):
+        if event.is_set():
+            return True
+        self.sleep( seconds )
+        return event.is_set()
+
+    async def async_sleep(self, seconds):
+        import asyncio
+        self.sleep( seconds )
+        await asyncio.sleep( 0 )
+
+_clock = SystemClock()
+
+def use_clock( clock ):
+    """[ replace the clock used by waits, backoffs, rate limits and producer intervals ]
+
+    Arguments:
+        clock {[ SystemClock|VirtualClock ]} -- [ new clock ]
+
+    Returns:
+        [ SystemClock|VirtualClock ] -- [ previous clock ]
+    """
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
+
+def time():
+    return _clock.time()
+
+def monotonic():
+    return _clock.monotonic()
+
+def sleep( seconds ):
+    _clock.sleep( seconds )
+
+def wait( event, seconds ):
+    """[ sleep seconds unless event is set meanwhile ]
+
+    Arguments:
+        event {[ threading.Event ]} -- [ event ending the wait ]
+        seconds {[ float ]} -- [ seconds to wait ]
+
+    Returns:
+        [ Boolean ] -- [ event set ? ]
+    """
+    return _clock.wait( event, seconds )
+
+async def async_sleep( seconds ):
+    await _clock.async_sleep( seconds )
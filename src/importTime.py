@@ -0,0 +1,164 @@
+import datetime
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+# python arguments of each measured start, run from the repository root
+TARGETS = {
+    'cli': [ "main.py", "--help" ],
+    'task1': [ "-c", "import src.task1.kinesis" ],
+    'task2': [ "-c", "import src.task2.autoscaling" ],
+    'fleetWorker': [ "-c", "import src.task1.producerFleet" ]
+}
+DEFAULT_RUNS = 5
+DEFAULT_TOP = 8
+IMPORT_TIME_LINE = re.compile( r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)" )
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+def parse_import_time( output ):
+    """[ parse the stderr of python -X importtime ]
+
+    Arguments:
+        output {[String]} -- [ stderr ]
+
+    Returns:
+        [ List<tuple> ] -- [ ( module, self us, cumulative us, depth ) in import order ]
+    """
+    modules = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match( line )
+        if match:
+            selfUs, cumulativeUs, indent, module = match.groups()
+            modules.append( ( module, int( selfUs ), int( cumulativeUs ), ( len( indent ) - 1 ) // 2 ) )
+    return modules
+
+def package_of( module ):
+    """[ group of a module in the breakdown, top level package or src module ]
+
+    Arguments:
+        module {[String]} -- [ module name ]
+
+    Returns:
+        [ String ] -- [ group ]
+    """
+    return module if module.startswith( "src." ) else module.split( "." )[0]
+
+def measure( arguments, runs=DEFAULT_RUNS ):
+    """[ start python -X importtime runs times in fresh interpreters and keep the fastest run ]
+
+    Arguments:
+        arguments {[ List<String> ]} -- [ python arguments, eg. a script or -c code ]
+
+    Keyword Arguments:
+        runs {int} -- [ number of runs ] (default: {DEFAULT_RUNS})
+
+    Returns:
+        [ dict ] -- [ importMs, processMs, modules count and self ms by package ]
+    """
+    best = None
+    for _ in range( runs ):
+        start = time.perf_counter()
+        process = subprocess.run( [ sys.executable, "-X", "importtime" ] + arguments, cwd=ROOT,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE )
+        processMs = ( time.perf_counter() - start ) * 1000
+        modules = parse_import_time( process.stderr.decode( errors="replace" ) )
+        importMs = sum( selfUs for module, selfUs, cumulativeUs, depth in modules ) / 1000
+        if best is None or importMs < best['importMs']:
+            packages = {}
+            for module, selfUs, cumulativeUs, depth in modules:
+                packages[ package_of( module ) ] = packages.get( package_of( module ), 0 ) + selfUs / 1000
+            best = {
+                'importMs': importMs,
+                'processMs': processMs,
+                'modules': len( modules ),
+                'packages': packages
+            }
+    return best
+
+def run_import_benchmark( targets=TARGETS, runs=DEFAULT_RUNS ):
+    """[ measure the import time of each target ]
+
+    Keyword Arguments:
+        targets {[ dict ]} -- [ target name to python arguments ] (default: {TARGETS})
+        runs {int} -- [ runs of each target, the fastest is kept ] (default: {DEFAULT_RUNS})
+
+    Returns:
+        [ dict ] -- [ machine readable report ]
+    """
+    from src.task1.benchmark import current_commit
+
+    return {
+        'commit': current_commit(),
+        'createdAt': datetime.datetime.utcnow().isoformat() + "Z",
+        'python': sys.version.split()[0],
+        'runs': runs,
+        'results': { name: measure( arguments, runs ) for name, arguments in targets.items() }
+    }
+
+def print_report( report, baseline=None, top=DEFAULT_TOP ):
+    """[ print the import time of each target and its slowest packages, with the change against a baseline ]
+
+    Arguments:
+        report {[ dict ]} -- [ report of run_import_benchmark ]
+
+    Keyword Arguments:
+        baseline {[ dict ]} -- [ earlier report to compare with ] (default: {None})
+        top {int} -- [ packages listed per target ] (default: {DEFAULT_TOP})
+    """
+    print( "{:<14} {:>10} {:>11} {:>8}".format( "target", "import ms", "process ms", "modules" ) )
+    for name, result in report['results'].items():
+        line = "{:<14} {:>10.1f} {:>11.1f} {:>8}".format( name, result['importMs'], result['processMs'], result['modules'] )
+        previous = ( baseline or {} ).get('results', {}).get( name )
+        if previous:
+            line += " {:+.1f}% import ms".format( ( result['importMs'] / previous['importMs'] - 1 ) * 100 )
+        print( line )
+        for package, ms in sorted( result['packages'].items(), key=lambda item: -item[1] )[:top]:
+            print( "    {:<34} {:>8.1f}".format( package, ms ) )
+
+def regressions( report, baseline, maxRegression ):
+    """[ targets whose import time grew more than maxRegression percent over the baseline ]
+
+    Arguments:
+        report {[ dict ]} -- [ report of run_import_benchmark ]
+        baseline {[ dict ]} -- [ earlier report ]
+        maxRegression {[ float ]} -- [ allowed growth in percent ]
+
+    Returns:
+        [ List<String> ] -- [ target names ]
+    """
+    slower = []
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get( name )
+        if previous and result['importMs'] > previous['importMs'] * ( 1 + maxRegression / 100 ):
+            slower.append( name )
+    return slower
+
+if __name__ == '__main__':
+    parser = ArgumentParser( description="Import time breakdown of the CLI and of each task, python -X importtime" )
+    parser.add_argument( "--targets", default=",".join( TARGETS ), help="Comma separated targets among {}".format( ", ".join( TARGETS ) ) )
+    parser.add_argument( "--runs", type=int, default=DEFAULT_RUNS, help="Runs of each target, the fastest is kept" )
+    parser.add_argument( "--top", type=int, default=DEFAULT_TOP, help="Slowest packages listed per target" )
+    parser.add_argument( "--output", help="Write the json report to this file" )
+    parser.add_argument( "--baseline", help="Json report of an earlier run to compare with" )
+    parser.add_argument( "--max-regression", type=float, dest="maxRegression",
+        help="Exit with an error when a target imports this many percent slower than the baseline" )
+    args = parser.parse_args()
+
+    report = run_import_benchmark( { name: TARGETS[ name ] for name in args.targets.split( "," ) }, args.runs )
+    baseline = None
+    if args.baseline:
+        with open( args.baseline ) as f:
+            baseline = json.load( f )
+    print_report( report, baseline, args.top )
+    if args.output:
+        with open( args.output, "w" ) as f:
+            json.dump( report, f, indent=2 )
+    if baseline and args.maxRegression is not None:
+        slower = regressions( report, baseline, args.maxRegression )
+        if slower:
+            print( "Import time regression over {}%: {}".format( args.maxRegression, ", ".join( slower ) ) )
+            sys.exit( 1 )
@@ -0,0 +1,297 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.metrics import LatencyHistogram
+
+DEFAULT_DUMP_INTERVAL = 10 # seconds between json dumps
+PROMETHEUS_QUANTILES = [ 0.5, 0.95, 0.99 ]
+START_CONTEXT_KEY = 'instrumentationStartedAt'
+
+class OperationStats:
+    """Counters and latency histogram of one AWS operation"""
+
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.requestBytes = 0
+        self.responseBytes = 0
+        self.errors = {}
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'requestBytes': self.requestBytes,
+            'responseBytes': self.responseBytes,
+            'errors': dict( self.errors ),
+            'latency': self.latency.to_dict()
+        }
+
+def operation_of( eventName ):
+    """[ service and operation of a botocore event name, eg. after-call.kinesis.PutRecords ]
+
+    Arguments:
+        eventName {[String]} -- [ event name ]
+
+    Returns:
+        [ tuple ] -- [ ( service, operation ) ]
+    """
+    parts = eventName.split( "." )
+    return parts[1], parts[2]
+
+def body_size( body ):
+    if body is None:
+        return 0
+    if isinstance( body, ( bytes, bytearray, str ) ):
+        return len( body )
+    try:
+        return os.fstat( body.fileno() ).st_size
+    except Exception:
+        return 0
+
+class Instrumentation:
+    """Per operation metrics of every AWS call, collected through botocore events
+
+    attach registers handlers on a client event system: before-call starts the clock,
+    before-send counts each HTTP attempt and its request bytes, after-call and
+    after-call-error record the latency, retries (ResponseMetadata RetryAttempts),
+    response bytes and error codes. Client creation time is recorded by the registry.
+    Metrics can be printed as a table, served in the Prometheus text format or dumped
+    to a json file periodically"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.clientCreations = {}
+        self.server = None
+        self.dumper = None
+
+    def operation(self, service, operation):
+        key = ( service, operation )
+        with self.lock:
+            stats = self.operations.get( key )
+            if stats is None:
+                stats = self.operations[ key ] = OperationStats()
+            return stats
+
+    def attach(self, client):
+        """[ collect the metrics of a client ]
+
+        Arguments:
+            client {[ botocore.client ]} -- [ client ]
+        """
+        events = client.meta.events
+        events.register( 'before-call.*.*', self.before_call, unique_id='instrumentation-before-call' )
+        events.register( 'before-send.*.*', self.before_send, unique_id='instrumentation-before-send' )
+        events.register( 'after-call.*.*', self.after_call, unique_id='instrumentation-after-call' )
+        events.register( 'after-call-error.*.*', self.after_call_error, unique_id='instrumentation-after-call-error' )
+
+    def before_call(self, context, **kwargs):
+        context[ START_CONTEXT_KEY ] = time.perf_counter()
+
+    def before_send(self, event_name, request, **kwargs):
+        stats = self.operation( *operation_of( event_name ) )
+        size = body_size( request.body )
+        with self.lock:
+            stats.attempts += 1
+            stats.requestBytes += size
+
+    def after_call(self, event_name, http_response, parsed, context, **kwargs):
+        stats = self.operation( *operation_of( event_name ) )
+        startedAt = context.get( START_CONTEXT_KEY )
+        if startedAt is not None:
+            stats.latency.record( time.perf_counter() - startedAt )
+        errorCode = parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None
+        with self.lock:
+            stats.calls += 1
+            stats.retries += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            stats.responseBytes += int( http_response.headers.get('content-length') or 0 )
+            if errorCode:
+                stats.errors[ errorCode ] = stats.errors.get( errorCode, 0 ) + 1
+
+    def after_call_error(self, event_name, exception, context, **kwargs):
+        stats = self.operation( *operation_of( event_name ) )
+        startedAt = context.get( START_CONTEXT_KEY )
+        if startedAt is not None:
+            stats.latency.record( time.perf_counter() - startedAt )
+        errorCode = type( exception ).__name__
+        with self.lock:
+            stats.calls += 1
+            stats.errors[ errorCode ] = stats.errors.get( errorCode, 0 ) + 1
+
+    def client_created(self, service, seconds):
+        """[ record the time spent building a client ]
+
+        Arguments:
+            service {[String]} -- [ service name ]
+            seconds {[ float ]} -- [ creation time ]
+        """
+        with self.lock:
+            count, total = self.clientCreations.get( service, ( 0, 0 ) )
+            self.clientCreations[ service ] = ( count + 1, total + seconds )
+
+    def reset(self):
+        """forget every metric"""
+        with self.lock:
+            self.operations = {}
+            self.clientCreations = {}
+
+    def to_dict(self):
+        """[ every metric, json serializable ]
+
+        Returns:
+            [ dict ] -- [ operations keyed by service.operation and client creations ]
+        """
+        with self.lock:
+            operations = list( self.operations.items() )
+            clientCreations = dict( self.clientCreations )
+        return {
+            'timestamp': time.time(),
+            'operations': { "{}.{}".format( *key ): stats.to_dict() for key, stats in sorted( operations ) },
+            'clients': { service: { 'count': count, 'seconds': total } for service, ( count, total ) in sorted( clientCreations.items() ) }
+        }
+
+    def to_prometheus(self):
+        """[ every metric in the Prometheus text exposition format ]
+
+        Returns:
+            [ String ] -- [ metrics ]
+        """
+        with self.lock:
+            operations = sorted( self.operations.items() )
+            clientCreations = sorted( self.clientCreations.items() )
+        counters = [
+            ( 'aws_api_calls_total', "AWS API calls", 'calls' ),
+            ( 'aws_api_attempts_total', "HTTP attempts of AWS API calls", 'attempts' ),
+            ( 'aws_api_retries_total', "Retries of AWS API calls", 'retries' ),
+            ( 'aws_api_request_bytes_total', "Request body bytes of AWS API calls", 'requestBytes' ),
+            ( 'aws_api_response_bytes_total', "Response body bytes of AWS API calls", 'responseBytes' )
+        ]
+        lines = []
+        for name, description, attribute in counters:
+            lines.append( "# HELP {} {}".format( name, description ) )
+            lines.append( "# TYPE {} counter".format( name ) )
+            for ( service, operation ), stats in operations:
+                lines.append( '{}{{service="{}",operation="{}"}} {}'.format( name, service, operation, getattr( stats, attribute ) ) )
+
+        lines.append( "# HELP aws_api_errors_total AWS API calls which failed, by error code" )
+        lines.append( "# TYPE aws_api_errors_total counter" )
+        for ( service, operation ), stats in operations:
+            for code, count in sorted( stats.errors.items() ):
+                lines.append( 'aws_api_errors_total{{service="{}",operation="{}",code="{}"}} {}'.format( service, operation, code, count ) )
+
+        lines.append( "# HELP aws_api_latency_seconds Latency of AWS API calls, retries included" )
+        lines.append( "# TYPE aws_api_latency_seconds summary" )
+        for ( service, operation ), stats in operations:
+            labels = 'service="{}",operation="{}"'.format( service, operation )
+            for quantile in PROMETHEUS_QUANTILES:
+                value = stats.latency.percentile( quantile * 100 )
+                lines.append( 'aws_api_latency_seconds{{{},quantile="{}"}} {}'.format( labels, quantile, value if value is not None else "NaN" ) )
+            lines.append( 'aws_api_latency_seconds_sum{{{}}} {}'.format( labels, stats.latency.total / 1000000 ) )
+            lines.append( 'aws_api_latency_seconds_count{{{}}} {}'.format( labels, stats.latency.count ) )
+
+        lines.append( "# HELP aws_client_create_seconds_total Time spent building AWS clients" )
+        lines.append( "# TYPE aws_client_create_seconds_total counter" )
+        for service, ( count, total ) in clientCreations:
+            lines.append( 'aws_client_create_seconds_total{{service="{}"}} {}'.format( service, total ) )
+        return "\n".join( lines ) + "\n"
+
+    def serve_prometheus(self, port, host=""):
+        """[ serve the metrics on http://host:port/metrics from a daemon thread ]
+
+        Arguments:
+            port {[ int ]} -- [ port, 0 picks a free one ]
+
+        Keyword Arguments:
+            host {String} -- [ interface ] (default: {all interfaces})
+
+        Returns:
+            [ int ] -- [ port the server listens on ]
+        """
+        instrumentation = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split( "?" )[0] != "/metrics":
+                    self.send_error( 404 )
+                    return
+                body = instrumentation.to_prometheus().encode()
+                self.send_response( 200 )
+                self.send_header( "Content-Type", "text/plain; version=0.0.4" )
+                self.send_header( "Content-Length", str( len( body ) ) )
+                self.end_headers()
+                self.wfile.write( body )
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer( ( host, port ), MetricsHandler )
+        threading.Thread( target=self.server.serve_forever, daemon=True ).start()
+        return self.server.server_address[1]
+
+    def dump_json(self, path):
+        """[ write every metric to a json file, atomically ]
+
+        Arguments:
+            path {[String]} -- [ file path ]
+        """
+        tmpPath = path + ".tmp"
+        with open( tmpPath, "w" ) as f:
+            json.dump( self.to_dict(), f )
+        os.replace( tmpPath, path )
+
+    def start_json_dump(self, path, interval=DEFAULT_DUMP_INTERVAL):
+        """[ dump the metrics to a json file every interval seconds from a daemon thread ]
+
+        Arguments:
+            path {[String]} -- [ file path ]
+
+        Keyword Arguments:
+            interval {int} -- [ seconds between dumps ] (default: {DEFAULT_DUMP_INTERVAL})
+        """
+        stopped = threading.Event()
+
+        def dump():
+            while not stopped.wait( interval ):
+                self.dump_json( path )
+
+        self.dumper = ( threading.Thread( target=dump, daemon=True ), stopped, path )
+        self.dumper[0].start()
+
+    def stop(self):
+        """stop the Prometheus server and the json dump, writing a last dump"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.dumper is not None:
+            thread, stopped, path = self.dumper
+            stopped.set()
+            thread.join()
+            self.dump_json( path )
+            self.dumper = None
+
+    def report(self):
+        """print a summary table of the AWS calls, slowest operations first"""
+        with self.lock:
+            operations = list( self.operations.items() )
+            clientCreations = sorted( self.clientCreations.items() )
+        if not operations:
+            return
+        print( "{:<40} {:>7} {:>7} {:>7} {:>9} {:>9} {:>9} {:>11}".format(
+            "operation", "calls", "retries", "errors", "p50 ms", "p99 ms", "total s", "bytes out" ) )
+        for ( service, operation ), stats in sorted( operations, key=lambda item: -item[1].latency.total ):
+            latency = stats.latency
+            print( "{:<40} {:>7} {:>7} {:>7} {:>9.1f} {:>9.1f} {:>9.2f} {:>11}".format(
+                "{}.{}".format( service, operation ), stats.calls, stats.retries, sum( stats.errors.values() ),
+                ( latency.percentile( 50 ) or 0 ) * 1000, ( latency.percentile( 99 ) or 0 ) * 1000,
+                latency.total / 1000000, stats.requestBytes ) )
+        for service, ( count, total ) in clientCreations:
+            print( "{:<40} {:>7} clients built in {:.2f}s".format( service, count, total ) )
+
+instrumentation = Instrumentation()
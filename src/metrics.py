@@ -0,0 +1,130 @@
+import math
+import threading
+
+DEFAULT_SUB_BUCKET_BITS = 5 # 32 sub buckets per power of two, about 3% relative error
+
+class LatencyHistogram:
+    """HDR style latency histogram
+
+    Latencies are recorded in microseconds into log-linear buckets: each power of two
+    range is split into 2 ** subBucketBits linear sub buckets, so the relative error of
+    every percentile is bounded whatever the magnitude. Recording is thread safe and
+    histograms can be pickled, eg. to merge the histograms of worker processes"""
+
+    def __init__(self, subBucketBits=DEFAULT_SUB_BUCKET_BITS):
+        self.subBucketBits = subBucketBits
+        self.subBuckets = 1 << subBucketBits
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def __getstate__(self):
+        with self.lock:
+            state = self.__dict__.copy()
+            state['buckets'] = dict( self.buckets )
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update( state )
+        self.lock = threading.Lock()
+
+    def bucket_index(self, micros):
+        """[ log-linear bucket of a value ]
+
+        Arguments:
+            micros {[ int ]} -- [ value in microseconds ]
+
+        Returns:
+            [ int ] -- [ bucket index ]
+        """
+        if micros < self.subBuckets:
+            return micros
+        shift = micros.bit_length() - self.subBucketBits - 1
+        return ( shift + 1 ) * self.subBuckets + ( micros >> shift ) - self.subBuckets
+
+    def bucket_upper_bound(self, index):
+        """[ highest value of a bucket in microseconds ]
+
+        Arguments:
+            index {[ int ]} -- [ bucket index ]
+
+        Returns:
+            [ int ] -- [ value in microseconds ]
+        """
+        if index < self.subBuckets:
+            return index
+        shift = index // self.subBuckets - 1
+        return ( ( index % self.subBuckets + self.subBuckets ) << shift ) + ( 1 << shift ) - 1
+
+    def record(self, seconds):
+        """[ record one latency ]
+
+        Arguments:
+            seconds {[ float ]} -- [ latency in seconds ]
+        """
+        micros = max( int( seconds * 1000000 ), 0 )
+        index = self.bucket_index( micros )
+        with self.lock:
+            self.buckets[ index ] = self.buckets.get( index, 0 ) + 1
+            self.count += 1
+            self.total += micros
+            self.min = micros if self.min is None else min( self.min, micros )
+            self.max = micros if self.max is None else max( self.max, micros )
+
+    def merge(self, other):
+        """[ add the values recorded by another histogram ]
+
+        Arguments:
+            other {[ LatencyHistogram ]} -- [ histogram with the same subBucketBits ]
+        """
+        with self.lock:
+            for index, count in other.buckets.items():
+                self.buckets[ index ] = self.buckets.get( index, 0 ) + count
+            self.count += other.count
+            self.total += other.total
+            if other.count:
+                self.min = other.min if self.min is None else min( self.min, other.min )
+                self.max = other.max if self.max is None else max( self.max, other.max )
+
+    def percentile(self, percent):
+        """[ latency at a percentile ]
+
+        Arguments:
+            percent {[ float ]} -- [ percentile between 0 and 100 ]
+
+        Returns:
+            [ float ] -- [ latency in seconds, None when empty ]
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = max( 1, math.ceil( self.count * percent / 100 ) )
+            seen = 0
+            for index in sorted( self.buckets ):
+                seen += self.buckets[ index ]
+                if seen >= rank:
+                    return min( self.bucket_upper_bound( index ), self.max ) / 1000000
+        return self.max / 1000000
+
+    def to_dict(self):
+        """[ summary and raw buckets, json serializable ]
+
+        Returns:
+            [ dict ] -- [ count, mean, min, max, p50, p95, p99 and p999 in seconds, buckets ]
+        """
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count / 1000000 if self.count else None,
+            'min': self.min / 1000000 if self.count else None,
+            'max': self.max / 1000000 if self.count else None,
+            'subBucketBits': self.subBucketBits
+        }
+        for name, percent in ( ( 'p50', 50 ), ( 'p95', 95 ), ( 'p99', 99 ), ( 'p999', 99.9 ) ):
+            summary[ name ] = self.percentile( percent )
+        with self.lock:
+            summary['buckets'] = { str( index ): count for index, count in sorted( self.buckets.items() ) }
+        return summary
@@ -0,0 +1,114 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class ProvisioningGraph:
+    """Runs provisioning steps as a dependency graph
+
+    Each node is an action taking the results of the finished nodes. A node starts as
+    soon as all of its dependencies finished, so independent nodes run concurrently and
+    the total time is bounded by the critical path instead of the sum of all the steps"""
+
+    def __init__(self, maxWorkers=8):
+        self.maxWorkers = maxWorkers
+        self.nodes = {}
+        self.timings = {}
+
+    def add_node(self, name, action, depends=()):
+        """[ add a provisioning step ]
+
+        Arguments:
+            name {[String]} -- [ node name ]
+            action {[ function ]} -- [ called with the dict of results of the finished nodes ]
+
+        Keyword Arguments:
+            depends {[ List<String> ]} -- [ names of the nodes to finish first ] (default: {()})
+        """
+        if name in self.nodes:
+            raise Exception("Duplicated provisioning node {}".format( name ))
+        self.nodes[ name ] = ( action, tuple( depends ) )
+
+    def validate(self):
+        """[ check every dependency exists and the graph has no cycle ]
+
+        Raises:
+            Exception: [ unknown dependency or cycle ]
+        """
+        visiting = set()
+        done = set()
+
+        def visit( name, path ):
+            if name in done:
+                return
+            if name in visiting:
+                raise Exception("Provisioning cycle {}".format( " -> ".join( path + [ name ] ) ))
+            if name not in self.nodes:
+                raise Exception("Unknown provisioning node {} required by {}".format( name, path[-1] ))
+            visiting.add( name )
+            for depend in self.nodes[ name ][1]:
+                visit( depend, path + [ name ] )
+            visiting.discard( name )
+            done.add( name )
+
+        for name in self.nodes:
+            visit( name, [] )
+
+    def run(self):
+        """[ run every node once its dependencies finished, stops starting nodes after the first failure ]
+
+        Raises:
+            Exception: [ first exception raised by a node ]
+
+        Returns:
+            [ dict ] -- [ node name -> result ]
+        """
+        self.validate()
+        results = {}
+        running = {}
+        error = None
+        start = time.time()
+        with ThreadPoolExecutor( self.maxWorkers ) as executor:
+            while True:
+                if error is None:
+                    for name, ( action, depends ) in self.nodes.items():
+                        if name in results or name in running.values():
+                            continue
+                        if all( depend in results for depend in depends ):
+                            self.timings[ name ] = [ time.time() - start, None ]
+                            running[ executor.submit( action, dict( results ) ) ] = name
+                if not running:
+                    break
+
+                finished, _ = wait( running, return_when=FIRST_COMPLETED )
+                for future in finished:
+                    name = running.pop( future )
+                    self.timings[ name ][1] = time.time() - start
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        results[ name ] = future.result()
+
+        if error is not None:
+            raise error
+        return results
+
+    def critical_path(self):
+        """[ chain of nodes which finished last, each waiting for the dependency which finished last ]
+
+        Returns:
+            [ List<String> ] -- [ node names from the first to the last node ]
+        """
+        finished = { name: timing[1] for name, timing in self.timings.items() if timing[1] is not None }
+        if not finished:
+            return []
+        path = [ max( finished, key=finished.get ) ]
+        while True:
+            depends = [ depend for depend in self.nodes[ path[0] ][1] if depend in finished ]
+            if not depends:
+                return path
+            path.insert( 0, max( depends, key=finished.get ) )
+
+    def report(self):
+        """print start and end time of each node and the critical path"""
+        for name, ( started, ended ) in sorted( self.timings.items(), key=lambda item: item[1][0] ):
+            print( "{} {:.2f}s -> {}".format( name, started, "{:.2f}s".format( ended ) if ended is not None else "not finished" ) )
+        print( "critical path: {}".format( " -> ".join( self.critical_path() ) ) )
@@ -0,0 +1,33 @@
+import os
+import string
+
+ALPHANUMERIC = ( string.ascii_uppercase + string.ascii_lowercase + string.digits ).encode()
+# byte -> alphanumeric translation table, the bytes above the last multiple of 62 are
+# deleted so every character stays equally likely
+ALPHANUMERIC_TABLE = bytes( ALPHANUMERIC[ b % len( ALPHANUMERIC ) ] for b in range( 256 ) )
+ALPHANUMERIC_DROP = bytes( range( 256 - 256 % len( ALPHANUMERIC ), 256 ) )
+
+def random_alphanumeric_bytes( length ):
+    """[ generate random alphanumeric bytes from os.urandom in one translate call ]
+    
+    Arguments:
+        length {[number]} -- [ number of bytes ]
+    
+    Returns:
+        [ bytes ] -- [ fix length random alphanumeric ]
+    """
+    out = b''
+    while len( out ) < length:
+        out += os.urandom( length - len( out ) + length // 16 + 8 ).translate( ALPHANUMERIC_TABLE, ALPHANUMERIC_DROP )
+    return out[:length]
+
+def random_alphanumeric(len):
+    """Generate random alphanumeric string based on len
+    
+    Arguments:
+        pass_len {[number]} -- [length of string]
+    
+    Returns:
+        [string] -- [ fix length random alphanumeric ]
+    """
+    return random_alphanumeric_bytes( len ).decode()
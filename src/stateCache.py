@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_STATE_PATH = ".task-state.json"
+
+def template_fingerprint( templateBody ):
+    """[ content hash of a rendered template ]
+
+    Arguments:
+        templateBody {[String]} -- [ rendered template ]
+
+    Returns:
+        [ String ] -- [ sha256 hex digest ]
+    """
+    return hashlib.sha256( templateBody.encode() ).hexdigest()
+
+class StateCache:
+    """Local json cache of provisioned resources, eg. stack outputs and stream ARNs
+
+    Lets a re-run skip create, wait and describe calls of resources which did not change.
+    Entries must be invalidated when their resource is deleted. Without path the cache
+    only lives in memory, for resources which do not outlive the process"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = None
+
+    def load(self):
+        if self.state is None:
+            self.state = {}
+            if self.path and os.path.exists( self.path ):
+                try:
+                    with open( self.path ) as f:
+                        self.state = json.load( f )
+                except ValueError:
+                    print("Ignoring corrupted state cache {}".format( self.path ))
+        return self.state
+
+    def use_path(self, path):
+        """[ switch to another cache file, None keeps the cache in memory ]
+
+        Arguments:
+            path {[String]} -- [ cache file path ]
+
+        Returns:
+            [ String ] -- [ previous path ]
+        """
+        with self.lock:
+            previous = self.path
+            self.path = path
+            self.state = None
+            return previous
+
+    def save(self):
+        if not self.path:
+            return
+        tmpPath = self.path + ".tmp"
+        with open( tmpPath, "w" ) as f:
+            json.dump( self.state, f, default=str )
+        os.replace( tmpPath, self.path )
+
+    def get(self, key):
+        """[ cached value of a resource ]
+
+        Arguments:
+            key {[String]} -- [ resource key eg. stacks/<stackName> ]
+
+        Returns:
+            [ dict ] -- [ cached value or None ]
+        """
+        with self.lock:
+            return self.load().get( key )
+
+    def put(self, key, value):
+        """[ cache a resource ]
+
+        Arguments:
+            key {[String]} -- [ resource key ]
+            value {[ dict ]} -- [ json serializable value ]
+        """
+        with self.lock:
+            self.load()[ key ] = value
+            self.save()
+
+    def invalidate(self, key):
+        """[ forget a resource ]
+
+        Arguments:
+            key {[String]} -- [ resource key ]
+        """
+        with self.lock:
+            if self.load().pop( key, None ) is not None:
+                self.save()
+
+stateCache = StateCache()
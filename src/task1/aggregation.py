@@ -0,0 +1,274 @@
+import hashlib
+from src import clock
+
+# KPL aggregated record format
+# https://github.com/awslabs/amazon-kinesis-producer/blob/master/aggregation-format.md
+#
+#   magic bytes | protobuf AggregatedRecord | md5 of the protobuf body
+#
+#   message AggregatedRecord {
+#       repeated string partition_key_table = 1;
+#       repeated string explicit_hash_key_table = 2;
+#       repeated Record records = 3;
+#   }
+#   message Record {
+#       required uint64 partition_key_index = 1;
+#       optional uint64 explicit_hash_key_index = 2;
+#       required bytes data = 3;
+#       repeated Tag tags = 4;
+#   }
+#
+# the protobuf messages are small enough to be encoded by hand without a protobuf dependency
+
+MAGIC = b'\xf3\x89\x9a\xc2'
+DIGEST_SIZE = 16
+MAX_AGGREGATED_SIZE = 1024 * 1024 # kinesis limit of data + partition key of one record
+
+WIRE_VARINT = 0
+WIRE_64BIT = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_32BIT = 5
+
+def encode_varint( value ):
+    """[ protobuf base 128 varint ]
+
+    Arguments:
+        value {[ int ]} -- [ unsigned value ]
+
+    Returns:
+        [ bytes ] -- [ encoded varint ]
+    """
+    out = bytearray()
+    while value > 0x7f:
+        out.append( ( value & 0x7f ) | 0x80 )
+        value >>= 7
+    out.append( value )
+    return bytes( out )
+
+def decode_varint( buffer, pos ):
+    """[ decode a protobuf varint ]
+
+    Arguments:
+        buffer {[ bytes ]} -- [ encoded message ]
+        pos {[ int ]} -- [ offset of the varint ]
+
+    Returns:
+        [ tuple ] -- [ ( value, offset after the varint ) ]
+    """
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len( buffer ):
+            raise ValueError("Truncated varint")
+        byte = buffer[ pos ]
+        pos += 1
+        value |= ( byte & 0x7f ) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def encode_field( fieldNumber, value ):
+    """[ encode a varint ( int ) or length delimited ( bytes ) protobuf field ]
+
+    Arguments:
+        fieldNumber {[ int ]} -- [ protobuf field number ]
+        value {[ int|bytes ]} -- [ field value ]
+
+    Returns:
+        [ bytes ] -- [ encoded field ]
+    """
+    if isinstance( value, int ):
+        return encode_varint( fieldNumber << 3 | WIRE_VARINT ) + encode_varint( value )
+    return encode_varint( fieldNumber << 3 | WIRE_LENGTH_DELIMITED ) + encode_varint( len( value ) ) + value
+
+def iter_fields( buffer ):
+    """[ iterate over the fields of a protobuf message ]
+
+    Arguments:
+        buffer {[ bytes ]} -- [ encoded message ]
+
+    Yields:
+        [ tuple ] -- [ ( field number, int or bytes value ) ]
+    """
+    pos = 0
+    while pos < len( buffer ):
+        key, pos = decode_varint( buffer, pos )
+        fieldNumber, wireType = key >> 3, key & 0x7
+        if wireType == WIRE_VARINT:
+            value, pos = decode_varint( buffer, pos )
+        elif wireType == WIRE_LENGTH_DELIMITED:
+            length, pos = decode_varint( buffer, pos )
+            value = buffer[ pos:pos + length ]
+            if len( value ) != length:
+                raise ValueError("Truncated field {}".format( fieldNumber ))
+            pos += length
+        elif wireType == WIRE_64BIT:
+            value, pos = buffer[ pos:pos + 8 ], pos + 8
+        elif wireType == WIRE_32BIT:
+            value, pos = buffer[ pos:pos + 4 ], pos + 4
+        else:
+            raise ValueError("Unsupported wire type {}".format( wireType ))
+        yield fieldNumber, value
+
+class RecordAggregator:
+    """Packs user records into one KPL aggregated kinesis record
+
+    Partition keys and explicit hash keys are stored once in the key tables and referenced
+    by index from each record. The kinesis record goes out with the partition key and
+    explicit hash key of the first user record, so all the user records of one aggregator
+    should be routed to the same shard"""
+
+    def __init__(self, maxSize=MAX_AGGREGATED_SIZE):
+        self.maxSize = maxSize
+        self.clear()
+
+    def clear(self):
+        """drop all the buffered user records"""
+        self.partitionKeys = {}
+        self.explicitHashKeys = {}
+        self.pieces = []
+        self.records = []
+        self.size = len( MAGIC ) + DIGEST_SIZE
+        self.firstPartitionKey = None
+        self.firstExplicitHashKey = None
+        self.startedAt = None
+
+    def __len__(self):
+        return len( self.records )
+
+    def encoded_record(self, partitionKey, data, explicitHashKey):
+        """[ encode a user record and the key table entries it adds ]
+
+        Returns:
+            [ tuple ] -- [ ( new key table pieces, record piece ) ]
+        """
+        pieces = []
+        partitionKeyIndex = self.partitionKeys.get( partitionKey )
+        if partitionKeyIndex is None:
+            partitionKeyIndex = len( self.partitionKeys )
+            pieces.append( ( 'partitionKeys', partitionKey, encode_field( 1, partitionKey.encode() ) ) )
+
+        record = encode_field( 1, partitionKeyIndex )
+        if explicitHashKey is not None:
+            explicitHashKeyIndex = self.explicitHashKeys.get( explicitHashKey )
+            if explicitHashKeyIndex is None:
+                explicitHashKeyIndex = len( self.explicitHashKeys )
+                pieces.append( ( 'explicitHashKeys', explicitHashKey, encode_field( 2, explicitHashKey.encode() ) ) )
+            record += encode_field( 2, explicitHashKeyIndex )
+        record += encode_field( 3, data )
+        return pieces, encode_field( 3, record )
+
+    def add_user_record(self, partitionKey, data, explicitHashKey=None):
+        """[ add a user record, returns the full aggregated record when this record does not fit anymore ]
+
+        Arguments:
+            partitionKey {[String]} -- [ partition key ]
+            data {[String|bytes]} -- [ record data ]
+
+        Keyword Arguments:
+            explicitHashKey {[String]} -- [ explicit hash key ] (default: {None})
+
+        Returns:
+            [ dict ] -- [ put_record(s) entry of the full aggregated record or None ]
+        """
+        if isinstance( data, str ):
+            data = data.encode()
+        pieces, record = self.encoded_record( partitionKey, data, explicitHashKey )
+        size = sum( len( piece[2] ) for piece in pieces ) + len( record )
+
+        full = None
+        if self.records and self.size + size + len( self.firstPartitionKey.encode() ) > self.maxSize:
+            full = self.clear_and_get()
+            pieces, record = self.encoded_record( partitionKey, data, explicitHashKey )
+            size = sum( len( piece[2] ) for piece in pieces ) + len( record )
+
+        if not self.records:
+            self.firstPartitionKey = partitionKey
+            self.firstExplicitHashKey = explicitHashKey
+            self.startedAt = clock.time()
+        for table, key, piece in pieces:
+            keys = getattr( self, table )
+            keys[ key ] = len( keys )
+            self.pieces.append( piece )
+        self.records.append( record )
+        self.size += size
+        return full
+
+    def clear_and_get(self):
+        """[ serialize the buffered user records and clear the aggregator ]
+
+        Returns:
+            [ dict ] -- [ put_record(s) entry or None when empty ]
+        """
+        if not self.records:
+            return None
+        body = b''.join( self.pieces ) + b''.join( self.records )
+        entry = {
+            'Data': MAGIC + body + hashlib.md5( body ).digest(),
+            'PartitionKey': self.firstPartitionKey
+        }
+        if self.firstExplicitHashKey is not None:
+            entry['ExplicitHashKey'] = self.firstExplicitHashKey
+        self.clear()
+        return entry
+
+def is_aggregated( data ):
+    """[ check magic bytes and md5 trailer of a kinesis record ]
+
+    Arguments:
+        data {[ bytes ]} -- [ kinesis record data ]
+
+    Returns:
+        [ Boolean ] -- [ is KPL aggregated record ]
+    """
+    if len( data ) < len( MAGIC ) + DIGEST_SIZE or not data.startswith( MAGIC ):
+        return False
+    body = data[ len( MAGIC ):-DIGEST_SIZE ]
+    return hashlib.md5( body ).digest() == data[ -DIGEST_SIZE: ]
+
+def deaggregate( data ):
+    """[ unpack a KPL aggregated record, data which is not aggregated is returned as the only user record ]
+
+    Arguments:
+        data {[ bytes ]} -- [ kinesis record data ]
+
+    Returns:
+        [ List<dict> ] -- [ user records with Data, PartitionKey and ExplicitHashKey ]
+    """
+    if not is_aggregated( data ):
+        return [ { 'Data': data, 'PartitionKey': None, 'ExplicitHashKey': None } ]
+
+    partitionKeys = []
+    explicitHashKeys = []
+    records = []
+    for fieldNumber, value in iter_fields( data[ len( MAGIC ):-DIGEST_SIZE ] ):
+        if fieldNumber == 1:
+            partitionKeys.append( value.decode() )
+        elif fieldNumber == 2:
+            explicitHashKeys.append( value.decode() )
+        elif fieldNumber == 3:
+            records.append( dict( iter_fields( value ) ) )
+
+    return [ {
+        'Data': record.get( 3, b'' ),
+        'PartitionKey': partitionKeys[ record[1] ],
+        'ExplicitHashKey': explicitHashKeys[ record[2] ] if 2 in record else None
+    } for record in records ]
+
+def deaggregate_record( record ):
+    """[ unpack a get_records record into its user records ]
+
+    Arguments:
+        record {[ dict ]} -- [ get_records record ]
+
+    Returns:
+        [ List<dict> ] -- [ user records with SequenceNumber and SubSequenceNumber ]
+    """
+    userRecords = deaggregate( record['Data'] )
+    for subSequenceNumber, userRecord in enumerate( userRecords ):
+        userRecord['SequenceNumber'] = record['SequenceNumber']
+        userRecord['SubSequenceNumber'] = subSequenceNumber
+        if userRecord['PartitionKey'] is None:
+            userRecord['PartitionKey'] = record.get('PartitionKey')
+        userRecord['ApproximateArrivalTimestamp'] = record.get('ApproximateArrivalTimestamp')
+    return userRecords
@@ -0,0 +1,113 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src import clock
+from src.clients import get_client
+from src.task1.kinesisProducer import KinesisProducer
+from src.task1.rateControl import IDLE_POLL_INTERVAL
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+class AsyncKinesisProducer(KinesisProducer):
+    """asyncio engine for KinesisProducer
+
+    Keeps up to maxInFlight put_record(s) requests in flight over one shared client
+    instead of waiting for each request before producing the next record. When the
+    limit is reached producing blocks until a request completes (backpressure).
+    boto3 is blocking so the requests run on a thread pool sized to maxInFlight and
+    the client connection pool is sized the same way.
+
+    run and stop behave as in KinesisProducer, without sleepInterval the records are
+    produced back to back"""
+
+    def __init__(self, streamName, sleepInterval=None, maxInFlight=DEFAULT_MAX_IN_FLIGHT, **kwargs):
+        if 'kinesisClient' not in kwargs:
+            kwargs['kinesisClient'] = get_client('kinesis', maxPoolConnections=maxInFlight )
+        super().__init__( streamName, sleepInterval, **kwargs )
+        self.maxInFlight = maxInFlight
+        self.requests = []
+        self.pending = set()
+        self.errors = []
+
+    def send_record(self, entry, attempt=0):
+        self.requests.append( functools.partial( KinesisProducer.send_record, self, entry, attempt ) )
+
+    def send_batch(self, entries, attempts=None):
+        self.requests.append( functools.partial( self.put_records_with_retry, entries, attempts ) )
+
+    def request_done(self, future):
+        """release the in flight slot of a finished request"""
+        self.pending.discard( future )
+        self.inFlight.release()
+        if not future.cancelled() and future.exception():
+            self.errors.append( future.exception() )
+
+    async def submit_requests(self):
+        """start the queued requests, waiting for a free in flight slot for each"""
+        requests = self.requests
+        self.requests = []
+        for request in requests:
+            await self.inFlight.acquire()
+            future = self.loop.run_in_executor( self.executor, request )
+            self.pending.add( future )
+            future.add_done_callback( self.request_done )
+
+    async def pace(self, size):
+        """[ wait before producing the next record, without blocking the completion of requests ]
+
+        Arguments:
+            size {[ int ]} -- [ bytes of the record just produced ]
+        """
+        if not self.rateController:
+            await clock.async_sleep( self.sleepInterval or 0 )
+            return
+        delay = self.rateController.reserve( size )
+        while delay is None:
+            await clock.async_sleep( IDLE_POLL_INTERVAL )
+            delay = self.rateController.reserve( size )
+        await clock.async_sleep( delay )
+
+    async def drain(self):
+        """wait for the requests in flight and send the deferred records as their shards get ready"""
+        while True:
+            if self.throttle:
+                self.send_deferred()
+            self.flush_batch()
+            await self.submit_requests()
+            # requests which completed meanwhile may have deferred their records again
+            nextReadyAt = self.next_ready_at() if self.throttle else None
+            if not self.pending and nextReadyAt is None:
+                return
+            timeout = None if nextReadyAt is None else max( nextReadyAt - clock.time(), 0 )
+            if self.pending:
+                await asyncio.wait( self.pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED )
+            else:
+                await clock.async_sleep( timeout )
+
+    async def run_async(self):
+        """produce totalTimes records keeping up to maxInFlight requests in flight"""
+        self.loop = asyncio.get_running_loop()
+        self.inFlight = asyncio.Semaphore( self.maxInFlight )
+        with ThreadPoolExecutor( self.maxInFlight ) as self.executor:
+            while self.totalTimes > 0 and not self.errors:
+                size = self.put_record()
+                self.flush_if_lingering()
+                await self.submit_requests()
+                await self.pace( size )
+                self.totalTimes = self.totalTimes - 1
+            self.flush()
+            await self.drain()
+        if self.errors:
+            raise self.errors[0]
+
+    def run(self):
+        """run the producer"""
+        self.startedAt = time.time()
+        try:
+            asyncio.run( self.run_async() )
+        except Exception as e:
+            print( e )
+            print('Unexpected stream {} exception. Exiting'.format(self.streamName))
+        finally:
+            self.finishedAt = time.time()
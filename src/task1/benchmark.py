@@ -0,0 +1,245 @@
+import datetime
+import json
+import logging
+import os
+import subprocess
+import time
+import uuid
+from argparse import ArgumentParser
+
+from src.clients import get_client
+from src.metrics import LatencyHistogram
+from src.waiter import waiter
+from src.task1.asyncKinesisProducer import AsyncKinesisProducer, DEFAULT_MAX_IN_FLIGHT
+from src.task1.kinesis import check_kinesis_stream_ready
+from src.task1.kinesisProducer import KinesisProducer, MAX_RECORDS_PER_REQUEST
+from src.task1.payloadGenerator import PayloadGenerator
+
+MODES = [ "single", "batched", "threaded", "async" ]
+DEFAULT_THREADS = 4
+# next is the path of paced and single record producers, batch the one of producers sending batches back to back,
+# no producer uses ringBatch, which only copies pre-generated bodies
+PAYLOAD_PATHS = [ "next", "batch", "ringBatch" ]
+PAYLOAD_COUNT = 200000
+
+def start_moto_server():
+    """[ start an in process moto server as local kinesis stand-in ]
+
+    Raises:
+        Exception: [ moto is not installed ]
+
+    Returns:
+        [ tuple ] -- [ ( server, endpoint url ) ]
+    """
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise Exception("moto[server] is required to benchmark against moto, or pass --endpoint of localstack")
+    os.environ.setdefault( 'AWS_ACCESS_KEY_ID', 'benchmark' )
+    os.environ.setdefault( 'AWS_SECRET_ACCESS_KEY', 'benchmark' )
+    logging.getLogger( 'werkzeug' ).setLevel( logging.ERROR )
+    server = ThreadedMotoServer( ip_address="127.0.0.1", port=0, verbose=False )
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, "http://{}:{}".format( host, port )
+
+def create_benchmark_stream( kinesisClient, mode, shardCount ):
+    """[ create a throwaway stream for one mode and wait for it ]
+
+    Arguments:
+        kinesisClient {[ botocore.client ]} -- [ kinesis client ]
+        mode {[String]} -- [ producer mode ]
+        shardCount {[ int ]} -- [ number of shards ]
+
+    Returns:
+        [ String ] -- [ stream name ]
+    """
+    streamName = "benchmark{}{}".format( mode.capitalize(), uuid.uuid4().hex[:8] )
+    kinesisClient.create_stream( StreamName=streamName, ShardCount=shardCount )
+    if not waiter.wait( kinesisClient.describe_stream, check_kinesis_stream_ready, StreamName=streamName ).ready:
+        raise Exception("Fails to create benchmark stream {}".format( streamName ))
+    return streamName
+
+def create_producers( mode, streamName, kinesisClient, records, payloadSize, latency, threads, maxInFlight ):
+    """[ producers of a mode, putting records back to back ]
+
+    Returns:
+        [ List<KinesisProducer> ] -- [ producers sharing the latency histogram ]
+    """
+    options = dict( kinesisClient=kinesisClient, verbose=False, latency=latency )
+    if mode == "single":
+        return [ KinesisProducer( streamName, 0, totalTimes=records, payloads=PayloadGenerator( payloadSize ), **options ) ]
+    if mode == "batched":
+        return [ KinesisProducer( streamName, 0, totalTimes=records, payloads=PayloadGenerator( payloadSize ),
+            batchSize=MAX_RECORDS_PER_REQUEST, **options ) ]
+    if mode == "threaded":
+        return [ KinesisProducer( streamName, 0, totalTimes=records // threads + ( 1 if index < records % threads else 0 ),
+            payloads=PayloadGenerator( payloadSize ), **options ) for index in range( threads ) ]
+    if mode == "async":
+        return [ AsyncKinesisProducer( streamName, 0, maxInFlight=maxInFlight, totalTimes=records,
+            payloads=PayloadGenerator( payloadSize ), **options ) ]
+    raise Exception("Unknown benchmark mode {}".format( mode ))
+
+def run_mode( mode, endpointUrl, records, payloadSize, shardCount, threads, maxInFlight ):
+    """[ benchmark one producer mode on its own stream ]
+
+    Returns:
+        [ dict ] -- [ records/s, bytes/s and request latency histogram ]
+    """
+    kinesisClient = get_client( 'kinesis', endpointUrl=endpointUrl, maxPoolConnections=max( threads, maxInFlight ) )
+    streamName = create_benchmark_stream( kinesisClient, mode, shardCount )
+    latency = LatencyHistogram()
+    producers = create_producers( mode, streamName, kinesisClient, records, payloadSize, latency, threads, maxInFlight )
+    try:
+        start = time.time()
+        if len( producers ) == 1:
+            producers[0].run()
+        else:
+            for producer in producers:
+                producer.start()
+            for producer in producers:
+                producer.join()
+        seconds = time.time() - start
+    finally:
+        kinesisClient.delete_stream( StreamName=streamName )
+
+    sentRecords = sum( producer.sentRecords for producer in producers )
+    sentBytes = sum( producer.sentBytes for producer in producers )
+    return {
+        'records': sentRecords,
+        'failedRecords': sum( producer.failedRecords for producer in producers ),
+        'bytes': sentBytes,
+        'seconds': seconds,
+        'recordsPerSecond': sentRecords / seconds,
+        'bytesPerSecond': sentBytes / seconds,
+        'latency': latency.to_dict()
+    }
+
+def payload_rates( payloadSize, count=PAYLOAD_COUNT, batchSize=MAX_RECORDS_PER_REQUEST ):
+    """[ payloads generated per second by each PayloadGenerator path, without putting them ]
+
+    Arguments:
+        payloadSize {[ int ]} -- [ bytes of each payload ]
+
+    Keyword Arguments:
+        count {int} -- [ payloads generated by each path ] (default: {PAYLOAD_COUNT})
+        batchSize {int} -- [ payloads of each batch call ] (default: {MAX_RECORDS_PER_REQUEST})
+
+    Returns:
+        [ dict ] -- [ payloads/s of next, batch and batch on a ring buffer ]
+    """
+    rates = {}
+    for path in PAYLOAD_PATHS:
+        generator = PayloadGenerator( payloadSize, ringSize=batchSize if path == "ringBatch" else 0 )
+        start = time.perf_counter()
+        if path == "next":
+            generated = count
+            for _ in range( count ):
+                generator.next()
+        else:
+            generated = count // batchSize * batchSize
+            for _ in range( count // batchSize ):
+                generator.batch( batchSize )
+        rates[ path ] = generated / ( time.perf_counter() - start )
+    return rates
+
+def current_commit():
+    """[ git commit of the benchmarked tree ]
+
+    Returns:
+        [ String ] -- [ commit hash or None outside of a git checkout ]
+    """
+    try:
+        return subprocess.check_output( [ "git", "rev-parse", "HEAD" ], stderr=subprocess.DEVNULL ).decode().strip()
+    except Exception:
+        return None
+
+def run_benchmark( modes=MODES, endpointUrl=None, records=1000, payloadSize=10, shardCount=1, threads=DEFAULT_THREADS, maxInFlight=DEFAULT_MAX_IN_FLIGHT ):
+    """[ benchmark producer modes against a local kinesis stand-in ]
+
+    Keyword Arguments:
+        modes {[ List<String> ]} -- [ modes among single, batched, threaded and async ] (default: {MODES})
+        endpointUrl {[String]} -- [ kinesis endpoint, an in process moto server when None ] (default: {None})
+        records {int} -- [ records put by each mode ] (default: {1000})
+        payloadSize {int} -- [ bytes of each payload ] (default: {10})
+        shardCount {int} -- [ shards of each benchmark stream ] (default: {1})
+        threads {int} -- [ producer threads of the threaded mode ] (default: {DEFAULT_THREADS})
+        maxInFlight {int} -- [ in flight requests of the async mode ] (default: {DEFAULT_MAX_IN_FLIGHT})
+
+    Returns:
+        [ dict ] -- [ machine readable report ]
+    """
+    server = None
+    if endpointUrl is None:
+        server, endpointUrl = start_moto_server()
+    try:
+        results = { mode: run_mode( mode, endpointUrl, records, payloadSize, shardCount, threads, maxInFlight ) for mode in modes }
+        payloads = payload_rates( payloadSize )
+    finally:
+        if server is not None:
+            server.stop()
+
+    return {
+        'commit': current_commit(),
+        'createdAt': datetime.datetime.utcnow().isoformat() + "Z",
+        'endpoint': "moto" if server is not None else endpointUrl,
+        'parameters': {
+            'records': records,
+            'payloadSize': payloadSize,
+            'shardCount': shardCount,
+            'threads': threads,
+            'maxInFlight': maxInFlight
+        },
+        'results': results,
+        'payloadsPerSecond': payloads
+    }
+
+def print_report( report, baseline=None ):
+    """[ print a benchmark report, with the change against a baseline report ]
+
+    Arguments:
+        report {[ dict ]} -- [ report of run_benchmark ]
+
+    Keyword Arguments:
+        baseline {[ dict ]} -- [ earlier report to compare with ] (default: {None})
+    """
+    print( "{:<10} {:>12} {:>14} {:>10} {:>10} {:>10}".format( "mode", "records/s", "bytes/s", "p50 ms", "p95 ms", "p99 ms" ) )
+    for mode, result in report['results'].items():
+        latency = result['latency']
+        line = "{:<10} {:>12.0f} {:>14.0f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            mode, result['recordsPerSecond'], result['bytesPerSecond'],
+            ( latency['p50'] or 0 ) * 1000, ( latency['p95'] or 0 ) * 1000, ( latency['p99'] or 0 ) * 1000 )
+        previous = ( baseline or {} ).get('results', {}).get( mode )
+        if previous:
+            line += " {:+.1f}% records/s".format( ( result['recordsPerSecond'] / previous['recordsPerSecond'] - 1 ) * 100 )
+        print( line )
+    print( "{:<10} {:>12}".format( "payloads", "payloads/s" ) )
+    for path, rate in report.get( 'payloadsPerSecond', {} ).items():
+        line = "{:<10} {:>12.0f}".format( path, rate )
+        previous = ( baseline or {} ).get('payloadsPerSecond', {}).get( path )
+        if previous:
+            line += " {:+.1f}% payloads/s".format( ( rate / previous - 1 ) * 100 )
+        print( line )
+
+if __name__ == '__main__':
+    parser = ArgumentParser( description="Benchmark KinesisProducer modes against a local kinesis stand-in" )
+    parser.add_argument( "--modes", default=",".join( MODES ), help="Comma separated modes among {}".format( ", ".join( MODES ) ) )
+    parser.add_argument( "--endpoint", help="Kinesis endpoint eg. localstack http://localhost:4568, default starts an in process moto server" )
+    parser.add_argument( "--records", type=int, default=1000, help="Records put by each mode" )
+    parser.add_argument( "--payload-size", type=int, default=10, dest="payloadSize", help="Bytes of each payload" )
+    parser.add_argument( "--shards", type=int, default=1, help="Shards of each benchmark stream" )
+    parser.add_argument( "--threads", type=int, default=DEFAULT_THREADS, help="Producer threads of the threaded mode" )
+    parser.add_argument( "--in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, dest="inFlight", help="In flight requests of the async mode" )
+    parser.add_argument( "--output", help="Write the json report to this file" )
+    parser.add_argument( "--baseline", help="Json report of an earlier run to compare with" )
+    args = parser.parse_args()
+
+    report = run_benchmark( args.modes.split( "," ), args.endpoint, args.records, args.payloadSize, args.shards, args.threads, args.inFlight )
+    baseline = None
+    if args.baseline:
+        with open( args.baseline ) as f:
+            baseline = json.load( f )
+    print_report( report, baseline )
+    if args.output:
+        with open( args.output, "w" ) as f:
+            json.dump( report, f, indent=2 )
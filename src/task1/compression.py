@@ -0,0 +1,333 @@
+import threading
+import time
+import zlib
+from argparse import ArgumentParser
+
+CODECS = [ "none", "gzip", "zstd" ]
+DEFAULT_LEVELS = { 'none': 0, 'gzip': 6, 'zstd': 3 }
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_WBITS = 31 # zlib window bits of a gzip member
+DEFAULT_CHUNK_SIZE = 16 * 1024 # compressed bytes read at once from a stream, bounds the decompressed chunks
+# firehose CompressionFormat of the S3 objects. Firehose can not decompress records nor write zstd, records
+# compressed by the producer are written as they are: concatenated gzip members or zstd frames are
+# themselves a gzip or zstd object, so only raw records are left to firehose to compress
+S3_FORMATS = [ "UNCOMPRESSED", "GZIP" ]
+
+def zstandard_module():
+    """[ the optional zstandard package ]
+
+    Raises:
+        Exception: [ zstandard is not installed ]
+
+    Returns:
+        [ module ] -- [ zstandard ]
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("The zstd codec needs the zstandard package: pipenv install zstandard")
+    return zstandard
+
+def firehose_format( codec="none", s3Compression=None ):
+    """[ firehose CompressionFormat matching the records of a producer codec ]
+
+    Arguments:
+        codec {[String]} -- [ producer codec of CODECS ]
+
+    Keyword Arguments:
+        s3Compression {[String]} -- [ format of S3_FORMATS asked for, UNCOMPRESSED when None ] (default: {None})
+
+    Raises:
+        Exception: [ firehose asked to compress records which are already compressed ]
+
+    Returns:
+        [ String ] -- [ CompressionFormat ]
+    """
+    s3Compression = s3Compression or "UNCOMPRESSED"
+    if s3Compression not in S3_FORMATS:
+        raise Exception("Unknown S3 compression {}, expect one of {}".format( s3Compression, ", ".join( S3_FORMATS ) ))
+    if codec != "none" and s3Compression != "UNCOMPRESSED":
+        raise Exception("Records compressed with {} are delivered as a {} object, firehose must not compress them again".format( codec, codec ))
+    return s3Compression
+
+def codec_of( data ):
+    """[ codec of a frame, from its magic bytes ]
+
+    Arguments:
+        data {[ bytes ]} -- [ record data or start of an object ]
+
+    Returns:
+        [ String ] -- [ gzip | zstd, None for raw data ]
+    """
+    if data[ :2 ] == GZIP_MAGIC:
+        return "gzip"
+    if data[ :4 ] == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+def decompressor( codec ):
+    """[ decompressor of one gzip member or zstd frame ]
+
+    Arguments:
+        codec {[String]} -- [ gzip | zstd ]
+
+    Returns:
+        [ object ] -- [ decompressobj with decompress, eof and unused_data ]
+    """
+    if codec == "zstd":
+        return zstandard_module().ZstdDecompressor().decompressobj()
+    return zlib.decompressobj( GZIP_WBITS )
+
+def decompress_stream( chunks ):
+    """[ decompress a stream of concatenated frames, raw streams are passed through ]
+
+    Arguments:
+        chunks {[ iterable<bytes> ]} -- [ chunks of the stream, eg. StreamingBody.iter_chunks() ]
+
+    Returns:
+        [ generator<bytes> ] -- [ decompressed chunks ]
+    """
+    chunks = iter( chunks )
+    first = b""
+    for first in chunks:
+        if first:
+            break
+    codec = codec_of( first )
+    if codec is None:
+        if first:
+            yield first
+        yield from chunks
+        return
+    current = decompressor( codec )
+    pending = first
+    while True:
+        while pending:
+            out = current.decompress( pending )
+            if out:
+                yield out
+            if not current.eof:
+                break
+            # next frame, eg. the next record of a firehose object
+            pending = current.unused_data
+            current = decompressor( codec )
+        pending = next( chunks, None )
+        if pending is None:
+            return
+
+def decompress_frames( chunks ):
+    """[ decompress a stream of concatenated frames one whole frame at a time, eg. to deaggregate each record ]
+
+    Arguments:
+        chunks {[ iterable<bytes> ]} -- [ chunks of the stream, eg. StreamingBody.iter_chunks() ]
+
+    Raises:
+        Exception: [ the stream is not made of gzip or zstd frames ]
+
+    Returns:
+        [ generator<bytes> ] -- [ decompressed frames ]
+    """
+    chunks = iter( chunks )
+    pending = b""
+    for pending in chunks:
+        if pending:
+            break
+    if not pending:
+        return
+    codec = codec_of( pending )
+    if codec is None:
+        raise Exception("The stream is not made of gzip or zstd frames")
+    current = decompressor( codec )
+    frame = []
+    while True:
+        while pending:
+            frame.append( current.decompress( pending ) )
+            if not current.eof:
+                break
+            yield b"".join( frame )
+            frame = []
+            pending = current.unused_data
+            current = decompressor( codec )
+        pending = next( chunks, None )
+        if pending is None:
+            return
+
+def decompress_record( data ):
+    """[ decompress the data of a record framed by a Codec, other data is returned as it is ]
+
+    Arguments:
+        data {[ bytes ]} -- [ record data ]
+
+    Returns:
+        [ bytes ] -- [ record data ]
+    """
+    if codec_of( data ) is None:
+        return data
+    try:
+        return b"".join( decompress_stream( [ data ] ) )
+    except Exception:
+        # raw data which happens to start with a magic
+        return data
+
+def iter_lines( chunks ):
+    """[ split a stream into lines without their newline ]
+
+    Arguments:
+        chunks {[ iterable<bytes> ]} -- [ chunks of the stream ]
+
+    Returns:
+        [ generator<bytes> ] -- [ lines ]
+    """
+    remainder = b""
+    for chunk in chunks:
+        lines = ( remainder + chunk ).split( b"\n" )
+        remainder = lines.pop()
+        yield from lines
+    if remainder:
+        yield remainder
+
+class Codec:
+    """Compresses kinesis records into self contained frames and accounts for the cost
+
+    gzip frames are gzip members and zstd frames zstd frames, so each record decompresses
+    on its own (see decompress_record) and concatenated records, eg. a firehose S3 object,
+    form a valid gzip or zstd stream (see decompress_stream). Small records compress poorly,
+    the frames pay off on KPL aggregated records, one frame per aggregated batch. The ratio
+    is compressed over raw bytes, the CPU time is the compressing thread time"""
+
+    def __init__(self, name="gzip", level=None):
+        if name not in CODECS:
+            raise Exception("Unknown codec {}, expect one of {}".format( name, ", ".join( CODECS ) ))
+        self.name = name
+        self.level = DEFAULT_LEVELS[ name ] if level is None else level
+        self.compressor = zstandard_module().ZstdCompressor( level=self.level ) if name == "zstd" else None
+        self.frames = 0
+        self.rawBytes = 0
+        self.compressedBytes = 0
+        self.cpuSeconds = 0.0
+        self.lock = threading.Lock()
+
+    def compress(self, data):
+        """[ compress data into one frame ]
+
+        Arguments:
+            data {[ bytes ]} -- [ record data ]
+
+        Returns:
+            [ bytes ] -- [ frame, data as it is for the none codec ]
+        """
+        with self.lock:
+            start = time.thread_time()
+            if self.name == "gzip":
+                compressor = zlib.compressobj( self.level, zlib.DEFLATED, GZIP_WBITS )
+                frame = compressor.compress( data ) + compressor.flush()
+            elif self.name == "zstd":
+                frame = self.compressor.compress( data )
+            else:
+                frame = data
+            self.cpuSeconds += time.thread_time() - start
+            self.frames += 1
+            self.rawBytes += len( data )
+            self.compressedBytes += len( frame )
+        return frame
+
+    @property
+    def ratio(self):
+        return self.compressedBytes / self.rawBytes if self.rawBytes else 1.0
+
+    def report(self):
+        """print the compression ratio and the CPU time it cost"""
+        mebibytes = self.rawBytes / 1024 / 1024
+        print( "{} level {}: {} frames {} -> {} bytes, ratio {:.3f}, {:.1f}ms CPU, {:.1f}ms CPU per MiB".format(
+            self.name, self.level, self.frames, self.rawBytes, self.compressedBytes, self.ratio,
+            self.cpuSeconds * 1000, self.cpuSeconds * 1000 / mebibytes if mebibytes else 0 ) )
+
+def compare_codecs( frames, codecs=CODECS, levels=None ):
+    """[ compress the same frames with each codec ]
+
+    Arguments:
+        frames {[ List<bytes> ]} -- [ record data, eg. KPL aggregated records ]
+
+    Keyword Arguments:
+        codecs {[ List<String> ]} -- [ codecs to compare, unavailable ones are skipped ] (default: {CODECS})
+        levels {[ dict ]} -- [ codec name to list of levels, DEFAULT_LEVELS when None ] (default: {None})
+
+    Returns:
+        [ List<Codec> ] -- [ codecs with their stats ]
+    """
+    results = []
+    for name in codecs:
+        for level in ( levels or {} ).get( name, [ DEFAULT_LEVELS[ name ] ] ):
+            try:
+                codec = Codec( name, level )
+            except Exception as e:
+                print( e )
+                continue
+            for frame in frames:
+                codec.compress( frame )
+            results.append( codec )
+    return results
+
+def print_comparison( codecs ):
+    """[ print the ratio against the CPU cost of each codec ]
+
+    Arguments:
+        codecs {[ List<Codec> ]} -- [ codecs of compare_codecs ]
+    """
+    print( "{:<6} {:>5} {:>8} {:>13} {:>12}".format( "codec", "level", "ratio", "CPU ms/MiB", "saved/CPU s" ) )
+    for codec in codecs:
+        mebibytes = codec.rawBytes / 1024 / 1024
+        saved = ( codec.rawBytes - codec.compressedBytes ) / 1024 / 1024
+        print( "{:<6} {:>5} {:>8.3f} {:>13.1f} {:>12}".format( codec.name, codec.level, codec.ratio,
+            codec.cpuSeconds * 1000 / mebibytes if mebibytes else 0,
+            "{:.1f}MiB".format( saved / codec.cpuSeconds ) if codec.cpuSeconds and saved else "-" ) )
+
+def sample_frames( records, payloadSize=100, aggregate=False, inputPath=None ):
+    """[ record data as the producer would send it, to compare codecs offline ]
+
+    Arguments:
+        records {[ int ]} -- [ number of user records ]
+
+    Keyword Arguments:
+        payloadSize {int} -- [ bytes of each random payload ] (default: {100})
+        aggregate {bool} -- [ pack the records into KPL aggregated records ] (default: {False})
+        inputPath {String} -- [ take the lines of this file instead of random payloads ] (default: {None})
+
+    Returns:
+        [ List<bytes> ] -- [ frames ]
+    """
+    from src.task1.aggregation import RecordAggregator
+    from src.task1.lineSource import LineSource
+    from src.task1.payloadGenerator import PayloadGenerator
+
+    payloads = LineSource( inputPath ) if inputPath else PayloadGenerator( payloadSize, header=True, delimiter=b"\n" )
+    frames = []
+    aggregator = RecordAggregator()
+    for _ in range( records ):
+        data = payloads.next()
+        if data is None:
+            break
+        if not aggregate:
+            frames.append( data )
+            continue
+        entry = aggregator.add_user_record( "8.8.8.8", data )
+        if entry:
+            frames.append( entry['Data'] )
+    if aggregate and len( aggregator ):
+        frames.append( aggregator.clear_and_get()['Data'] )
+    return frames
+
+if __name__ == '__main__':
+    parser = ArgumentParser( description="Compression ratio against CPU time of each codec on task1 records" )
+    parser.add_argument( "--records", type=int, default=10000, help="User records compressed" )
+    parser.add_argument( "--payload-size", type=int, default=100, dest="payloadSize", help="Bytes of each random payload" )
+    parser.add_argument( "--aggregate", action="store_true", help="Compress KPL aggregated records, one frame per batch" )
+    parser.add_argument( "--input", dest="inputPath", help="Compress the lines of this file instead of random payloads" )
+    parser.add_argument( "--levels", help="Levels to compare, eg. gzip=1:6:9,zstd=1:3:19" )
+    args = parser.parse_args()
+
+    levels = None
+    if args.levels:
+        levels = { name: [ int( level ) for level in spec.split( ":" ) ]
+            for name, spec in ( item.split( "=" ) for item in args.levels.split( "," ) ) }
+    print_comparison( compare_codecs( sample_frames( args.records, args.payloadSize, args.aggregate, args.inputPath ), levels=levels ) )
@@ -0,0 +1,177 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src import clock
+from src.clients import get_client
+from src.metrics import LatencyHistogram
+from src.waiter import Waiter
+from src.task1.payloadGenerator import parse_header
+from src.task1.aggregation import deaggregate
+from src.task1.compression import decompress_frames, decompress_stream, iter_lines, DEFAULT_CHUNK_SIZE
+
+DEFAULT_PREFIX = "firehose/"
+DEFAULT_FETCH_WORKERS = 8
+DEFAULT_VERIFY_TIMEOUT = 300 # seconds, firehose buffers up to IntervalInSeconds before writing to S3
+
+class DeliveryVerifier:
+    """Checks that the records of a producer reached the firehose S3 destination
+
+    Lists the prefix incrementally, each poll only pages through the keys after the last
+    key seen (StartAfter), so polling a bucket with many objects stays cheap. New objects are
+    fetched in parallel and read line by line from the response stream, never whole in memory.
+    Each line is matched by the sequence number and emission time in its header (see
+    PayloadGenerator header and delimiter), giving the delivery completeness and the produce
+    to S3 latency: object LastModified minus emission time, so within a second and subject to
+    the clock skew between producer and S3. Objects compressed by firehose or made of records
+    compressed by the producer (see Codec) are decompressed on the fly. With aggregated set
+    the objects are made of KPL aggregated records each compressed into its own frame, every
+    frame is deaggregated before its user records are matched"""
+
+    def __init__(self, bucket, prefix=DEFAULT_PREFIX, s3Client=None, fetchWorkers=DEFAULT_FETCH_WORKERS, aggregated=False):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.aggregated = aggregated
+        self.s3Client = s3Client or get_client('s3', maxPoolConnections=fetchWorkers )
+        self.fetchWorkers = fetchWorkers
+        self.startAfter = None
+        self.sequenceNumbers = set()
+        self.duplicates = 0
+        self.unmatchedLines = 0
+        self.objects = 0
+        self.bytes = 0
+        self.objectBytes = 0
+        self.latency = LatencyHistogram()
+        self.lock = threading.Lock()
+
+    def list_new_objects(self):
+        """[ keys written after the last listed key ]
+
+        Returns:
+            [ List<String> ] -- [ new object keys in listing order ]
+        """
+        keys = []
+        kwargs = { 'Bucket': self.bucket, 'Prefix': self.prefix }
+        if self.startAfter:
+            kwargs['StartAfter'] = self.startAfter
+        for page in self.s3Client.get_paginator('list_objects_v2').paginate( **kwargs ):
+            keys.extend( content['Key'] for content in page.get('Contents', []) )
+        if keys:
+            self.startAfter = keys[-1]
+        return keys
+
+    def lines(self, body):
+        """[ lines of a delivered object, the user records of each frame when aggregated ]
+
+        Arguments:
+            body {[ StreamingBody ]} -- [ get_object Body ]
+
+        Returns:
+            [ generator<bytes> ] -- [ lines without their newline ]
+        """
+        chunks = body.iter_chunks( DEFAULT_CHUNK_SIZE )
+        if not self.aggregated:
+            yield from iter_lines( decompress_stream( chunks ) )
+            return
+        for frame in decompress_frames( chunks ):
+            for userRecord in deaggregate( frame ):
+                yield from iter_lines( [ userRecord['Data'] ] )
+
+    def fetch(self, key):
+        """[ stream one delivered object and match its records ]
+
+        Arguments:
+            key {[String]} -- [ object key ]
+
+        Returns:
+            [ int ] -- [ number of records matched ]
+        """
+        res = self.s3Client.get_object( Bucket=self.bucket, Key=key )
+        deliveredAt = res['LastModified'].timestamp()
+        matched = 0
+        size = 0
+        for line in self.lines( res['Body'] ):
+            size += len( line ) + 1
+            header = parse_header( line )
+            if header is None:
+                with self.lock:
+                    self.unmatchedLines += 1 if line else 0
+                continue
+            sequenceNumber, emittedAt = header
+            self.latency.record( max( deliveredAt - emittedAt, 0 ) )
+            with self.lock:
+                if sequenceNumber in self.sequenceNumbers:
+                    self.duplicates += 1
+                else:
+                    self.sequenceNumbers.add( sequenceNumber )
+                    matched += 1
+        with self.lock:
+            self.objects += 1
+            self.bytes += size
+            self.objectBytes += res['ContentLength']
+        return matched
+
+    def poll(self, executor=None):
+        """[ list and fetch the new objects ]
+
+        Keyword Arguments:
+            executor {[ ThreadPoolExecutor ]} -- [ pool fetching the objects, a new one when None ] (default: {None})
+
+        Returns:
+            [ int ] -- [ number of new records ]
+        """
+        keys = self.list_new_objects()
+        if not keys:
+            return 0
+        if executor is None:
+            with ThreadPoolExecutor( self.fetchWorkers ) as executor:
+                return sum( executor.map( self.fetch, keys ) )
+        return sum( executor.map( self.fetch, keys ) )
+
+    def verify(self, expected, timeout=DEFAULT_VERIFY_TIMEOUT):
+        """[ poll until expected records were delivered ]
+
+        Arguments:
+            expected {[ int ]} -- [ number of records the producer put ]
+
+        Keyword Arguments:
+            timeout {int} -- [ seconds to wait for the delivery ] (default: {DEFAULT_VERIFY_TIMEOUT})
+
+        Returns:
+            [ bool ] -- [ True when every record was delivered ]
+        """
+        deadline = clock.time() + timeout
+        delays = Waiter( firstDelay=1, maxDelay=10 ).delays()
+        with ThreadPoolExecutor( self.fetchWorkers ) as executor:
+            while True:
+                self.poll( executor )
+                if len( self.sequenceNumbers ) >= expected:
+                    return True
+                if clock.time() >= deadline:
+                    return False
+                clock.sleep( min( next( delays ), max( deadline - clock.time(), 0 ) ) )
+
+    def missing(self, sequenceNumbers):
+        """[ sequence numbers which were not delivered ]
+
+        Arguments:
+            sequenceNumbers {[ iterable ]} -- [ sequence numbers put, eg. range( records ) ]
+
+        Returns:
+            [ List<int> ] -- [ missing sequence numbers ]
+        """
+        return [ sequenceNumber for sequenceNumber in sequenceNumbers if sequenceNumber not in self.sequenceNumbers ]
+
+    def report(self, expected=None):
+        """[ print the delivery completeness and latency ]
+
+        Keyword Arguments:
+            expected {[ int ]} -- [ number of records put ] (default: {None})
+        """
+        delivered = len( self.sequenceNumbers )
+        completeness = " of {} ({:.1f}%)".format( expected, delivered * 100 / expected ) if expected else ""
+        print( "s3://{}/{} delivered {} records{} in {} objects, {} duplicates, {} unmatched lines".format(
+            self.bucket, self.prefix, delivered, completeness, self.objects, self.duplicates, self.unmatchedLines ) )
+        if self.bytes:
+            print( "s3 objects {} bytes for {} bytes of records, ratio {:.3f}".format( self.objectBytes, self.bytes, self.objectBytes / self.bytes ) )
+        if self.latency.count:
+            print( "produce to s3 latency p50 {:.1f}s p95 {:.1f}s p99 {:.1f}s max {:.1f}s".format(
+                self.latency.percentile( 50 ), self.latency.percentile( 95 ), self.latency.percentile( 99 ), self.latency.max / 1000000 ) )
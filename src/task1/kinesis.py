@@ -1,48 +1,51 @@
-import sys, os, random, string
-from troposphere import Base64, FindInMap, GetAtt, Join, Output, Select, GetAZs
-from troposphere import Parameter, Ref, Tags, Template
-from troposphere.firehose import (
-    BufferingHints,
-    KinesisStreamSourceConfiguration,
-    CopyCommand,
-    DeliveryStream,
-    S3DestinationConfiguration
-)
+from troposphere import Output, Ref, Template
 
-from argparse import ArgumentParser
-import boto3
-import time
+from src.clients import get_client
+from src.waiter import WaitFatalError, DEFAULT_WAIT_TIMEOUT
+from src.stateCache import stateCache
 from src.task1.kinesisProducer import KinesisProducer
+from src.provisioning import ProvisioningGraph
+from src.task1.asyncKinesisProducer import AsyncKinesisProducer, DEFAULT_MAX_IN_FLIGHT
+from src.task1.kinesisConsumer import KinesisConsumer
+from src.task1.payloadGenerator import PayloadGenerator, HEADER_SIZE, MIN_HEADER_PAYLOAD_SIZE
+from src.task1.lineSource import LineSource
+from src.task1.compression import Codec, firehose_format
+from src.task1.rateControl import RateController, parse_profile
+from src.task1.producerFleet import ProducerFleet
+from src.task1.shardThrottle import ShardThrottle
+from src.task1.deliveryVerifier import DeliveryVerifier
+from src.task1.shardRouter import ShardRouter
+from src.metrics import LatencyHistogram
 from src.utils import (
-    get_or_create_kinesis_stream_resource,
     create_s3_bucket_resource,
     create_role_resource,
     create_root_Policy,
     create_firehose_delivery_stream_resource,
     wait_resource,
-    check_s3_bucket_has_content,
-    wait_for_s3_bucket_has_content
+    deploy_cloudformation_stack,
+    get_cloudformation_stack_output
 )
 
-def get_or_create_kinesis_cloudformation_stack( projectName, kinesisStreamArn ):
-    """[create or get the cloudformation stack based on the project name 
-        TODO: for somehow kinesisStream cloudformation snippet fails on xml parse
-        have to create it outside of stack
-    ]
+DEFAULT_SLEEP_INTERVAL = 0.2 # seconds between two puts of the task1 producer without rate or profile
+
+def create_kinesis_cloudformation_template( projectName, kinesisStreamArn, s3bucket=None, deliveryRole=None, rootPolicy=None, compressionFormat="UNCOMPRESSED",
+                                            bufferingHints=None ):
+    """[ render the task1 template of S3 bucket, delivery role, policy and firehose delivery stream ]
     
     Arguments:
         projectName {[String]} -- [ project name ]
         kinesisStreamArn {[String]} -- [ kinesisStream Arn ]
     
-    Raises:
-        Exception: [ timeout or unexpected exception ]
+    Keyword Arguments:
+        s3bucket {[troposphere.resource]} -- [ already rendered bucket resource ] (default: {None})
+        deliveryRole {[troposphere.resource]} -- [ already rendered role resource ] (default: {None})
+        rootPolicy {[troposphere.resource]} -- [ already rendered policy resource of deliveryRole ] (default: {None})
+        compressionFormat {String} -- [ firehose CompressionFormat of the S3 objects ] (default: {"UNCOMPRESSED"})
+        bufferingHints {[ dict ]} -- [ firehose BufferingHints, see utils.DEFAULT_BUFFERING_HINTS ] (default: {None})
     
     Returns:
-        [ dict ] -- [ describe stack information ]
+        [ troposphere.Template ] -- [ task1 template ]
     """
-
-    cloudformationClient=boto3.client('cloudformation', endpoint_url='http://localhost:4581', region_name='us-west-2' )
-
     t = Template()
 
     t.set_version('2010-09-09')
@@ -51,11 +54,11 @@ def get_or_create_kinesis_cloudformation_stack( projectName, kinesisStreamArn ):
 
     # kinesisStream = get_or_create_kinesis_stream_resource( projectName + "kinesisStream" )
 
-    bucketName=projectName + "s3bucketStream"
-    s3bucket = create_s3_bucket_resource( projectName + "s3bucketStream")
-    deliveryRole = create_role_resource( projectName+"deliveryRole")
-    rootPolicy = create_root_Policy( projectName + "rootPolicy", [ Ref(deliveryRole)] )
-    fireHoseDelivery = create_firehose_delivery_stream_resource( projectName + "fireHoseDelivery", rootPolicy, kinesisStreamArn, s3bucket, deliveryRole )
+    s3bucket = s3bucket or create_s3_bucket_resource( projectName + "s3bucketStream")
+    deliveryRole = deliveryRole or create_role_resource( projectName+"deliveryRole")
+    rootPolicy = rootPolicy or create_root_Policy( projectName + "rootPolicy", [ Ref(deliveryRole)] )
+    fireHoseDelivery = create_firehose_delivery_stream_resource( projectName + "fireHoseDelivery", rootPolicy, kinesisStreamArn, s3bucket, deliveryRole,
+        compressionFormat, bufferingHints )
 
     t.add_resource( s3bucket )
     t.add_resource( rootPolicy )
@@ -76,24 +79,33 @@ def get_or_create_kinesis_cloudformation_stack( projectName, kinesisStreamArn ):
     #     Description="Name of kinesis Stream"
     # ))
 
-    stackName=projectName+'Task1'
+    return t
 
-    try:
-        task1_stack=cloudformationClient.create_stack(
-            StackName=stackName,
-            TemplateBody=t.to_yaml()
-        )
-    except Exception as e:
-        # TODO: check other exceptions
-        pass
+def get_or_create_kinesis_cloudformation_stack( projectName, kinesisStreamArn, template=None ):
+    """[create or get the cloudformation stack based on the project name 
+        TODO: for somehow kinesisStream cloudformation snippet fails on xml parse
+        have to create it outside of stack
+    ]
+    
+    Arguments:
+        projectName {[String]} -- [ project name ]
+        kinesisStreamArn {[String]} -- [ kinesisStream Arn ]
+    
+    Keyword Arguments:
+        template {[troposphere.Template]} -- [ already rendered task1 template ] (default: {None})
+    
+    Raises:
+        Exception: [ timeout or unexpected exception ]
+    
+    Returns:
+        [ dict ] -- [ describe stack information ]
+    """
 
-    stackReady=wait_resource( cloudformationClient.describe_stacks, check_cloudformation_stack_complete, 10, StackName=stackName )
+    t = template or create_kinesis_cloudformation_template( projectName, kinesisStreamArn )
 
-    if stackReady:
-        res = cloudformationClient.describe_stacks( StackName=stackName )
-        return res['Stacks'][0]
-    else:
-        raise Exception("Fails to get recently created stack, try to wait for more time")
+    stackName=projectName+'Task1'
+
+    return deploy_cloudformation_stack( stackName, t.to_yaml() )
 
 def check_kinesis_stream_ready( kinesisResponse ):
     """[ helper function for checking kinesis resource activate ]
@@ -101,96 +113,242 @@ def check_kinesis_stream_ready( kinesisResponse ):
     Arguments:
         kinesisResponse {[kinesis Response]} -- [ Response of aws describe_stream ]
     
+    Raises:
+        WaitFatalError: [ stream is being deleted ]
+
     Returns:
         [ Boolean ] -- [ is kinesis ready ]
     """
     description = kinesisResponse.get('StreamDescription')
     status = description.get('StreamStatus')
 
+    if status == "DELETING":
+        raise WaitFatalError("Stream {} is being deleted".format( description.get('StreamName') ))
     return status == "ACTIVE"
 
-def check_cloudformation_stack_complete( cloudformationRespose ):
-    """[ cloudformation stack complete checker ]
-    
-    Arguments:
-        cloudformationRespose {[ dict ]} -- [ cloudformation describe stack response ]
-    
-    Returns:
-        [Boolean] -- [ is cloudformation complete ]
-    """
-
-    stacks = cloudformationRespose.get('Stacks')
-    status = stacks[0].get('StackStatus')
-    return status == "CREATE_COMPLETE"
-
-def get_or_create_kinesis_stream( name ):
+def get_or_create_kinesis_stream( name, shardCount=1 ):
     """[ create or get kinesis stream using boto3 by name ]
     
     Arguments:
         name {[ String ]} -- [ name ]
+
+    Keyword Arguments:
+        shardCount {int} -- [ number of shards of a newly created stream ] (default: {1})
     
     Raises:
         Exception: [ timeout or unexpected exception ]
     
     Returns:
-        [ dict ] -- [ StreamDescription ]
+        [ dict ] -- [ StreamDescription, from the state cache when the stream was already created and still exists ]
     """
-    kinesisClient = boto3.client('kinesis', endpoint_url='http://localhost:4568', region_name='us-west-2')
-
     streamName = name+"KinesisStream"
+    kinesisClient = get_client('kinesis')
+    cached = stateCache.get( "streams/" + streamName )
+    if cached:
+        try:
+            kinesisClient.describe_stream_summary( StreamName=streamName )
+            return cached
+        except kinesisClient.exceptions.ResourceNotFoundException:
+            # the cache outlives backends which do not persist resources, eg. a restarted localstack
+            print("Stream {} of the state cache no longer exists, provisioning it again".format( streamName ))
+            stateCache.invalidate( "streams/" + streamName )
+            stateCache.invalidate( "stacks/" + name + "Task1" )
     try:
         kinesisClient.create_stream(
             StreamName=streamName,
-            ShardCount=1
+            ShardCount=shardCount
         )
-    except Exception as e:
-        # TODO: check other exceptions
+    except kinesisClient.exceptions.ResourceInUseException:
+        # the stream already exists, eg. created by a previous run
         pass
 
-    kinesisReady=wait_resource( kinesisClient.describe_stream, check_kinesis_stream_ready, 10, StreamName=streamName )
+    kinesisReady=wait_resource( kinesisClient.describe_stream, check_kinesis_stream_ready, DEFAULT_WAIT_TIMEOUT, StreamName=streamName )
 
     if kinesisReady:
         res = kinesisClient.describe_stream( StreamName=streamName )
+        stateCache.put( "streams/" + streamName, res['StreamDescription'] )
         return res['StreamDescription']
     else:
         raise Exception("Fails to get recently created stream, try to wait for more time")
 
-def task1_kinesis( projectName , totalTimes=10 ):
+def run_task1_producer( kinesis, totalTimes=10, batchSize=None, engine="thread", maxInFlight=DEFAULT_MAX_IN_FLIGHT, consume=False, aggregate=False,
+                        payloadSize=10, rate=None, rateUnit="records", profile=None, workers=1, header=False, inputPath=None, compression="none",
+                        sleepInterval=DEFAULT_SLEEP_INTERVAL, verbose=True ):
+    """[ put random data or the lines of an input to the stream, optionally reading it back with a KinesisConsumer ]
+
+    Arguments:
+        kinesis {[ dict ]} -- [ StreamDescription ]
+
+    Keyword Arguments:
+        see task1_kinesis
+
+    Returns:
+        [ KinesisProducer|ProducerFleet ] -- [ finished producer, or fleet with more than one worker ]
+    """
+    kinesisClient = get_client('kinesis')
+    if consume:
+        consumer = KinesisConsumer( kinesis['StreamName'], kinesisClient=kinesisClient )
+        consumer.start()
+    if inputPath and workers > 1:
+        raise Exception("An input is read by a single producer, run it without workers")
+    if workers > 1:
+        producer = ProducerFleet( kinesis, workers, totalTimes, engine=engine, maxInFlight=maxInFlight, batchSize=batchSize,
+            aggregate=aggregate, payloadSize=payloadSize, rate=rate, rateUnit=rateUnit, profile=profile, header=header, compression=compression )
+        producer.run()
+        producer.report()
+    else:
+        producer = run_task1_single_producer( kinesis, kinesisClient, totalTimes, batchSize, engine, maxInFlight, aggregate,
+            payloadSize, rate, rateUnit, profile, header, inputPath, compression, sleepInterval, verbose )
+    if inputPath:
+        totalTimes = producer.payloads.records
+    if consume:
+        if not consumer.wait_until_caught_up( totalTimes - producer.failedRecords, 10 ):
+            print("Consumer did not catch up with stream {}".format( kinesis['StreamName'] ))
+        consumer.stop()
+        consumer.report()
+    return producer
+
+def run_task1_single_producer( kinesis, kinesisClient, totalTimes, batchSize, engine, maxInFlight, aggregate, payloadSize, rate, rateUnit, profile, header,
+                               inputPath=None, compression="none", sleepInterval=DEFAULT_SLEEP_INTERVAL, verbose=True ):
+    """[ put random data or the lines of an input to the stream from this process, see run_task1_producer ]
+
+    Returns:
+        [ KinesisProducer ] -- [ finished producer ]
+    """
+    router = ShardRouter( kinesisClient, kinesis['StreamName'], description=kinesis )
+    if inputPath:
+        # the whole input is replayed back to back, or at the pace of the rate controller
+        payloads = LineSource( inputPath ).start()
+        totalTimes = float( "inf" )
+        sleepInterval = 0
+        verbose = False
+    else:
+        payloads = PayloadGenerator( payloadSize, header=header, delimiter=b"\n" if header else b"" )
+    throttle = ShardThrottle()
+    codec = Codec( compression ) if compression != "none" else None
+    rateController = None
+    if rate or profile:
+        rateController = RateController( parse_profile( profile, rate ), rateUnit )
+    if engine == "async":
+        producer = AsyncKinesisProducer(kinesis['StreamName'], sleepInterval, maxInFlight=maxInFlight, totalTimes=totalTimes, batchSize=batchSize, router=router, aggregate=aggregate,
+            payloads=payloads, rateController=rateController, throttle=throttle, verbose=verbose, codec=codec, latency=LatencyHistogram() )
+    else:
+        producer = KinesisProducer(kinesis['StreamName'], sleepInterval, totalTimes=totalTimes, batchSize=batchSize, router=router, aggregate=aggregate,
+            payloads=payloads, rateController=rateController, throttle=throttle, verbose=verbose, codec=codec, latency=LatencyHistogram() )
+    try:
+        producer.run()
+    finally:
+        if inputPath:
+            payloads.close()
+    router.report()
+    throttle.report()
+    if inputPath:
+        payloads.report()
+    if codec:
+        codec.report()
+    return producer
+
+def task1_kinesis( projectName , totalTimes=10, batchSize=None, shardCount=1, engine="thread", maxInFlight=DEFAULT_MAX_IN_FLIGHT, consume=False, aggregate=False,
+                   waitForDelivery=True, payloadSize=10, rate=None, rateUnit="records", profile=None, workers=1, verify=False, inputPath=None,
+                   compression="none", s3Compression=None, bufferingHints=None, sleepInterval=DEFAULT_SLEEP_INTERVAL, verbose=True ):
     """[ 
-            tesk1 scripts 1. provision kinesis 2. put random data to it 
-            TODO: firehose seems not working, as s3 have no content
+            tesk1 scripts 1. provision kinesis 2. put random data to it 3. optionally verify the S3 delivery
     ]
 
+    Provisioning runs as a dependency graph: the stream and the template resources start
+    together, the delivery stream stack starts once the stream is active and the producer
+    starts once the stream is active, while the stack is still being created.
+
     Arguments:
         projectName {[type]} -- [description]
+
+    Keyword Arguments:
+        totalTimes {int} -- [ number of records to put ] (default: {10})
+        batchSize {int} -- [ send records with put_records in batches of batchSize ] (default: {None})
+        shardCount {int} -- [ number of shards, records are spread over them with ExplicitHashKey ] (default: {1})
+        engine {String} -- [ producer engine thread | async ] (default: {"thread"})
+        maxInFlight {int} -- [ requests kept in flight by the async engine ] (default: {DEFAULT_MAX_IN_FLIGHT})
+        consume {bool} -- [ read the stream back with a KinesisConsumer and report the lag ] (default: {False})
+        aggregate {bool} -- [ pack records into KPL aggregated records ] (default: {False})
+        waitForDelivery {bool} -- [ start producing only once the delivery stream exists, firehose reads the stream
+            from LATEST so earlier records never reach S3. False produces as soon as the stream exists ] (default: {True})
+        payloadSize {int} -- [ bytes of each random payload ] (default: {10})
+        rate {float} -- [ target rate in rateUnit per second instead of a put every sleepInterval ] (default: {None})
+        rateUnit {String} -- [ records | bytes ] (default: {"records"})
+        profile {String} -- [ load profile spec, see rateControl.parse_profile ] (default: {None})
+        workers {int} -- [ producer processes, each writing to its slice of the hash key space ] (default: {1})
+        verify {bool} -- [ put payloads with sequence number headers and check that firehose delivered each of
+            them to S3, implies waitForDelivery ] (default: {False})
+        inputPath {String} -- [ put the lines of this file, pipe or - for stdin instead of totalTimes random
+            payloads, back to back unless rate or profile is set ] (default: {None})
+        compression {String} -- [ codec compressing each kinesis record none | gzip | zstd, see compression.Codec ] (default: {"none"})
+        s3Compression {String} -- [ firehose CompressionFormat UNCOMPRESSED | GZIP of raw records, records compressed
+            by the producer are delivered as a gzip or zstd object ] (default: {None})
+        bufferingHints {[ dict ]} -- [ firehose IntervalInSeconds and / or SizeInMBs, see utils.DEFAULT_BUFFERING_HINTS ] (default: {None})
+        sleepInterval {float} -- [ seconds between two puts without rate or profile ] (default: {DEFAULT_SLEEP_INTERVAL})
+        verbose {bool} -- [ print every put of a single producer ] (default: {True})
+
+    Raises:
+        Exception: [ verify of an input, its lines carry no sequence number header, verify of payloads smaller than
+            their header, verify of uncompressed
+            aggregated records, or firehose compressing records already compressed ]
+
+    Returns:
+        [ dict ] -- [ result of each provisioning node ]
     """
+    if verify and inputPath:
+        raise Exception("Input lines carry no sequence number header, they can not be verified")
+    if verify and payloadSize < MIN_HEADER_PAYLOAD_SIZE:
+        raise Exception("Verified payloads carry a {} byte header, use a payload size of at least {}".format( HEADER_SIZE, MIN_HEADER_PAYLOAD_SIZE ))
+    if verify and aggregate and compression == "none":
+        raise Exception("Aggregated records are only delimited in S3 when each is compressed into its own frame, verify them with a compression")
+    compressionFormat = firehose_format( compression, s3Compression )
+
+    graph = ProvisioningGraph()
+    graph.add_node( "stream", lambda results: get_or_create_kinesis_stream( projectName, shardCount ) )
 
-    kinesis = get_or_create_kinesis_stream( projectName )
-    task1_stack=get_or_create_kinesis_cloudformation_stack( projectName, kinesis['StreamARN'])
-    # print( task1_stack )
-    outputs = task1_stack.get("Outputs")
-    bucketName = outputs[0].get("OutputValue")
-    producer = KinesisProducer(kinesis['StreamName'], 0.2, totalTimes=totalTimes )
-    producer.run()
+    def create_delivery_stream( results ):
+        # the bucket, role and policy resources are only rendered into the template, the stack deploy creates them
+        streamArn = results["stream"]['StreamARN']
+        template = create_kinesis_cloudformation_template( projectName, streamArn, compressionFormat=compressionFormat, bufferingHints=bufferingHints )
+        return get_or_create_kinesis_cloudformation_stack( projectName, streamArn, template )
 
-    # wait_for_s3_bucket_has_content( bucketName ) # FIXME: #4 fireHoseDelivery not working
+    graph.add_node( "deliveryStream", create_delivery_stream, depends=[ "stream" ] )
+    graph.add_node( "producer", lambda results: run_task1_producer( results["stream"], totalTimes, batchSize, engine, maxInFlight, consume, aggregate,
+        payloadSize, rate, rateUnit, profile, workers, verify, inputPath, compression, sleepInterval, verbose ),
+        depends=[ "stream", "deliveryStream" ] if waitForDelivery or verify else [ "stream" ] )
+
+    def verify_delivery( results ):
+        verifier = DeliveryVerifier( get_cloudformation_stack_output( results["deliveryStream"], "BucketName" ), aggregated=aggregate )
+        expected = totalTimes - results["producer"].failedRecords
+        if not verifier.verify( expected ):
+            print("Firehose did not deliver every record of {} to S3".format( projectName ))
+        verifier.report( expected )
+        return verifier
+
+    if verify:
+        graph.add_node( "verify", verify_delivery, depends=[ "producer", "deliveryStream" ] )
+
+    results = graph.run()
+    graph.report()
+    return results
 
 def clean_up_kinesis( name ):
-    """[ Clean up kinesis stream resource ]
+    """[ start the deletion of the kinesis stream of a project, see src.teardown to delete and wait for every resource of a project ]
     
     Arguments:
-        name {[type]} -- [description]
+        name {[String]} -- [ project name ]
     """
-    kinesisClient = boto3.client('kinesis', endpoint_url='http://localhost:4568', region_name='us-west-2')
+    kinesisClient = get_client('kinesis')
 
     streamName = name+"KinesisStream"
+    stateCache.invalidate( "streams/" + streamName )
     try:
         kinesisClient.delete_stream(
-            StreamName=streamName,
-            ShardCount=1
+            StreamName=streamName
         )
-    except Exception as e:
-        # TODO: check other exceptions
+    except kinesisClient.exceptions.ResourceNotFoundException:
+        # already deleted
         pass
 
 
@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+import time
+from src import clock
+from src.clients import get_client
+from src.task1.aggregation import deaggregate_record
+from src.task1.compression import decompress_record
+
+DEFAULT_MIN_POLL_INTERVAL = 0.2 # seconds between get_records calls while records keep coming
+DEFAULT_MAX_POLL_INTERVAL = 5 # upper bound of the poll interval of an idle shard
+GET_RECORDS_LIMIT = 1000
+
+class FileCheckpointer:
+    """Keeps the last processed sequence number of each shard in a local json file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.checkpoints = {}
+        if os.path.exists( path ):
+            with open( path ) as f:
+                self.checkpoints = json.load( f )
+
+    def get(self, shardId):
+        """[ last checkpointed sequence number of a shard ]
+
+        Arguments:
+            shardId {[String]} -- [ shard id ]
+
+        Returns:
+            [ String ] -- [ sequence number or None ]
+        """
+        with self.lock:
+            return self.checkpoints.get( shardId )
+
+    def save(self, shardId, sequenceNumber):
+        """[ checkpoint a shard, the file is replaced atomically so a crash never leaves it half written ]
+
+        Arguments:
+            shardId {[String]} -- [ shard id ]
+            sequenceNumber {[String]} -- [ last processed sequence number ]
+        """
+        with self.lock:
+            self.checkpoints[ shardId ] = sequenceNumber
+            tmpPath = self.path + ".tmp"
+            with open( tmpPath, "w" ) as f:
+                json.dump( self.checkpoints, f )
+            os.replace( tmpPath, self.path )
+
+class ShardReader(threading.Thread):
+    """Reads one shard with get_records
+
+    KPL aggregated records are unpacked so processRecord and the counts see user records.
+    The poll interval doubles while the shard is idle, up to maxPollInterval, and drops
+    back to minPollInterval as soon as records arrive"""
+
+    def __init__(self, consumer, shardId):
+        self.consumer = consumer
+        self.shardId = shardId
+        self.records = 0
+        self.bytes = 0
+        self.millisBehindLatest = None
+        self.pollInterval = consumer.minPollInterval
+        super().__init__( daemon=True )
+
+    def get_shard_iterator(self):
+        """[ iterator after the checkpoint, or from TRIM_HORIZON for a shard never read ]
+
+        Returns:
+            [ String ] -- [ shard iterator ]
+        """
+        sequenceNumber = self.consumer.checkpointer.get( self.shardId )
+        kwargs = { 'StreamName': self.consumer.streamName, 'ShardId': self.shardId }
+        if sequenceNumber:
+            kwargs.update( ShardIteratorType='AFTER_SEQUENCE_NUMBER', StartingSequenceNumber=sequenceNumber )
+        else:
+            kwargs.update( ShardIteratorType='TRIM_HORIZON' )
+        return self.consumer.kinesisClient.get_shard_iterator( **kwargs )['ShardIterator']
+
+    def poll(self, shardIterator):
+        """[ read one page of records, process and checkpoint them ]
+
+        Arguments:
+            shardIterator {[String]} -- [ shard iterator ]
+
+        Returns:
+            [ String ] -- [ next shard iterator, None once a closed shard is fully read ]
+        """
+        res = self.consumer.kinesisClient.get_records( ShardIterator=shardIterator, Limit=self.consumer.batchLimit )
+        records = res.get('Records', [])
+        self.millisBehindLatest = res.get('MillisBehindLatest')
+
+        for record in records:
+            record['Data'] = decompress_record( record['Data'] )
+            for userRecord in deaggregate_record( record ):
+                self.consumer.processRecord( self.shardId, userRecord )
+                self.records += 1
+                self.bytes += len( userRecord['Data'] )
+
+        if records:
+            self.consumer.checkpointer.save( self.shardId, records[-1]['SequenceNumber'] )
+            self.pollInterval = self.consumer.minPollInterval
+        else:
+            self.pollInterval = min( self.pollInterval * 2, self.consumer.maxPollInterval )
+        return res.get('NextShardIterator')
+
+    def run(self):
+        """read the shard until the consumer stops or the shard is closed"""
+        try:
+            shardIterator = self.get_shard_iterator()
+            while shardIterator and not self.consumer.stopped.is_set():
+                try:
+                    shardIterator = self.poll( shardIterator )
+                except self.consumer.kinesisClient.exceptions.ExpiredIteratorException:
+                    shardIterator = self.get_shard_iterator()
+                except self.consumer.kinesisClient.exceptions.ProvisionedThroughputExceededException:
+                    self.pollInterval = min( self.pollInterval * 2, self.consumer.maxPollInterval )
+                clock.wait( self.consumer.stopped, self.pollInterval )
+        except Exception as e:
+            print( e )
+            print('Unexpected shard {} exception. Exiting'.format(self.shardId))
+
+class KinesisConsumer:
+    """Consumer of every shard of a kinesis stream, one ShardReader thread per shard
+
+    Checkpoints go to a local json file so a restarted consumer resumes after the last
+    processed record instead of replaying the stream from TRIM_HORIZON"""
+
+    def __init__(self, streamName, checkpointPath=None, processRecord=None, kinesisClient=None,
+                 minPollInterval=DEFAULT_MIN_POLL_INTERVAL, maxPollInterval=DEFAULT_MAX_POLL_INTERVAL, batchLimit=GET_RECORDS_LIMIT ):
+        self.streamName = streamName
+        self.checkpointer = FileCheckpointer( checkpointPath or streamName + ".checkpoint.json" )
+        self.processRecord = processRecord or ( lambda shardId, record: None )
+        self.kinesisClient = kinesisClient or get_client('kinesis')
+        self.minPollInterval = minPollInterval
+        self.maxPollInterval = maxPollInterval
+        self.batchLimit = batchLimit
+        self.stopped = threading.Event()
+        self.readers = []
+
+    def list_shard_ids(self):
+        """[ ids of all the shards of the stream, closed shards included ]
+
+        Returns:
+            [ List<String> ] -- [ shard ids ]
+        """
+        shardIds = []
+        kwargs = { 'StreamName': self.streamName }
+        while True:
+            description = self.kinesisClient.describe_stream( **kwargs )['StreamDescription']
+            shardIds.extend( shard['ShardId'] for shard in description['Shards'] )
+            if not description.get('HasMoreShards'):
+                return shardIds
+            kwargs['ExclusiveStartShardId'] = shardIds[-1]
+
+    def start(self):
+        """start one reader per shard"""
+        self.stopped.clear()
+        self.readers = [ ShardReader( self, shardId ) for shardId in self.list_shard_ids() ]
+        for reader in self.readers:
+            reader.start()
+
+    def stop(self):
+        """ Stop consumer """
+        self.stopped.set()
+        for reader in self.readers:
+            reader.join()
+
+    def stats(self):
+        """[ records, bytes and MillisBehindLatest of each shard ]
+
+        Returns:
+            [ dict ] -- [ shardId -> stats ]
+        """
+        return { reader.shardId: {
+            'records': reader.records,
+            'bytes': reader.bytes,
+            'millisBehindLatest': reader.millisBehindLatest
+        } for reader in self.readers }
+
+    def wait_until_caught_up(self, expectedRecords, timeout):
+        """[ wait until the readers received expectedRecords records and are not behind the stream ]
+
+        Arguments:
+            expectedRecords {[ int ]} -- [ total number of records to receive ]
+            timeout {[ int ]} -- [ seconds of wait time ]
+
+        Returns:
+            [ Boolean ] -- [ caught up ? ]
+        """
+        # a real time deadline, on a virtual clock the readers poll at the speed of their calls and this loop would not wait for them
+        mustend = time.monotonic() + timeout
+        while time.monotonic() < mustend:
+            stats = self.stats().values()
+            if sum( stat['records'] for stat in stats ) >= expectedRecords and all( stat['millisBehindLatest'] == 0 for stat in stats ):
+                return True
+            time.sleep( self.minPollInterval )
+        return False
+
+    def report(self):
+        """print per shard records, bytes and lag"""
+        for shardId, stat in sorted( self.stats().items() ):
+            print( "consumed {} records {} bytes {} millisBehindLatest {}".format(
+                shardId, stat['records'], stat['bytes'], stat['millisBehindLatest'] ) )
@@ -1,53 +1,496 @@
-import datetime
+import collections
 import time
 import threading
-import boto3
-from src.utils import random_alphanumeric
+from botocore.exceptions import ClientError
+from src import clock
+from src.clients import get_client
+from src.task1.payloadGenerator import PayloadGenerator
+from src.task1.aggregation import RecordAggregator
+from src.task1.shardRouter import partition_key_hash
+from src.task1.shardThrottle import RETRYABLE_ERROR_CODES, THROTTLING_ERROR_CODES
+
+MAX_RECORDS_PER_REQUEST = 500 # put_records hard limit of records per call
+MAX_BYTES_PER_REQUEST = 5 * 1024 * 1024 # put_records hard limit of data + partition keys per call
+MAX_RECORD_RETRIES = 3
 
 class KinesisProducer(threading.Thread):
     """Producer class for AWS Kinesis streams
 
     This class will emit records with the IP addresses as partition key and
-    the emission timestamps as data"""
+    random payloads of a PayloadGenerator as data. With a ShardRouter the partition key and
+    ExplicitHashKey of each record are picked by the router instead.
+
+    With batchSize set records are buffered and sent with put_records, the buffer
+    is flushed when it reaches batchSize records, batchBytes bytes or when the
+    oldest buffered record is older than lingerTime seconds.
+
+    sleepInterval None puts a single record, 0 puts totalTimes records back to back.
+    With a RateController as rateController records are paced along its load profile
+    in records or bytes per second instead of sleeping sleepInterval after each put.
+    With a LatencyHistogram as latency the duration of every put_record(s) call is recorded.
+
+    With aggregate set user records are packed into KPL aggregated records, one
+    aggregator per shard, which are sent once full or older than lingerTime.
 
-    def __init__(self, streamName, sleepInterval=None, ipAddr='8.8.8.8', totalTimes=100 ):
+    With a ShardThrottle as throttle records of a shard over its budget are deferred in a
+    per shard queue instead of being sent, the other shards keep flowing. Throttled and
+    other retryable failures are requeued on their shard after a backoff rather than
+    ending the run, records still failing after maxRetries are counted in failedRecords
+
+    With a Codec as codec each kinesis record, aggregated records included, is compressed
+    into a self contained frame before it is sent, sentBytes then counts compressed bytes
+
+    Records sent back to back in batch mode take their payloads batchSize at a time from
+    the batch method of the payloads when they have one, see PayloadGenerator.batch"""
+
+    def __init__(self, streamName, sleepInterval=None, ipAddr='8.8.8.8', totalTimes=100,
+                 batchSize=None, batchBytes=MAX_BYTES_PER_REQUEST, lingerTime=0.5, maxRetries=MAX_RECORD_RETRIES,
+                 router=None, kinesisClient=None, aggregate=False, payloads=None, verbose=True, latency=None,
+                 rateController=None, throttle=None, codec=None ):
         self.streamName = streamName
         self.sleepInterval = sleepInterval
         self.ipAddr = ipAddr
         self.totalTimes = totalTimes
-        self.kinesisClient = boto3.client('kinesis', endpoint_url='http://localhost:4568', region_name='us-west-2')
+        self.batchSize = min( batchSize, MAX_RECORDS_PER_REQUEST ) if batchSize else None
+        self.batchBytes = min( batchBytes, MAX_BYTES_PER_REQUEST )
+        self.lingerTime = lingerTime
+        self.maxRetries = maxRetries
+        self.router = router
+        self.aggregate = aggregate
+        self.aggregators = {}
+        self.payloads = payloads or PayloadGenerator( 10 )
+        self.payloadBatch = collections.deque()
+        self.buffer = []
+        self.bufferBytes = 0
+        self.bufferStartedAt = None
+        self.failedRecords = 0
+        self.sentRecords = 0
+        self.sentBytes = 0
+        self.verbose = verbose
+        self.latency = latency
+        self.rateController = rateController
+        self.throttle = throttle
+        self.codec = codec
+        self.startedAt = None
+        self.finishedAt = None
+        self.deferred = {}
+        self.deferredLock = threading.Lock()
+        self.statsLock = threading.Lock()
+        self.kinesisClient = kinesisClient or get_client('kinesis')
         super().__init__()
 
     def put_record(self):
-        """put a single record to the stream"""
-        timestamp = datetime.datetime.utcnow()
+        """[ put a single record to the stream, or buffer it in batch and aggregate mode ]
+
+        Returns:
+            [ int ] -- [ bytes of the record data ]
+        """
         part_key = self.ipAddr
-        data = random_alphanumeric(10)
-        print( "put {} to kinesisStrem {}".format( data, self.streamName ) )
-        self.kinesisClient.put_record(
-            StreamName=self.streamName, 
-            Data=data, 
-            PartitionKey=part_key
-        )
+        explicitHashKey = None
+        shardId = None
+        data = self.next_payload()
+        if data is None:
+            # the payloads are exhausted, eg. the end of a LineSource input
+            self.totalTimes = 0
+            return 0
+        if self.router:
+            part_key, explicitHashKey, shardId = self.router.route( data )
+        if self.aggregate:
+            aggregator = self.aggregators.setdefault( shardId, RecordAggregator() )
+            entry = aggregator.add_user_record( part_key, data, explicitHashKey )
+            if entry:
+                self.emit_record( entry )
+            return len( data )
+        entry = { 'Data': data, 'PartitionKey': part_key }
+        if explicitHashKey:
+            entry['ExplicitHashKey'] = explicitHashKey
+        self.emit_record( entry )
+        return len( data )
+
+    def next_payload(self):
+        """[ next payload, generated a batch at a time when the records are neither paced nor sent one by one ]
+
+        Returns:
+            [ bytes ] -- [ payload, None once the payloads are exhausted ]
+        """
+        if self.payloadBatch:
+            return self.payloadBatch.popleft()
+        # paced payloads are generated one at a time so their header carries the time they are emitted at
+        count = min( self.batchSize or 1, self.totalTimes )
+        if count <= 1 or self.sleepInterval or self.rateController or not hasattr( self.payloads, "batch" ):
+            return self.payloads.next()
+        self.payloadBatch.extend( self.payloads.batch( int( count ) ) )
+        return self.payloadBatch.popleft()
+
+    def emit_record(self, entry):
+        """[ send a kinesis record, or defer it while its shard is over budget ]
+
+        Arguments:
+            entry {[ dict ]} -- [ Data, PartitionKey and optional ExplicitHashKey ]
+        """
+        if self.codec:
+            entry = dict( entry, Data=self.codec.compress( entry['Data'] ) )
+        if self.throttle:
+            shardId = self.shard_of( entry )
+            delay = self.throttle.reserve( shardId, 1, len( entry['Data'] ) + len( entry['PartitionKey'] ) )
+            if delay or self.deferred.get( shardId ):
+                self.defer( shardId, entry, delay )
+                return
+        self.dispatch_record( entry )
+
+    def dispatch_record(self, entry, attempt=0):
+        """[ send a kinesis record right away, or buffer it in batch mode ]
+
+        Arguments:
+            entry {[ dict ]} -- [ Data, PartitionKey and optional ExplicitHashKey ]
+
+        Keyword Arguments:
+            attempt {int} -- [ retries of the record so far ] (default: {0})
+        """
+        if self.batchSize:
+            self.add_record( entry['Data'], entry['PartitionKey'], entry.get('ExplicitHashKey'), attempt )
+            return
+        data = entry['Data']
+        if self.verbose:
+            print( "put {} to kinesisStrem {}".format( data if isinstance( data, str ) else "{} bytes".format( len( data ) ), self.streamName ) )
+        self.send_record( entry, attempt )
+
+    def send_record(self, entry, attempt=0):
+        """[ send one record with put_record ]
+
+        Arguments:
+            entry {[ dict ]} -- [ Data, PartitionKey and optional ExplicitHashKey ]
+
+        Keyword Arguments:
+            attempt {int} -- [ retries of the record so far ] (default: {0})
+        """
+        start = time.time()
+        try:
+            self.kinesisClient.put_record( StreamName=self.streamName, **entry )
+        except ClientError as e:
+            errorCode = e.response.get('Error', {}).get('Code')
+            if not self.throttle or errorCode not in RETRYABLE_ERROR_CODES:
+                raise
+            self.retry_records( [ ( entry, errorCode, attempt ) ] )
+            return
+        self.record_sent( 1, len( entry['Data'] ), time.time() - start )
+        if self.throttle:
+            self.throttle.on_success( self.shard_of( entry ) )
+
+    def shard_of(self, entry):
+        """[ shard a record is written to, None without router ]
+
+        Arguments:
+            entry {[ dict ]} -- [ Data, PartitionKey and optional ExplicitHashKey ]
+
+        Returns:
+            [ String ] -- [ shard id ]
+        """
+        if not self.router:
+            return None
+        explicitHashKey = entry.get('ExplicitHashKey')
+        if explicitHashKey:
+            return self.router.shard_for_hash_key( int( explicitHashKey ) )
+        return self.router.shard_for_hash_key( partition_key_hash( entry['PartitionKey'] ) )
+
+    def defer(self, shardId, entry, delay, attempt=0):
+        """[ queue a record behind the other deferred records of its shard ]
+
+        Arguments:
+            shardId {[String]} -- [ shard id ]
+            entry {[ dict ]} -- [ Data, PartitionKey and optional ExplicitHashKey ]
+            delay {[ float ]} -- [ seconds before the record can be sent ]
+
+        Keyword Arguments:
+            attempt {int} -- [ retries of the record so far, kept with the record until it is sent ] (default: {0})
+        """
+        readyAt = clock.time() + delay
+        with self.deferredLock:
+            queue = self.deferred.setdefault( shardId, collections.deque() )
+            if queue:
+                readyAt = max( readyAt, queue[-1][0] )
+            queue.append( ( readyAt, entry, attempt ) )
+
+    def send_deferred(self):
+        """[ send the deferred records whose shard is ready again ]
+
+        Returns:
+            [ float ] -- [ time the next deferred record is ready, None when none is left ]
+        """
+        now = clock.time()
+        ready = []
+        with self.deferredLock:
+            for queue in self.deferred.values():
+                while queue and queue[0][0] <= now:
+                    ready.append( queue.popleft()[1:] )
+        for entry, attempt in ready:
+            self.dispatch_record( entry, attempt )
+        return self.next_ready_at()
+
+    def next_ready_at(self):
+        """[ time the next deferred record is ready ]
+
+        Returns:
+            [ float ] -- [ time, None when no record is deferred ]
+        """
+        with self.deferredLock:
+            return min( [ queue[0][0] for queue in self.deferred.values() if queue ] or [ None ] )
+
+    def retry_records(self, failures):
+        """[ requeue failed records on their shard after a backoff, throttled shards slow down ]
+
+        Arguments:
+            failures {[ List<tuple> ]} -- [ ( entry, error code, retries of the entry so far ) ]
+        """
+        shards = {}
+        for failure in failures:
+            shards.setdefault( self.shard_of( failure[0] ), [] ).append( failure )
+
+        for shardId, shardFailures in shards.items():
+            if any( errorCode in THROTTLING_ERROR_CODES for entry, errorCode, attempt in shardFailures ):
+                delay = self.throttle.on_throttled( shardId )
+            else:
+                delay = None
+            for entry, errorCode, attempt in shardFailures:
+                attempt += 1
+                if attempt > self.maxRetries:
+                    print( "record failed to put to kinesisStrem {} after {} retries: {}".format( self.streamName, self.maxRetries, errorCode ) )
+                    with self.statsLock:
+                        self.failedRecords += 1
+                    continue
+                backoff = delay if delay is not None else self.throttle.retry_delay( attempt )
+                size = len( entry['Data'] ) + len( entry['PartitionKey'] )
+                self.defer( shardId, entry, max( backoff, self.throttle.reserve( shardId, 1, size ) ), attempt )
+
+    def record_sent(self, records, size, seconds):
+        """[ count records which reached the stream and the latency of their request ]
+
+        Arguments:
+            records {[ int ]} -- [ number of records ]
+            size {[ int ]} -- [ bytes of data ]
+            seconds {[ float ]} -- [ request latency ]
+        """
+        with self.statsLock:
+            self.sentRecords += records
+            self.sentBytes += size
+        if self.latency is not None:
+            self.latency.record( seconds )
+
+    def add_record(self, data, partitionKey, explicitHashKey=None, attempt=0):
+        """[ buffer one record and flush when the batch is full ]
+
+        Arguments:
+            data {[String|bytes]} -- [ record data ]
+            partitionKey {[String]} -- [ partition key ]
+
+        Keyword Arguments:
+            explicitHashKey {[String]} -- [ hash key overriding the partition key hash ] (default: {None})
+            attempt {int} -- [ retries of the record so far ] (default: {0})
+        """
+        if isinstance( data, str ):
+            data = data.encode()
+        size = len( data ) + len( partitionKey.encode() )
+        entry = { 'Data': data, 'PartitionKey': partitionKey }
+        if explicitHashKey:
+            entry['ExplicitHashKey'] = explicitHashKey
+
+        if self.buffer and self.bufferBytes + size > self.batchBytes:
+            self.flush_batch()
+
+        if not self.buffer:
+            self.bufferStartedAt = clock.time()
+        self.buffer.append( ( entry, attempt ) )
+        self.bufferBytes += size
+
+        if len( self.buffer ) >= self.batchSize:
+            self.flush_batch()
+
+    def flush_if_lingering(self):
+        """send ready deferred records, flush aggregators and the buffer when their oldest record waited longer than lingerTime"""
+        if self.throttle:
+            self.send_deferred()
+        now = clock.time()
+        for aggregator in self.aggregators.values():
+            if len( aggregator ) and now - aggregator.startedAt >= self.lingerTime:
+                self.emit_record( aggregator.clear_and_get() )
+        if self.buffer and now - self.bufferStartedAt >= self.lingerTime:
+            self.flush_batch()
+
+    def flush(self):
+        """send all aggregated, buffered and ready deferred records"""
+        for aggregator in self.aggregators.values():
+            if len( aggregator ):
+                self.emit_record( aggregator.clear_and_get() )
+        if self.throttle:
+            self.send_deferred()
+        self.flush_batch()
+
+    def flush_deferred(self):
+        """send the deferred records as their shards get ready, until none is left"""
+        while True:
+            self.send_deferred()
+            self.flush_batch()
+            # the flush may have deferred its records again
+            nextReadyAt = self.next_ready_at()
+            if nextReadyAt is None:
+                return
+            clock.sleep( max( nextReadyAt - clock.time(), 0 ) )
+
+    def flush_batch(self):
+        """send all buffered records with put_records"""
+        if not self.buffer:
+            return
+        entries = [ entry for entry, attempt in self.buffer ]
+        attempts = [ attempt for entry, attempt in self.buffer ]
+        self.buffer = []
+        self.bufferBytes = 0
+        self.bufferStartedAt = None
+        if self.verbose:
+            print( "put {} records to kinesisStrem {}".format( len( entries ), self.streamName ) )
+        self.send_batch( entries, attempts )
+
+    def send_batch(self, entries, attempts=None):
+        """[ send a flushed batch with put_records ]
+
+        Arguments:
+            entries {[List<dict>]} -- [ put_records Records entries ]
+
+        Keyword Arguments:
+            attempts {[List<int>]} -- [ retries of each entry so far, none when None ] (default: {None})
+        """
+        self.put_records_with_retry( entries, attempts )
+
+    def put_records_with_retry(self, entries, attempts=None):
+        """[ put_records and retry only the records which failed in a partial failure response ]
+
+        Arguments:
+            entries {[List<dict>]} -- [ put_records Records entries ]
+
+        Keyword Arguments:
+            attempts {[List<int>]} -- [ retries of each entry so far with a throttle, none when None ] (default: {None})
+
+        Returns:
+            [ int ] -- [ number of records which still failed after all retries, with a throttle
+                the number of records requeued ]
+        """
+        if self.throttle:
+            return self.put_records_throttled( entries, attempts )
+        attempt = 0
+        while entries:
+            start = time.time()
+            res = self.kinesisClient.put_records(
+                StreamName=self.streamName,
+                Records=entries
+            )
+            seconds = time.time() - start
+            size = sum( len( entry['Data'] ) for entry in entries )
+            if res.get('FailedRecordCount', 0) == 0:
+                self.record_sent( len( entries ), size, seconds )
+                return 0
+
+            failed = [ entry for entry, result in zip( entries, res['Records'] ) if result.get('ErrorCode') ]
+            self.record_sent( len( entries ) - len( failed ), size - sum( len( entry['Data'] ) for entry in failed ), seconds )
+            entries = failed
+            attempt += 1
+            if attempt > self.maxRetries:
+                break
+            clock.sleep( 0.1 * 2 ** ( attempt - 1 ) )
+
+        print( "{} records failed to put to kinesisStrem {}".format( len( entries ), self.streamName ) )
+        with self.statsLock:
+            self.failedRecords += len( entries )
+        return len( entries )
+
+    def put_records_throttled(self, entries, attempts=None):
+        """[ put_records once, requeueing the failed records on their shard ]
+
+        Arguments:
+            entries {[List<dict>]} -- [ put_records Records entries ]
+
+        Keyword Arguments:
+            attempts {[List<int>]} -- [ retries of each entry so far, none when None ] (default: {None})
+
+        Returns:
+            [ int ] -- [ number of records requeued ]
+        """
+        attempts = attempts or [ 0 ] * len( entries )
+        start = time.time()
+        try:
+            res = self.kinesisClient.put_records(
+                StreamName=self.streamName,
+                Records=entries
+            )
+        except ClientError as e:
+            errorCode = e.response.get('Error', {}).get('Code')
+            if errorCode not in RETRYABLE_ERROR_CODES:
+                raise
+            self.retry_records( [ ( entry, errorCode, attempt ) for entry, attempt in zip( entries, attempts ) ] )
+            return len( entries )
+        seconds = time.time() - start
+
+        failures = []
+        succeeded = {}
+        size = 0
+        for entry, attempt, result in zip( entries, attempts, res['Records'] ):
+            if result.get('ErrorCode'):
+                failures.append( ( entry, result['ErrorCode'], attempt ) )
+                continue
+            shardId = self.shard_of( entry )
+            succeeded[ shardId ] = succeeded.get( shardId, 0 ) + 1
+            size += len( entry['Data'] )
+        self.record_sent( len( entries ) - len( failures ), size, seconds )
+        for shardId, records in succeeded.items():
+            self.throttle.on_success( shardId, records )
+        if failures:
+            self.retry_records( failures )
+        return len( failures )
 
     def run_continously(self):
-        """put a record at regular intervals"""
+        """put a record at regular intervals, or at the pace of the rate controller"""
         while self.totalTimes > 0:
-            self.put_record()
-            time.sleep(self.sleepInterval)
+            size = self.put_record()
+            self.flush_if_lingering()
+            if self.rateController:
+                self.rateController.acquire( size )
+            elif self.sleepInterval:
+                clock.sleep(self.sleepInterval)
             self.totalTimes = self.totalTimes - 1
 
     def run(self):
         """run the producer"""
+        self.startedAt = time.time()
         try:
-            if self.sleepInterval:
+            if self.sleepInterval is not None or self.rateController:
                 self.run_continously()
             else:
                 self.put_record()
+            self.flush()
+            if self.throttle:
+                self.flush_deferred()
         except Exception as e:
             print( e )
             print('Unexpected stream {} exception. Exiting'.format(self.streamName))
+        finally:
+            self.finishedAt = time.time()
+
+    def stats(self):
+        """[ throughput and latency of the run, the same keys as ProducerFleet.stats ]
+
+        Returns:
+            [ dict ] -- [ sentRecords, sentBytes, failedRecords, seconds, recordsPerSecond, bytesPerSecond, latency ]
+        """
+        seconds = ( self.finishedAt or time.time() ) - self.startedAt if self.startedAt else 0
+        return {
+            'sentRecords': self.sentRecords,
+            'sentBytes': self.sentBytes,
+            'failedRecords': self.failedRecords,
+            'seconds': seconds,
+            'recordsPerSecond': self.sentRecords / seconds if seconds else 0,
+            'bytesPerSecond': self.sentBytes / seconds if seconds else 0,
+            'latency': self.latency
+        }
+
     def stop( self ):
         """ Stop producer """
         self.totalTimes = 0
-    
\ No newline at end of file
+
@@ -0,0 +1,233 @@
+import mmap
+import os
+import queue
+import stat
+import sys
+import threading
+import time
+
+MAX_RECORD_SIZE = 1024 * 1024 # kinesis data blob limit
+DEFAULT_CHUNK_BYTES = 1024 * 1024 # bytes of lines handed over to the producer at once
+DEFAULT_QUEUE_SIZE = 32 # chunks read ahead, bounds the memory to about DEFAULT_QUEUE_SIZE * DEFAULT_CHUNK_BYTES
+RELEASE_INTERVAL = 64 * 1024 * 1024 # mapped bytes read before their pages are dropped
+PUT_TIMEOUT = 0.5 # seconds between checks of close while the queue is full
+
+class LineSource:
+    """Streams the lines of a file, a pipe or stdin as payloads, with a bounded read-ahead
+
+    A reader thread splits the input into lines and hands them over in chunks of about
+    chunkBytes through a queue of queueSize chunks, so reading overlaps the puts of the
+    producer and the memory stays bounded whatever the input size. Regular files are
+    memory mapped and split in place, the pages already read are dropped as the reader
+    moves on. Pipes and stdin are read in chunkBytes blocks. Empty lines and lines over
+    maxRecordSize are skipped. next returns None once the input is exhausted, which ends
+    the run of a KinesisProducer"""
+
+    def __init__(self, path, queueSize=DEFAULT_QUEUE_SIZE, chunkBytes=DEFAULT_CHUNK_BYTES, maxRecordSize=MAX_RECORD_SIZE, keepNewline=True):
+        self.path = path
+        self.chunkBytes = chunkBytes
+        self.maxRecordSize = maxRecordSize
+        self.keepNewline = keepNewline
+        self.queue = queue.Queue( queueSize )
+        self.lines = []
+        self.index = 0
+        self.finished = False
+        self.closed = threading.Event()
+        self.thread = None
+        self.records = 0
+        self.readBytes = 0
+        self.skippedLines = 0
+        self.readerBlocked = 0.0
+        self.producerStarved = 0.0
+        self.startedAt = None
+
+    def start(self):
+        """[ start reading ahead, next starts it otherwise ]
+
+        Returns:
+            [ LineSource ] -- [ self ]
+        """
+        if self.thread is None:
+            self.startedAt = time.perf_counter()
+            self.thread = threading.Thread( target=self.read, daemon=True )
+            self.thread.start()
+        return self
+
+    def close(self):
+        """stop the reader, the lines already queued are dropped"""
+        self.closed.set()
+        self.finished = True
+
+    def next(self):
+        """[ next line of the input ]
+
+        Raises:
+            Exception: [ the input can not be read ]
+
+        Returns:
+            [ bytes ] -- [ payload, None once the input is exhausted ]
+        """
+        while self.index >= len( self.lines ):
+            if self.finished:
+                return None
+            self.start()
+            start = time.perf_counter()
+            chunk = self.queue.get()
+            self.producerStarved += time.perf_counter() - start
+            if chunk is None or isinstance( chunk, Exception ):
+                self.finished = True
+                if chunk is not None:
+                    raise chunk
+                return None
+            self.lines = chunk
+            self.index = 0
+        line = self.lines[ self.index ]
+        self.index += 1
+        self.records += 1
+        return line
+
+    def open_input(self):
+        """[ stdin for -, a memory map for regular files and the file object otherwise ]
+
+        Returns:
+            [ tuple ] -- [ ( opened file, mmap or None ) ]
+        """
+        if self.path == "-":
+            return sys.stdin.buffer, None
+        f = open( self.path, "rb" )
+        if stat.S_ISREG( os.fstat( f.fileno() ).st_mode ) and os.fstat( f.fileno() ).st_size > 0:
+            return f, mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+        return f, None
+
+    def read(self):
+        """reader thread, queues chunks of lines then None, or the exception ending the read"""
+        f = None
+        try:
+            f, mapped = self.open_input()
+            if mapped is not None:
+                with mapped:
+                    self.split_mapped( mapped )
+            else:
+                self.split_stream( f )
+            self.enqueue( None )
+        except Exception as e:
+            self.enqueue( Exception("Fails to read input {}: {}".format( self.path, e )) )
+        finally:
+            if f is not None and f is not sys.stdin.buffer:
+                f.close()
+
+    def split_mapped(self, mapped):
+        """[ split a memory mapped file into lines, dropping the pages already read ]
+
+        Arguments:
+            mapped {[ mmap ]} -- [ mapped file ]
+        """
+        if hasattr( mapped, "madvise" ):
+            mapped.madvise( mmap.MADV_SEQUENTIAL )
+        size = len( mapped )
+        position = 0
+        released = 0
+        chunk = []
+        chunkSize = 0
+        while position < size and not self.closed.is_set():
+            end = mapped.find( b"\n", position )
+            end = size if end < 0 else end + 1
+            if end - position > self.maxRecordSize + 2:
+                # never copy an oversized line out of the mapping
+                self.skippedLines += 1
+            else:
+                chunkSize += self.add_line( chunk, mapped[ position:end ] )
+            self.readBytes += end - position
+            position = end
+            if chunkSize >= self.chunkBytes:
+                self.enqueue( chunk )
+                chunk = []
+                chunkSize = 0
+            if position - released >= RELEASE_INTERVAL and hasattr( mapped, "madvise" ):
+                # pages of a read only mapping are backed by the file, dropping them bounds the resident memory
+                release = ( position // mmap.PAGESIZE ) * mmap.PAGESIZE
+                mapped.madvise( mmap.MADV_DONTNEED, released, release - released )
+                released = release
+        if chunk:
+            self.enqueue( chunk )
+
+    def split_stream(self, stream):
+        """[ split a pipe or stdin into lines, reading chunkBytes blocks ]
+
+        Arguments:
+            stream {[ file ]} -- [ binary stream ]
+        """
+        # read1 returns what the pipe holds instead of waiting for a full block
+        read = getattr( stream, "read1", stream.read )
+        remainder = b""
+        oversized = False
+        while not self.closed.is_set():
+            block = read( self.chunkBytes )
+            if not block:
+                break
+            self.readBytes += len( block )
+            lines = ( remainder + block ).split( b"\n" )
+            remainder = lines.pop()
+            chunk = []
+            for line in lines:
+                if oversized:
+                    # tail of a line dropped for being over maxRecordSize
+                    oversized = False
+                    continue
+                self.add_line( chunk, line + b"\n" )
+            if len( remainder ) > self.maxRecordSize:
+                if not oversized:
+                    self.skippedLines += 1
+                remainder = b""
+                oversized = True
+            if chunk:
+                self.enqueue( chunk )
+        if remainder and not oversized:
+            chunk = []
+            self.add_line( chunk, remainder )
+            if chunk:
+                self.enqueue( chunk )
+
+    def add_line(self, chunk, line):
+        """[ append a line to a chunk unless it is empty or too large ]
+
+        Arguments:
+            chunk {[ List<bytes> ]} -- [ lines of the chunk ]
+            line {[ bytes ]} -- [ line, with its newline unless it ends the input ]
+
+        Returns:
+            [ int ] -- [ bytes added ]
+        """
+        if not self.keepNewline or not line.endswith( b"\n" ):
+            line = line.rstrip( b"\n" ) + ( b"\n" if self.keepNewline else b"" )
+        if line.strip( b"\r\n" ) == b"":
+            return 0
+        if len( line ) > self.maxRecordSize:
+            self.skippedLines += 1
+            return 0
+        chunk.append( line )
+        return len( line )
+
+    def enqueue(self, item):
+        """[ queue a chunk, waiting while the queue is full until the source is closed ]
+
+        Arguments:
+            item {[ List<bytes>|Exception|None ]} -- [ chunk of lines, read error or end of input ]
+        """
+        start = time.perf_counter()
+        while not self.closed.is_set():
+            try:
+                self.queue.put( item, timeout=PUT_TIMEOUT )
+                break
+            except queue.Full:
+                continue
+        self.readerBlocked += time.perf_counter() - start
+
+    def report(self):
+        """print the lines read and where the time went: a blocked reader means the producer is the bottleneck"""
+        seconds = time.perf_counter() - self.startedAt if self.startedAt else 0
+        print( "Input {}: {} records, {:.1f} MiB read, {} lines skipped, {:.1f} MiB/s".format(
+            self.path, self.records, self.readBytes / 1024 / 1024, self.skippedLines,
+            self.readBytes / 1024 / 1024 / seconds if seconds else 0 ) )
+        print( "Input {}: reader blocked on a full queue {:.2f}s, producer waiting for input {:.2f}s".format(
+            self.path, self.readerBlocked, self.producerStarved ) )
@@ -0,0 +1,159 @@
+import itertools
+import math
+import random
+import time
+from src.randomData import random_alphanumeric_bytes
+
+DEFAULT_POOL_SIZE = 1024 * 1024 # random bytes generated per os.urandom call
+HEADER_FORMAT = b"%016x%016x|" # sequence number, emission time in microseconds
+HEADER_SIZE = 33
+MIN_HEADER_PAYLOAD_SIZE = HEADER_SIZE + 2 # header, one byte of body and the newline delimiter
+
+class FixedSize:
+    """Every payload has the same size"""
+
+    def __init__(self, size=10):
+        self.size = size
+
+    def __call__(self, rng):
+        return self.size
+
+class UniformSize:
+    """Payload sizes drawn uniformly between minSize and maxSize"""
+
+    def __init__(self, minSize, maxSize):
+        self.minSize = minSize
+        self.maxSize = maxSize
+
+    def __call__(self, rng):
+        return rng.randint( self.minSize, self.maxSize )
+
+class LogNormalSize:
+    """Payload sizes drawn from a log-normal distribution, mostly small payloads with a long tail
+
+    median is the median size, sigma the standard deviation of the underlying normal"""
+
+    def __init__(self, median, sigma=1.0, minSize=1, maxSize=1024 * 1024):
+        self.mu = 0 if median <= 0 else math.log( median )
+        self.sigma = sigma
+        self.minSize = minSize
+        self.maxSize = maxSize
+
+    def __call__(self, rng):
+        return max( self.minSize, min( self.maxSize, int( rng.lognormvariate( self.mu, self.sigma ) ) ) )
+
+def parse_header( data ):
+    """[ read the sequence number and emission time of a payload generated with header ]
+
+    Arguments:
+        data {[ bytes ]} -- [ payload ]
+
+    Returns:
+        [ tuple ] -- [ ( sequence number, emission time in seconds ) or None without header ]
+    """
+    if len( data ) < HEADER_SIZE or data[ HEADER_SIZE - 1:HEADER_SIZE ] != b"|":
+        return None
+    try:
+        return int( data[ :16 ], 16 ), int( data[ 16:32 ], 16 ) / 1000000
+    except ValueError:
+        return None
+
+class PayloadGenerator:
+    """Generates random alphanumeric payloads in bulk
+
+    Random bytes come from one large os.urandom call translated to alphanumeric
+    characters, payloads are slices of that pool. With ringSize set a ring buffer of
+    ringSize payload bodies is generated once and reused, so generation only costs the
+    slicing and the header. With header set each payload starts with its sequence number
+    and emission time (see parse_header), size then includes the header and a fixed size
+    smaller than the header and delimiter plus one byte is rejected. Bodies have at least
+    one byte, sizes drawn too small are rounded up. Generators of different producers can use
+    disjoint sequence numbers with sequenceStart"""
+
+    def __init__(self, size=10, header=False, ringSize=0, delimiter=b"", seed=None, poolSize=DEFAULT_POOL_SIZE, sequenceStart=0):
+        if header and not callable( size ) and size < HEADER_SIZE + len( delimiter ) + 1:
+            raise Exception("Payloads with a header need at least {} bytes, got {}".format( HEADER_SIZE + len( delimiter ) + 1, size ))
+        self.sizes = size if callable( size ) else FixedSize( size )
+        self.header = header
+        self.delimiter = delimiter
+        self.rng = random.Random( seed )
+        self.poolSize = poolSize
+        self.pool = b""
+        self.offset = 0
+        self.sequenceNumber = sequenceStart
+        self.ring = [ self.random_bytes( self.body_size() ) for _ in range( ringSize ) ]
+        self.ringIndex = 0
+
+    def body_size(self):
+        size = self.sizes( self.rng ) - len( self.delimiter )
+        if self.header:
+            size -= HEADER_SIZE
+        return max( size, 1 )
+
+    def random_bytes(self, length):
+        """[ next length random alphanumeric bytes of the pool ]
+
+        Arguments:
+            length {[ int ]} -- [ number of bytes ]
+
+        Returns:
+            [ bytes ] -- [ random alphanumeric bytes ]
+        """
+        if self.offset + length > len( self.pool ):
+            self.pool = random_alphanumeric_bytes( max( self.poolSize, length ) )
+            self.offset = 0
+        data = self.pool[ self.offset:self.offset + length ]
+        self.offset += length
+        return data
+
+    def next(self):
+        """[ generate one payload ]
+
+        Returns:
+            [ bytes ] -- [ payload ]
+        """
+        if self.ring:
+            body = self.ring[ self.ringIndex ]
+            self.ringIndex = ( self.ringIndex + 1 ) % len( self.ring )
+        else:
+            body = self.random_bytes( self.body_size() )
+        if self.header:
+            body = HEADER_FORMAT % ( self.sequenceNumber, int( time.time() * 1000000 ) ) + body
+        self.sequenceNumber += 1
+        return body + self.delimiter
+
+    def batch(self, count):
+        """[ generate count payloads from one slice of the pool, the payloads share one emission time ]
+
+        Arguments:
+            count {[ int ]} -- [ number of payloads ]
+
+        Returns:
+            [ List<bytes> ] -- [ payloads ]
+        """
+        if self.ring:
+            start = self.ringIndex
+            if start + count <= len( self.ring ):
+                bodies = self.ring[ start:start + count ]
+            else:
+                bodies = list( itertools.islice( itertools.cycle( self.ring[ start: ] + self.ring[ :start ] ), count ) )
+            self.ringIndex = ( start + count ) % len( self.ring )
+        elif isinstance( self.sizes, FixedSize ):
+            size = self.body_size()
+            block = self.random_bytes( size * count )
+            bodies = [ block[ offset:offset + size ] for offset in range( 0, size * count, size ) ]
+        else:
+            offsets = [ 0 ]
+            for offset in itertools.accumulate( self.body_size() for _ in range( count ) ):
+                offsets.append( offset )
+            block = self.random_bytes( offsets[-1] )
+            bodies = [ block[ start:end ] for start, end in zip( offsets, offsets[1:] ) ]
+
+        if self.header:
+            timestamp = int( time.time() * 1000000 )
+            first = self.sequenceNumber
+            bodies = [ HEADER_FORMAT % ( first + index, timestamp ) + body for index, body in enumerate( bodies ) ]
+        self.sequenceNumber += count
+        if self.delimiter:
+            return [ body + self.delimiter for body in bodies ]
+        return bodies
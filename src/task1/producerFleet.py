@@ -0,0 +1,275 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from src import backends
+from src.metrics import LatencyHistogram
+from src.task1.asyncKinesisProducer import AsyncKinesisProducer
+from src.task1.kinesisProducer import KinesisProducer
+from src.task1.payloadGenerator import PayloadGenerator
+from src.task1.compression import Codec
+from src.task1.rateControl import RateController, ScaledRate, parse_profile
+from src.task1.shardRouter import ShardRouter, HashKeySlice
+from src.task1.shardThrottle import ShardThrottle
+
+DEFAULT_REPORT_INTERVAL = 1.0
+DEFAULT_START_TIMEOUT = 60
+WORKER_SEQUENCE_BITS = 40 # payload header sequence numbers of worker i start at i << WORKER_SEQUENCE_BITS
+
+def create_fleet_producer( index, workers, description, totalTimes, engine="thread", maxInFlight=8, batchSize=None, aggregate=False,
+                           payloadSize=10, rate=None, rateUnit="records", profile=None, header=False, compression="none" ):
+    """[ producer of one fleet worker, writing to its slice of the stream hash key space ]
+
+    Arguments:
+        index {[ int ]} -- [ worker index ]
+        workers {[ int ]} -- [ number of workers ]
+        description {[ dict ]} -- [ StreamDescription ]
+        totalTimes {[ int ]} -- [ records of this worker ]
+
+    Keyword Arguments:
+        see task1_kinesis, rate is the rate of the whole fleet, header adds a payload header
+        with sequence numbers unique across the fleet and a newline delimiter
+
+    Returns:
+        [ KinesisProducer ] -- [ producer, not started ]
+    """
+    streamName = description['StreamName']
+    producerClass = AsyncKinesisProducer if engine == "async" else KinesisProducer
+    payloads = PayloadGenerator( payloadSize, header=header, delimiter=b"\n" if header else b"", sequenceStart=index << WORKER_SEQUENCE_BITS )
+    options = dict( totalTimes=totalTimes, batchSize=batchSize, aggregate=aggregate, payloads=payloads,
+        verbose=False, latency=LatencyHistogram(), throttle=ShardThrottle() )
+    if engine == "async":
+        options['maxInFlight'] = maxInFlight
+    if compression != "none":
+        options['codec'] = Codec( compression )
+    if rate or profile:
+        options['rateController'] = RateController( ScaledRate( parse_profile( profile, rate ), 1 / workers ), rateUnit )
+    producer = producerClass( streamName, 0, **options )
+    producer.router = ShardRouter( producer.kinesisClient, streamName, HashKeySlice( index, workers ), description )
+    return producer
+
+def producer_stats( index, producer, state, startedAt ):
+    return {
+        'worker': index,
+        'pid': os.getpid(),
+        'state': state,
+        'sentRecords': producer.sentRecords,
+        'sentBytes': producer.sentBytes,
+        'failedRecords': producer.failedRecords,
+        'elapsed': time.time() - startedAt,
+        'latency': producer.latency
+    }
+
+def run_fleet_worker( index, workers, description, totalTimes, producerOptions, startEvent, stopEvent, statsQueue, reportInterval, backend="localstack" ):
+    """[ worker process entry point: build the producer, wait for the fleet start, send stats until done ]
+
+    Arguments:
+        index {[ int ]} -- [ worker index ]
+        workers {[ int ]} -- [ number of workers ]
+        description {[ dict ]} -- [ StreamDescription ]
+        totalTimes {[ int ]} -- [ records of this worker ]
+        producerOptions {[ dict ]} -- [ keyword arguments of create_fleet_producer ]
+        startEvent {[ multiprocessing.Event ]} -- [ set by the parent once every worker is ready ]
+        stopEvent {[ multiprocessing.Event ]} -- [ set by the parent to stop the workers early ]
+        statsQueue {[ multiprocessing.Queue ]} -- [ stats messages to the parent ]
+        reportInterval {[ float ]} -- [ seconds between stats messages ]
+
+    Keyword Arguments:
+        backend {String} -- [ backend of the parent process ] (default: {"localstack"})
+    """
+    try:
+        backends.Backend( backend ).start()
+        producer = create_fleet_producer( index, workers, description, totalTimes, **producerOptions )
+    except Exception as e:
+        statsQueue.put( { 'worker': index, 'pid': os.getpid(), 'state': "failed", 'error': str( e ) } )
+        return
+    statsQueue.put( { 'worker': index, 'pid': os.getpid(), 'state': "ready" } )
+    startEvent.wait()
+    if stopEvent.is_set():
+        return
+
+    startedAt = time.time()
+    done = threading.Event()
+
+    def report():
+        while not done.wait( reportInterval ):
+            if stopEvent.is_set():
+                producer.stop()
+            statsQueue.put( producer_stats( index, producer, "running", startedAt ) )
+
+    reporter = threading.Thread( target=report, daemon=True )
+    reporter.start()
+    producer.run()
+    done.set()
+    reporter.join()
+    statsQueue.put( producer_stats( index, producer, "done", startedAt ) )
+
+class ProducerFleet:
+    """Runs producers in worker processes to use more than one core
+
+    Payload generation, serialization and request signing are CPU bound and threads share
+    one GIL, so each worker process runs its own producer and client on a slice of the
+    stream hash key space (see HashKeySlice). Workers start together once all of them are
+    ready, stop together with stop, and send their stats to the parent every reportInterval.
+    Workers are spawned, not forked, so no client or lock of the parent is inherited"""
+
+    def __init__(self, description, workers=None, totalTimes=100, reportInterval=DEFAULT_REPORT_INTERVAL, verbose=True, **producerOptions):
+        self.description = description
+        self.streamName = description['StreamName']
+        self.workers = workers or os.cpu_count()
+        self.totalTimes = totalTimes
+        self.reportInterval = reportInterval
+        self.verbose = verbose
+        self.producerOptions = producerOptions
+        self.processes = []
+        self.workerStats = {}
+        self.startedAt = None
+        self.finishedAt = None
+
+    def start(self, timeout=DEFAULT_START_TIMEOUT):
+        """[ spawn the workers and start them together once all are ready ]
+
+        Keyword Arguments:
+            timeout {int} -- [ seconds to wait for the workers to be ready ] (default: {DEFAULT_START_TIMEOUT})
+
+        Raises:
+            Exception: [ a worker failed or did not get ready in time, or the backend lives in this process ]
+        """
+        backend = backends.current
+        if backend.inProcess:
+            raise Exception("Producer fleet workers can not reach the in-process {} backend, run a single worker".format( backend.name ))
+        context = multiprocessing.get_context( "spawn" )
+        self.startEvent = context.Event()
+        self.stopEvent = context.Event()
+        self.statsQueue = context.Queue()
+        for index in range( self.workers ):
+            totalTimes = self.totalTimes // self.workers + ( 1 if index < self.totalTimes % self.workers else 0 )
+            process = context.Process( target=run_fleet_worker, name="producer-{}".format( index ), daemon=True,
+                args=( index, self.workers, self.description, totalTimes, self.producerOptions,
+                    self.startEvent, self.stopEvent, self.statsQueue, self.reportInterval, backend.name ) )
+            process.start()
+            self.processes.append( process )
+
+        deadline = time.time() + timeout
+        while len( self.workerStats ) < self.workers:
+            if time.time() > deadline:
+                self.abort()
+                raise Exception("Producer fleet of {} not ready after {}s".format( self.streamName, timeout ))
+            self.collect( 0.1 )
+            failed = [ stats for stats in self.workerStats.values() if stats['state'] == "failed" ]
+            if failed:
+                self.abort()
+                raise Exception("Producer fleet worker {} failed: {}".format( failed[0]['worker'], failed[0]['error'] ))
+
+        self.startedAt = time.time()
+        self.startEvent.set()
+
+    def abort(self):
+        self.stopEvent.set()
+        self.startEvent.set()
+        for process in self.processes:
+            process.join( 5 )
+            if process.is_alive():
+                process.terminate()
+
+    def collect(self, timeout=0):
+        """[ read the stats messages sent by the workers ]
+
+        Keyword Arguments:
+            timeout {float} -- [ seconds to wait for the first message ] (default: {0})
+        """
+        try:
+            while True:
+                stats = self.statsQueue.get( timeout=timeout )
+                self.workerStats[ stats['worker'] ] = stats
+                timeout = 0
+        except queue.Empty:
+            pass
+
+    def done(self):
+        finished = all( stats['state'] in ( "done", "failed" ) for stats in self.workerStats.values() )
+        return ( finished and len( self.workerStats ) == self.workers ) or not any( process.is_alive() for process in self.processes )
+
+    def wait(self, timeout=None):
+        """[ wait for the workers to finish, printing the fleet throughput every reportInterval ]
+
+        Keyword Arguments:
+            timeout {float} -- [ seconds to wait, None waits until done ] (default: {None})
+
+        Returns:
+            [ bool ] -- [ True when every worker finished ]
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        lastReportAt = time.time()
+        while not self.done():
+            if deadline is not None and time.time() > deadline:
+                return False
+            self.collect( 0.1 )
+            if self.verbose and time.time() - lastReportAt >= self.reportInterval:
+                lastReportAt = time.time()
+                stats = self.stats()
+                print( "fleet {} records {} ({:.0f} records/s)".format( self.streamName, stats['sentRecords'], stats['recordsPerSecond'] ) )
+        for process in self.processes:
+            process.join()
+        self.collect()
+        self.finishedAt = time.time()
+        return True
+
+    def stop(self):
+        """ Stop the workers """
+        self.stopEvent.set()
+
+    def run(self):
+        """run the fleet until every worker is done, stopping it on KeyboardInterrupt"""
+        self.start()
+        try:
+            self.wait()
+        except KeyboardInterrupt:
+            self.stop()
+            self.wait()
+
+    @property
+    def sentRecords(self):
+        return sum( stats.get('sentRecords', 0) for stats in self.workerStats.values() )
+
+    @property
+    def failedRecords(self):
+        return sum( stats.get('failedRecords', 0) for stats in self.workerStats.values() )
+
+    def stats(self):
+        """[ aggregate throughput and latency of the workers ]
+
+        Returns:
+            [ dict ] -- [ sentRecords, sentBytes, failedRecords, seconds, recordsPerSecond, bytesPerSecond, latency ]
+        """
+        latency = LatencyHistogram()
+        for stats in self.workerStats.values():
+            if stats.get('latency') is not None:
+                latency.merge( stats['latency'] )
+        seconds = ( self.finishedAt or time.time() ) - self.startedAt if self.startedAt else 0
+        sentBytes = sum( stats.get('sentBytes', 0) for stats in self.workerStats.values() )
+        return {
+            'sentRecords': self.sentRecords,
+            'sentBytes': sentBytes,
+            'failedRecords': self.failedRecords,
+            'seconds': seconds,
+            'recordsPerSecond': self.sentRecords / seconds if seconds else 0,
+            'bytesPerSecond': sentBytes / seconds if seconds else 0,
+            'latency': latency
+        }
+
+    def report(self):
+        """print per worker and aggregate throughput"""
+        for index, stats in sorted( self.workerStats.items() ):
+            if stats['state'] == "failed":
+                print( "worker {} failed: {}".format( index, stats['error'] ) )
+                continue
+            elapsed = stats.get('elapsed') or 0
+            print( "worker {} pid {} {} records {} failed {} ({:.0f} records/s)".format( index, stats['pid'], stats['state'],
+                stats.get('sentRecords', 0), stats.get('failedRecords', 0), stats.get('sentRecords', 0) / elapsed if elapsed else 0 ) )
+        stats = self.stats()
+        print( "fleet {} {} workers records {} failed {} in {:.2f}s ({:.0f} records/s, {:.0f} bytes/s, p99 {})".format(
+            self.streamName, self.workers, stats['sentRecords'], stats['failedRecords'], stats['seconds'],
+            stats['recordsPerSecond'], stats['bytesPerSecond'],
+            "{:.1f}ms".format( stats['latency'].percentile( 99 ) * 1000 ) if stats['latency'].count else "-" ) )
@@ -0,0 +1,248 @@
+import csv
+import bisect
+import math
+import threading
+from src.clock import monotonic, sleep
+
+RATE_UNITS = [ "records", "bytes" ]
+IDLE_POLL_INTERVAL = 0.1 # seconds between checks while a profile rate is 0
+
+class TokenBucket:
+    """Token bucket pacing a producer at rate tokens per second
+
+    Tokens refill continuously up to burst, a token is a record or a byte. reserve takes
+    tokens up front and lets the bucket go into debt, the caller then waits the returned
+    delay, so the pace is set by the clock and not by the request latency (open loop).
+    At rate 0 nothing can be reserved beyond the tokens left"""
+
+    def __init__(self, rate, burst=None, clock=monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else max( rate, 1 )
+        self.clock = clock
+        self.tokens = self.burst
+        self.updatedAt = clock()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        if self.rate > 0:
+            self.tokens = min( self.burst, self.tokens + ( now - self.updatedAt ) * self.rate )
+        self.updatedAt = now
+
+    def set_rate(self, rate, burst=None):
+        """[ change the refill rate, tokens already earned are kept ]
+
+        Arguments:
+            rate {[ float ]} -- [ tokens per second ]
+
+        Keyword Arguments:
+            burst {[ float ]} -- [ bucket capacity, unchanged when None ] (default: {None})
+        """
+        with self.lock:
+            self.refill( self.clock() )
+            self.rate = rate
+            if burst is not None:
+                self.burst = burst
+
+    def drain(self):
+        """drop the tokens left, eg. after the receiver pushed back"""
+        with self.lock:
+            self.refill( self.clock() )
+            self.tokens = min( self.tokens, 0 )
+
+    def reserve(self, amount=1):
+        """[ take amount tokens ]
+
+        Keyword Arguments:
+            amount {[ float ]} -- [ tokens to take ] (default: {1})
+
+        Returns:
+            [ float ] -- [ seconds to wait before sending, 0 when the tokens were available,
+                None at rate 0 when nothing was taken ]
+        """
+        with self.lock:
+            self.refill( self.clock() )
+            if self.rate <= 0 and self.tokens < amount:
+                return None
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self, amount=1):
+        """[ take amount tokens, sleeping until they are paid for ]
+
+        Keyword Arguments:
+            amount {[ float ]} -- [ tokens to take ] (default: {1})
+        """
+        delay = self.reserve( amount )
+        while delay is None:
+            sleep( IDLE_POLL_INTERVAL )
+            delay = self.reserve( amount )
+        if delay:
+            sleep( delay )
+
+class ConstantRate:
+    """Load profile with the same rate for the whole run"""
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def __call__(self, elapsed):
+        return self.rate
+
+class LinearRamp:
+    """Load profile going linearly from startRate to endRate in duration seconds, then holding endRate"""
+
+    def __init__(self, startRate, endRate, duration):
+        self.startRate = startRate
+        self.endRate = endRate
+        self.duration = duration
+
+    def __call__(self, elapsed):
+        if elapsed >= self.duration:
+            return self.endRate
+        return self.startRate + ( self.endRate - self.startRate ) * elapsed / self.duration
+
+class StepRate:
+    """Load profile of ( start second, rate ) steps, each rate holds until the next step"""
+
+    def __init__(self, steps):
+        self.steps = sorted( steps )
+        self.starts = [ start for start, rate in self.steps ]
+
+    def __call__(self, elapsed):
+        index = bisect.bisect_right( self.starts, elapsed ) - 1
+        return self.steps[ max( index, 0 ) ][1]
+
+class SinusoidalRate:
+    """Load profile oscillating around meanRate by amplitude with a period in seconds"""
+
+    def __init__(self, meanRate, amplitude, period):
+        self.meanRate = meanRate
+        self.amplitude = amplitude
+        self.period = period
+
+    def __call__(self, elapsed):
+        return max( 0, self.meanRate + self.amplitude * math.sin( 2 * math.pi * elapsed / self.period ) )
+
+class ScaledRate:
+    """Load profile at share times the rate of another profile, eg. the share of one of several producers"""
+
+    def __init__(self, profile, share):
+        self.profile = profile
+        self.share = share
+
+    def __call__(self, elapsed):
+        return self.profile( elapsed ) * self.share
+
+class CsvReplay(StepRate):
+    """Load profile replayed from a csv file of second,rate rows, eg. rates recorded in production
+
+    Rows which do not parse, like a header, are skipped. With loop set the profile
+    restarts once the last row has been played for as long as the previous one"""
+
+    def __init__(self, path, loop=False):
+        steps = []
+        with open( path, newline="" ) as f:
+            for row in csv.reader( f ):
+                try:
+                    steps.append( ( float( row[0] ), float( row[1] ) ) )
+                except ( ValueError, IndexError ):
+                    continue
+        if not steps:
+            raise Exception("No second,rate rows in load profile {}".format( path ))
+        super().__init__( steps )
+        self.loop = loop
+        last = self.starts[-1]
+        self.length = last + ( last - self.starts[-2] if len( self.starts ) > 1 else 1 )
+
+    def __call__(self, elapsed):
+        if self.loop:
+            elapsed = elapsed % self.length
+        return super().__call__( elapsed )
+
+def parse_profile( spec, rate=None ):
+    """[ build a load profile from a command line spec ]
+
+    constant uses rate, ramp:START:END:SECONDS, step:SECOND=RATE,SECOND=RATE,
+    sine:MEAN:AMPLITUDE:PERIOD, csv:PATH or csv:PATH:loop
+
+    Arguments:
+        spec {[String]} -- [ profile spec ]
+
+    Keyword Arguments:
+        rate {[ float ]} -- [ rate of the constant profile ] (default: {None})
+
+    Raises:
+        Exception: [ unknown or malformed profile ]
+
+    Returns:
+        [ callable ] -- [ rate at a number of elapsed seconds ]
+    """
+    kind, _, options = ( spec or "constant" ).partition( ":" )
+    try:
+        if kind == "constant":
+            return ConstantRate( float( options ) if options else float( rate ) )
+        if kind == "ramp":
+            startRate, endRate, duration = options.split( ":" )
+            return LinearRamp( float( startRate ), float( endRate ), float( duration ) )
+        if kind == "step":
+            return StepRate( [ tuple( float( value ) for value in step.split( "=" ) ) for step in options.split( "," ) ] )
+        if kind == "sine":
+            meanRate, amplitude, period = options.split( ":" )
+            return SinusoidalRate( float( meanRate ), float( amplitude ), float( period ) )
+        if kind == "csv":
+            path, _, loop = options.partition( ":" )
+            return CsvReplay( path, loop == "loop" )
+    except ( ValueError, TypeError ):
+        pass
+    raise Exception("Invalid load profile {}".format( spec ))
+
+class RateController:
+    """Paces a producer along a load profile in records or bytes per second
+
+    The token bucket rate follows the profile as time passes, burst is the number
+    of seconds of the current rate which can be sent back to back after an idle period"""
+
+    def __init__(self, profile, unit="records", burstSeconds=1.0, clock=monotonic):
+        if unit not in RATE_UNITS:
+            raise Exception("Unknown rate unit {}".format( unit ))
+        self.profile = profile
+        self.unit = unit
+        self.burstSeconds = burstSeconds
+        self.clock = clock
+        self.startedAt = None
+        self.bucket = None
+
+    def reserve(self, size):
+        """[ account for one record ]
+
+        Arguments:
+            size {[ int ]} -- [ bytes of the record ]
+
+        Returns:
+            [ float ] -- [ seconds to wait before the next record, None while the profile rate is 0 ]
+        """
+        now = self.clock()
+        if self.startedAt is None:
+            self.startedAt = now
+        rate = self.profile( now - self.startedAt )
+        burst = max( rate * self.burstSeconds, 1 if self.unit == "records" else size )
+        if self.bucket is None:
+            self.bucket = TokenBucket( rate, burst, self.clock )
+        else:
+            self.bucket.set_rate( rate, burst )
+        return self.bucket.reserve( size if self.unit == "bytes" else 1 )
+
+    def acquire(self, size):
+        """[ account for one record, sleeping to keep the profile rate ]
+
+        Arguments:
+            size {[ int ]} -- [ bytes of the record ]
+        """
+        delay = self.reserve( size )
+        while delay is None:
+            sleep( IDLE_POLL_INTERVAL )
+            delay = self.reserve( size )
+        if delay:
+            sleep( delay )
@@ -0,0 +1,163 @@
+import bisect
+import hashlib
+import itertools
+import random
+import uuid
+
+MAX_HASH_KEY = 2 ** 128 - 1
+
+def partition_key_hash( partitionKey ):
+    """[ hash a partition key the way kinesis does to pick a shard ]
+
+    Arguments:
+        partitionKey {[String]} -- [ partition key ]
+
+    Returns:
+        [ int ] -- [ 128 bit hash key ]
+    """
+    return int( hashlib.md5( partitionKey.encode() ).hexdigest(), 16 )
+
+class FixedPartitionKey:
+    """Key strategy sending every record with the same partition key, all records land on one shard"""
+
+    def __init__(self, partitionKey='8.8.8.8'):
+        self.partitionKey = partitionKey
+
+    def __call__(self, router, data):
+        return self.partitionKey, None
+
+class RandomPartitionKey:
+    """Key strategy using a random partition key per record, kinesis md5 spreads them over the shards"""
+
+    def __call__(self, router, data):
+        return uuid.uuid4().hex, None
+
+class RoundRobinExplicitHashKey:
+    """Key strategy cycling through the open shards and pinning each record with ExplicitHashKey
+    to the middle of the shard hash key range"""
+
+    def __init__(self, partitionKey='8.8.8.8'):
+        self.partitionKey = partitionKey
+        self.counter = itertools.count()
+
+    def __call__(self, router, data):
+        shard = router.shards[ next( self.counter ) % len( router.shards ) ]
+        middle = ( shard['StartingHashKey'] + shard['EndingHashKey'] ) // 2
+        return self.partitionKey, str( middle )
+
+class HashKeySlice:
+    """Key strategy confining records to slice index of count equal slices of the hash key space,
+    with a random ExplicitHashKey inside the slice. Producers with different slices never
+    write to the same part of the stream, with as many slices as shards each owns a shard"""
+
+    def __init__(self, index, count, partitionKey='8.8.8.8', seed=None):
+        self.startingHashKey = MAX_HASH_KEY * index // count + ( 1 if index else 0 )
+        self.endingHashKey = MAX_HASH_KEY * ( index + 1 ) // count
+        self.partitionKey = partitionKey
+        self.rng = random.Random( seed )
+
+    def __call__(self, router, data):
+        return self.partitionKey, str( self.rng.randint( self.startingHashKey, self.endingHashKey ) )
+
+class ShardRouter:
+    """Routes records to the open shards of a stream
+
+    Reads the shard hash key ranges with describe_stream, picks the partition key and
+    ExplicitHashKey of each record with a pluggable key strategy and keeps per shard
+    record and byte counts so skew is visible before the shards throttle"""
+
+    def __init__(self, kinesisClient, streamName, strategy=None, description=None):
+        self.kinesisClient = kinesisClient
+        self.streamName = streamName
+        self.strategy = strategy or RoundRobinExplicitHashKey()
+        self.shards = []
+        self.startingHashKeys = []
+        self.counts = {}
+        self.refresh( description )
+
+    def refresh(self, description=None):
+        """[ reload the open shards and their hash key ranges from describe_stream ]
+
+        Keyword Arguments:
+            description {[ dict ]} -- [ complete StreamDescription already at hand, saves the describe_stream calls ] (default: {None})
+        """
+        if description and description.get('Shards') and not description.get('HasMoreShards'):
+            shards = description['Shards']
+        else:
+            shards = []
+            kwargs = { 'StreamName': self.streamName }
+            while True:
+                description = self.kinesisClient.describe_stream( **kwargs )['StreamDescription']
+                shards.extend( description['Shards'] )
+                if not description.get('HasMoreShards'):
+                    break
+                kwargs['ExclusiveStartShardId'] = description['Shards'][-1]['ShardId']
+
+        openShards = [ {
+            'ShardId': shard['ShardId'],
+            'StartingHashKey': int( shard['HashKeyRange']['StartingHashKey'] ),
+            'EndingHashKey': int( shard['HashKeyRange']['EndingHashKey'] )
+        } for shard in shards if 'EndingSequenceNumber' not in shard['SequenceNumberRange'] ]
+
+        if len( openShards ) == 0:
+            raise Exception("Stream {} has no open shards".format( self.streamName ))
+
+        self.shards = sorted( openShards, key=lambda shard: shard['StartingHashKey'] )
+        self.startingHashKeys = [ shard['StartingHashKey'] for shard in self.shards ]
+        for shard in self.shards:
+            self.counts.setdefault( shard['ShardId'], { 'records': 0, 'bytes': 0 } )
+
+    def shard_for_hash_key(self, hashKey):
+        """[ find the open shard owning a hash key ]
+
+        Arguments:
+            hashKey {[ int ]} -- [ 128 bit hash key ]
+
+        Returns:
+            [ String ] -- [ shard id ]
+        """
+        index = bisect.bisect_right( self.startingHashKeys, hashKey ) - 1
+        return self.shards[ max( index, 0 ) ]['ShardId']
+
+    def route(self, data):
+        """[ pick partition key and explicit hash key for a record and count it against its shard ]
+
+        Arguments:
+            data {[ bytes ]} -- [ record data ]
+
+        Returns:
+            [ tuple ] -- [ ( partitionKey, explicitHashKey or None, shardId ) ]
+        """
+        partitionKey, explicitHashKey = self.strategy( self, data )
+        if explicitHashKey is None:
+            shardId = self.shard_for_hash_key( partition_key_hash( partitionKey ) )
+        else:
+            shardId = self.shard_for_hash_key( int( explicitHashKey ) )
+
+        count = self.counts[ shardId ]
+        count['records'] += 1
+        count['bytes'] += len( data ) + len( partitionKey )
+        return partitionKey, explicitHashKey, shardId
+
+    def hot_shards(self, threshold=1.5):
+        """[ shards which received more than threshold times the mean record count ]
+
+        Keyword Arguments:
+            threshold {float} -- [ skew ratio to the mean ] (default: {1.5})
+
+        Returns:
+            [ List<String> ] -- [ shard ids ]
+        """
+        total = sum( count['records'] for count in self.counts.values() )
+        if total == 0:
+            return []
+        mean = total / len( self.counts )
+        return [ shardId for shardId, count in self.counts.items() if count['records'] > mean * threshold ]
+
+    def report(self):
+        """print per shard record and byte counts and the hot shards"""
+        for shardId, count in sorted( self.counts.items() ):
+            print( "{} records {} bytes {}".format( shardId, count['records'], count['bytes'] ) )
+        hotShards = self.hot_shards()
+        if hotShards:
+            print( "hot shards in {}: {}".format( self.streamName, ", ".join( hotShards ) ) )
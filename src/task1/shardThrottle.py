@@ -0,0 +1,137 @@
+import random
+import threading
+from src.clock import monotonic
+from src.task1.rateControl import TokenBucket
+
+SHARD_MAX_RECORDS_PER_SECOND = 1000 # kinesis write limit of a shard
+SHARD_MAX_BYTES_PER_SECOND = 1024 * 1024 # kinesis write limit of a shard, data + partition key
+DEFAULT_INCREASE = 0.05 # fraction of the shard limit given back after each successful request
+DEFAULT_DECREASE = 0.5 # factor applied to the shard rate after a throttled request
+DEFAULT_MIN_FRACTION = 0.02
+DEFAULT_RETRY_DELAY = 0.1
+DEFAULT_MAX_RETRY_DELAY = 5
+
+# put_record(s) errors of a shard over its limits
+THROTTLING_ERROR_CODES = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'KMSThrottlingException'
+}
+
+# put_record(s) errors worth retrying, the others end the run
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | {
+    'InternalFailure',
+    'InternalFailureException',
+    'ServiceUnavailable',
+    'ServiceUnavailableException'
+}
+
+class ShardState:
+    """Rate of one shard as a fraction of its limits, with the token buckets enforcing it"""
+
+    def __init__(self, recordsPerSecond, bytesPerSecond, clock):
+        self.fraction = 1.0
+        self.records = TokenBucket( recordsPerSecond, recordsPerSecond, clock )
+        self.bytes = TokenBucket( bytesPerSecond, bytesPerSecond, clock )
+        self.consecutiveThrottles = 0
+        self.sentRecords = 0
+        self.throttles = 0
+
+class ShardThrottle:
+    """Per shard throughput accounting against the 1000 records/s and 1 MB/s shard write limits
+
+    Each shard starts at its full limits and adapts AIMD style: a throttled request halves the
+    shard rate (multiplicative decrease) and each successful request gives back a small fraction
+    of the limits (additive increase). reserve tells how long a record has to wait for its shard,
+    so a producer can hold back the records of a hot shard while the others keep flowing.
+    Shard None stands for the whole stream when records are not routed"""
+
+    def __init__(self, recordsPerSecond=SHARD_MAX_RECORDS_PER_SECOND, bytesPerSecond=SHARD_MAX_BYTES_PER_SECOND,
+                 increase=DEFAULT_INCREASE, decrease=DEFAULT_DECREASE, minFraction=DEFAULT_MIN_FRACTION,
+                 retryDelay=DEFAULT_RETRY_DELAY, maxRetryDelay=DEFAULT_MAX_RETRY_DELAY, clock=monotonic):
+        self.recordsPerSecond = recordsPerSecond
+        self.bytesPerSecond = bytesPerSecond
+        self.increase = increase
+        self.decrease = decrease
+        self.minFraction = minFraction
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.clock = clock
+        self.shards = {}
+        self.lock = threading.Lock()
+
+    def shard(self, shardId):
+        with self.lock:
+            state = self.shards.get( shardId )
+            if state is None:
+                state = self.shards[ shardId ] = ShardState( self.recordsPerSecond, self.bytesPerSecond, self.clock )
+            return state
+
+    def set_fraction(self, state, fraction):
+        state.fraction = fraction
+        state.records.set_rate( self.recordsPerSecond * fraction, max( self.recordsPerSecond * fraction, 1 ) )
+        state.bytes.set_rate( self.bytesPerSecond * fraction, self.bytesPerSecond * fraction )
+
+    def reserve(self, shardId, records, size):
+        """[ take the records and bytes of a request from the shard budget ]
+
+        Arguments:
+            shardId {[String]} -- [ shard id ]
+            records {[ int ]} -- [ number of records ]
+            size {[ int ]} -- [ bytes of data and partition keys ]
+
+        Returns:
+            [ float ] -- [ seconds to wait before sending, 0 when within the shard budget ]
+        """
+        state = self.shard( shardId )
+        return max( state.records.reserve( records ), state.bytes.reserve( size ) )
+
+    def on_success(self, shardId, records=1):
+        """[ additive increase of the shard rate after a successful request ]
+
+        Arguments:
+            shardId {[String]} -- [ shard id ]
+
+        Keyword Arguments:
+            records {int} -- [ records which reached the shard ] (default: {1})
+        """
+        state = self.shard( shardId )
+        with self.lock:
+            state.sentRecords += records
+            state.consecutiveThrottles = 0
+            if state.fraction < 1:
+                self.set_fraction( state, min( 1.0, state.fraction + self.increase ) )
+
+    def on_throttled(self, shardId):
+        """[ multiplicative decrease of the shard rate after a throttled request ]
+
+        Arguments:
+            shardId {[String]} -- [ shard id ]
+
+        Returns:
+            [ float ] -- [ seconds to wait before retrying, growing with consecutive throttles ]
+        """
+        state = self.shard( shardId )
+        with self.lock:
+            state.throttles += 1
+            state.consecutiveThrottles += 1
+            self.set_fraction( state, max( self.minFraction, state.fraction * self.decrease ) )
+            state.records.drain()
+            state.bytes.drain()
+            return self.retry_delay( state.consecutiveThrottles )
+
+    def retry_delay(self, attempt):
+        """[ jittered exponential backoff ]
+
+        Arguments:
+            attempt {[ int ]} -- [ 1 for the first retry ]
+
+        Returns:
+            [ float ] -- [ seconds ]
+        """
+        return random.uniform( 0.5, 1 ) * min( self.maxRetryDelay, self.retryDelay * 2 ** ( attempt - 1 ) )
+
+    def report(self):
+        """print the rate and throttles of each shard"""
+        for shardId, state in sorted( self.shards.items(), key=lambda item: str( item[0] ) ):
+            print( "{} rate {:.0f}% records {} throttled {}".format( shardId or "stream", state.fraction * 100, state.sentRecords, state.throttles ) )
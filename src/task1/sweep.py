@@ -0,0 +1,291 @@
+import datetime
+import itertools
+import json
+import threading
+import time
+import uuid
+from argparse import ArgumentParser
+
+from src.backends import Backend, BACKENDS
+from src.teardown import Teardown
+
+# sweep parameter -> ( task1_kinesis keyword, type ), a dotted keyword is a key of a dict keyword
+PARAMETERS = {
+    'shards': ( "shardCount", int ),
+    'records': ( "totalTimes", int ),
+    'batchSize': ( "batchSize", int ),
+    'payloadSize': ( "payloadSize", int ),
+    'interval': ( "sleepInterval", float ),
+    'rate': ( "rate", float ),
+    'engine': ( "engine", str ),
+    'inFlight': ( "maxInFlight", int ),
+    'aggregate': ( "aggregate", lambda value: value.lower() in ( "1", "true", "yes" ) ),
+    'compression': ( "compression", str ),
+    'workers': ( "workers", int ),
+    'bufferingInterval': ( "bufferingHints.IntervalInSeconds", int ),
+    'bufferingSize': ( "bufferingHints.SizeInMBs", int )
+}
+DEFAULT_MAX_CELLS = 4
+DEFAULT_SHARD_BUDGET = 8 # shards open at once over all the running cells
+
+def parse_grid( specs ):
+    """[ parse name=value,value,... specs into a parameter grid ]
+
+    Arguments:
+        specs {[ List<String> ]} -- [ eg. [ "shards=1,2", "bufferingInterval=60,300" ] ]
+
+    Raises:
+        Exception: [ unknown parameter or malformed spec ]
+
+    Returns:
+        [ dict ] -- [ parameter name to list of values, in the order of the specs ]
+    """
+    grid = {}
+    for spec in specs:
+        if "=" not in spec:
+            raise Exception("Malformed sweep parameter {}, expect name=value,value".format( spec ))
+        name, values = spec.split( "=", 1 )
+        if name not in PARAMETERS:
+            raise Exception("Unknown sweep parameter {}, expect one of {}".format( name, ", ".join( PARAMETERS ) ))
+        grid[ name ] = [ PARAMETERS[ name ][1]( value ) for value in values.split( "," ) ]
+    return grid
+
+def grid_cells( grid ):
+    """[ every combination of the grid values ]
+
+    Arguments:
+        grid {[ dict ]} -- [ parameter name to list of values ]
+
+    Returns:
+        [ List<dict> ] -- [ parameter name to value of each cell ]
+    """
+    names = list( grid )
+    return [ dict( zip( names, values ) ) for values in itertools.product( *[ grid[ name ] for name in names ] ) ]
+
+def cell_options( cell ):
+    """[ task1_kinesis keyword arguments of a cell ]
+
+    Arguments:
+        cell {[ dict ]} -- [ parameter name to value ]
+
+    Returns:
+        [ dict ] -- [ keyword arguments ]
+    """
+    options = {}
+    for name, value in cell.items():
+        keyword = PARAMETERS[ name ][0]
+        if "." in keyword:
+            keyword, key = keyword.split( "." )
+            options.setdefault( keyword, {} )[ key ] = value
+        else:
+            options[ keyword ] = value
+    return options
+
+class ResourceBudget:
+    """Bounds the cells running at once and the shards they hold
+
+    A cell waits until fewer than maxCells cells run and its shards fit in maxShards.
+    A cell larger than the whole budget runs once nothing else runs, rather than never"""
+
+    def __init__(self, maxCells=DEFAULT_MAX_CELLS, maxShards=DEFAULT_SHARD_BUDGET):
+        self.maxCells = maxCells
+        self.maxShards = maxShards
+        self.cells = 0
+        self.shards = 0
+        self.peakCells = 0
+        self.peakShards = 0
+        self.condition = threading.Condition()
+
+    def fits(self, shards):
+        if self.cells == 0:
+            return True
+        return self.cells < self.maxCells and self.shards + shards <= self.maxShards
+
+    def acquire(self, shards):
+        """[ wait until a cell of shards shards fits in the budget ]
+
+        Arguments:
+            shards {[ int ]} -- [ shards of the cell ]
+        """
+        with self.condition:
+            self.condition.wait_for( lambda: self.fits( shards ) )
+            self.cells += 1
+            self.shards += shards
+            self.peakCells = max( self.peakCells, self.cells )
+            self.peakShards = max( self.peakShards, self.shards )
+
+    def release(self, shards):
+        """[ give back the budget of a finished cell ]
+
+        Arguments:
+            shards {[ int ]} -- [ shards of the cell ]
+        """
+        with self.condition:
+            self.cells -= 1
+            self.shards -= shards
+            self.condition.notify_all()
+
+class SweepRunner:
+    """Runs task1 for every cell of a parameter grid and compares them
+
+    Each cell gets its own stream, stack, bucket and delivery stream named after
+    prefix and the cell index, so cells never share a resource. Cells run concurrently
+    within a ResourceBudget, in grid order. Unless keep is set the stream of a cell is
+    deleted as soon as it finishes, giving its shards back, and a Teardown of the prefix
+    removes the stacks, buckets and delivery streams of every cell at the end. The
+    producer throughput and put latency of each cell are collected and with verify the
+    produce to S3 latency too, which is what the firehose buffering hints move"""
+
+    def __init__(self, grid, prefix=None, options=None, budget=None, verify=False, keep=False):
+        self.grid = grid
+        self.cells = grid_cells( grid )
+        self.prefix = prefix or "sweep" + uuid.uuid4().hex[:6]
+        self.options = options or {}
+        self.budget = budget or ResourceBudget()
+        self.verify = verify
+        self.keep = keep
+        self.results = [ None ] * len( self.cells )
+
+    def project_name(self, index):
+        return "{}C{}".format( self.prefix, index )
+
+    def run_cell(self, index):
+        """[ provision, produce and clean up one cell ]
+
+        Arguments:
+            index {[ int ]} -- [ cell index ]
+
+        Returns:
+            [ dict ] -- [ cell result, with the error instead of the stats when it failed ]
+        """
+        from src.task1.kinesis import task1_kinesis, clean_up_kinesis
+
+        cell = self.cells[ index ]
+        projectName = self.project_name( index )
+        options = dict( self.options, verify=self.verify, verbose=False )
+        options.update( cell_options( cell ) )
+        result = { 'cell': index, 'projectName': projectName, 'parameters': cell, 'error': None }
+        start = time.time()
+        try:
+            results = task1_kinesis( projectName, **options )
+            stats = results["producer"].stats()
+            result.update( {
+                'records': stats['sentRecords'],
+                'failedRecords': stats['failedRecords'],
+                'bytes': stats['sentBytes'],
+                'seconds': stats['seconds'],
+                'recordsPerSecond': stats['recordsPerSecond'],
+                'bytesPerSecond': stats['bytesPerSecond'],
+                'putLatency': stats['latency'].to_dict() if stats['latency'] is not None else None
+            } )
+            if "verify" in results:
+                verifier = results["verify"]
+                result['delivered'] = len( verifier.sequenceNumbers )
+                result['deliveryLatency'] = verifier.latency.to_dict()
+        except Exception as e:
+            result['error'] = str( e )
+        if not self.keep:
+            try:
+                clean_up_kinesis( projectName )
+            except Exception as e:
+                result['error'] = result['error'] or "Fails to delete the stream: {}".format( e )
+        result['wall'] = time.time() - start
+        return result
+
+    def run(self):
+        """[ run every cell within the budget ]
+
+        Returns:
+            [ dict ] -- [ machine readable report ]
+        """
+        from src.task1.benchmark import current_commit
+
+        def run_within_budget( index ):
+            shards = cell_options( self.cells[ index ] ).get( "shardCount", self.options.get( "shardCount", 1 ) )
+            self.budget.acquire( shards )
+            try:
+                self.results[ index ] = self.run_cell( index )
+            finally:
+                self.budget.release( shards )
+
+        start = time.time()
+        threads = []
+        for index in range( len( self.cells ) ):
+            thread = threading.Thread( target=run_within_budget, args=( index, ), name="sweep-{}".format( index ), daemon=True )
+            thread.start()
+            threads.append( thread )
+        for thread in threads:
+            thread.join()
+        left = []
+        if not self.keep:
+            teardown = Teardown( self.prefix )
+            teardown.run()
+            teardown.report()
+            left = teardown.failures
+        return {
+            'commit': current_commit(),
+            'createdAt': datetime.datetime.utcnow().isoformat() + "Z",
+            'prefix': self.prefix,
+            'grid': self.grid,
+            'options': self.options,
+            'budget': { 'maxCells': self.budget.maxCells, 'maxShards': self.budget.maxShards,
+                'peakCells': self.budget.peakCells, 'peakShards': self.budget.peakShards },
+            'seconds': time.time() - start,
+            'results': self.results,
+            'left': left
+        }
+
+def milliseconds( latency, percentile ):
+    return "{:.1f}".format( latency[ percentile ] * 1000 ) if latency and latency.get( percentile ) is not None else "-"
+
+def seconds( latency, percentile ):
+    return "{:.1f}".format( latency[ percentile ] ) if latency and latency.get( percentile ) is not None else "-"
+
+def print_report( report ):
+    """[ print the cells from the highest throughput down, relative to the best cell ]
+
+    Arguments:
+        report {[ dict ]} -- [ report of SweepRunner.run ]
+    """
+    results = [ result for result in report['results'] if result and not result['error'] ]
+    best = max( [ result['recordsPerSecond'] for result in results ] or [ 0 ] )
+    print( "{:<48} {:>11} {:>10} {:>6} {:>9} {:>9} {:>10} {:>10} {:>7}".format(
+        "cell", "records/s", "KiB/s", "best", "put p50", "put p99", "s3 p50 s", "s3 p95 s", "failed" ) )
+    for result in sorted( results, key=lambda result: -result['recordsPerSecond'] ):
+        parameters = " ".join( "{}={}".format( name, value ) for name, value in result['parameters'].items() )
+        print( "{:<48} {:>11.1f} {:>10.1f} {:>5.0f}% {:>9} {:>9} {:>10} {:>10} {:>7}".format(
+            parameters, result['recordsPerSecond'], result['bytesPerSecond'] / 1024,
+            result['recordsPerSecond'] * 100 / best if best else 0,
+            milliseconds( result['putLatency'], 'p50' ), milliseconds( result['putLatency'], 'p99' ),
+            seconds( result.get('deliveryLatency'), 'p50' ), seconds( result.get('deliveryLatency'), 'p95' ), result['failedRecords'] ) )
+    for result in report['results']:
+        if result and result['error']:
+            print( "cell {} {} failed: {}".format( result['cell'], result['parameters'], result['error'] ) )
+    budget = report['budget']
+    print( "sweep {} ran {} cells in {:.1f}s, peak {} cells and {} shards at once".format(
+        report['prefix'], len( report['results'] ), report['seconds'], budget['peakCells'], budget['peakShards'] ) )
+
+if __name__ == '__main__':
+    parser = ArgumentParser( description="Run task1 over a parameter grid and compare throughput and latency" )
+    parser.add_argument( "grid", nargs="+", help="name=value,value,... among {}".format( ", ".join( PARAMETERS ) ) )
+    parser.add_argument( "--prefix", help="Name prefix of every cell resource, random by default" )
+    parser.add_argument( "--backend", choices=BACKENDS, default="localstack", help="Backend the cells run against" )
+    parser.add_argument( "--max-cells", type=int, default=DEFAULT_MAX_CELLS, dest="maxCells", help="Cells running at once" )
+    parser.add_argument( "--shard-budget", type=int, default=DEFAULT_SHARD_BUDGET, dest="shardBudget", help="Shards open at once over all the cells" )
+    parser.add_argument( "--verify", action="store_true", help="Wait for the S3 delivery of each cell and report its latency" )
+    parser.add_argument( "--keep", action="store_true", help="Keep the resources of each cell" )
+    parser.add_argument( "--output", help="Write the json report to this file" )
+    args = parser.parse_args()
+
+    grid = parse_grid( args.grid )
+    backend = Backend( args.backend ).start()
+    try:
+        runner = SweepRunner( grid, args.prefix, {}, ResourceBudget( args.maxCells, args.shardBudget ),
+            args.verify, args.keep )
+        report = runner.run()
+    finally:
+        backend.stop()
+    print_report( report )
+    if args.output:
+        with open( args.output, "w" ) as f:
+            json.dump( report, f, indent=2 )
@@ -1,125 +1,48 @@
-import sys, os, random, string, boto3
-from troposphere import Base64, FindInMap, GetAtt, Join, Output, Select, GetAZs
-from troposphere import Parameter, Ref, Tags, Template
-from troposphere.autoscaling import ( 
-    LaunchConfiguration,
-    AutoScalingGroup
-)
-from troposphere.policies import (
-    AutoScalingReplacingUpdate, AutoScalingRollingUpdate, UpdatePolicy
-)
-
-from src.utils import (
-    wait_resource,
-    create_security_group_rule,
-    create_security_group_resource
-) 
+from src.clients import get_client
+from src.waiter import DEFAULT_WAIT_TIMEOUT
+from src.task2.healthTracker import HealthTracker
+from src.task2.rollingRebuild import RollingRebuild, MAX_BATCH_SIZE, MIN_INSTANCES_IN_SERVICE, DEFAULT_MAX_FAILURES
 
+# the cloudformation template of the group lives in autoscalingTemplate, so rebuilding never imports troposphere
 MOCK_KEY_PAIR_NAME="MOCK_KEY_PAIR_NAME" # assume we key pair 
 MOCK_IMAGE_ID="MOCK_IMAGE_ID" # assume we already create an image from existing instance and have init scipts run on reboot
 
-zone1 = Select( 0, GetAZs( Ref('AWS::Region')) )
-zone2 = Select( 1, GetAZs( Ref('AWS::Region')) )
+def create_autoscaling_group( name, desiredCapacity=10 ):
+    """[ create the task2 group through the API when it does not exist, eg. on an in-process backend
+        where nothing was provisioned, with the capacity of create_autoscaling_resource ]
 
-def create_launch_configuration_resource( name, securityGroups ):
-    """[create simple]
-    
     Arguments:
-        name {[type]} -- [description]
-        securityGroups {[List<String>]} -- [ list of security refs ]
-    
-    Returns:
-        [ troposphere.resource ] -- [ LaunchConfiguration ]
-    """
-    return LaunchConfiguration(
-        name,
-        ImageId=MOCK_IMAGE_ID,
-        KeyName=MOCK_KEY_PAIR_NAME,
-        InstanceType="m1.small",
-        SecurityGroups=securityGroups,
-        Tags=Tags(
-            Application=Ref('AWS::StackId'),
-            Name=Join("", [Ref('AWS::StackName'), "-LaunchConfiguration"])
-        )
-    )
+        name {[String]} -- [ autoscaling group name ]
+
+    Keyword Arguments:
+        desiredCapacity {int} -- [ number of instances ] (default: {10})
 
-def create_autoscaling_resource( name, launchConfig ):
-    """[ create simple autoscaling resource ]
-    
-    Arguments:
-        name {[String]} -- [ name ]
-        launchConfig {[LaunchConfiguration]} -- [description]
-    
     Returns:
-        [ troposphere.resource ] -- [ AutoScalingGroup ]
+        [ bool ] -- [ True when the group was created ]
     """
-    return AutoScalingGroup(
-        name+"AutoScalingGroup",
-        DesiredCapacity=10,
+    autoscalingClient = get_client('autoscaling')
+    ec2Client = get_client('ec2')
+    if autoscalingClient.describe_auto_scaling_groups( AutoScalingGroupNames=[ name ] ).get('AutoScalingGroups'):
+        return False
+
+    images = ec2Client.describe_images( Owners=[ 'amazon' ] ).get('Images')
+    zones = [ zone['ZoneName'] for zone in ec2Client.describe_availability_zones().get('AvailabilityZones') ][:2]
+    launchConfigName = name + "LaunchConfiguration"
+    autoscalingClient.create_launch_configuration(
+        LaunchConfigurationName=launchConfigName,
+        ImageId=images[0]['ImageId'] if images else MOCK_IMAGE_ID,
+        InstanceType="m1.small"
+    )
+    autoscalingClient.create_auto_scaling_group(
         AutoScalingGroupName=name,
-        LaunchConfigurationName=Ref(launchConfig),
-        MinSize=9,
-        MaxSize=10,
-        AvailabilityZones=[Ref(zone1), Ref(zone2)],
-        HealthCheckType="EC2",
-        UpdatePolicy=UpdatePolicy(
-            AutoScalingReplacingUpdate=AutoScalingReplacingUpdate(
-                WillReplace=True,
-            ),
-            AutoScalingRollingUpdate=AutoScalingRollingUpdate(
-                PauseTime='PT5M',
-                MinInstancesInService="1",
-                MaxBatchSize='1',
-                WaitOnResourceSignals=True
-            )
-        ),
-        Tags=Tags(
-            Application=Ref('AWS::StackId')
-        )
+        LaunchConfigurationName=launchConfigName,
+        MinSize=desiredCapacity - 1,
+        MaxSize=desiredCapacity,
+        DesiredCapacity=desiredCapacity,
+        AvailabilityZones=zones,
+        HealthCheckType="EC2"
     )
-
-def create_autoscaling_stack( projectName ):
-
-    cloudformationClient=boto3.client('cloudformation', endpoint_url='http://localhost:4581', region_name='us-west-2' )
-
-    t = Template()
-
-    t.set_version('2010-09-09')
-
-    t.set_description("LocalStackTests Task two cloud formation template of AutoScalingGroup ")
-
-    ssh_rule = create_security_group_rule( "tcp", "22", "22", "0.0.0.0/0" )
-    http_rule = create_security_group_rule( "tcp", "80", "80", "0.0.0.0/0" ) # assume we are ruing on 80 port 80
-    ec2SecurityGroup = create_security_group_resource( projectName+"EC2SecurityGroup", [ ssh_rule, http_rule ], "EC2 Security Group" )
-
-    launchConfigName=projectName + "LaunchConfiguration"
-
-    launchConfig = create_launch_configuration_resource( launchConfigName, [ Ref(ec2SecurityGroup) ] )
-
-    autoscaling = create_autoscaling_resource( projectName, launchConfig )
- 
-    t.add_resource( ec2SecurityGroup )
-    t.add_resource( launchConfig )
-    t.add_resource( autoscaling )
-
-    stackName=projectName+'Task2'
-
-    try:
-        task2_stack=cloudformationClient.create_stack(
-            StackName=stackName,
-            TemplateBody=t.to_yaml()
-        )
-    except Exception as e:
-        # TODO: check other exceptions
-        pass
-
-    stackReady=wait_resource( cloudformationClient.describe_stacks, check_cloudformation_stack_complete, 10, StackName=stackName )
-
-    if stackReady:
-        res = cloudformationClient.describe_stacks( StackName=stackName )
-        return res['Stacks'][0]
-    else:
-        raise Exception("Fails to get recently created stack, try to wait for more time")
+    return True
 
 def check_autoscaling_instance_health( response ):
     instances = response.get("AutoScalingInstances")
@@ -127,9 +50,9 @@ def check_autoscaling_instance_health( response ):
         raise Exception("unexpected response from describe autoscaling instances expect at least one instance") 
     instance = instances[0]
 
-    return instance.get(HealthStatus) == "HEALTHY"
+    return instance.get("HealthStatus", "").upper() == "HEALTHY"
 
-def rebuild_instance_from_auto_scaling_group( instanceId, autoScalingGroupName ):
+def rebuild_instance_from_auto_scaling_group( instanceId, autoScalingGroupName, healthTracker=None ):
     """[rebuild one instance from auto scaling group ]
     1. detach_instances from auto scaling group
     2. reboot the instance -- the rebuild script should run on reboot eg: when first create ec2 
@@ -142,18 +65,23 @@ def rebuild_instance_from_auto_scaling_group( instanceId, autoScalingGroupName )
     Arguments:
         instanceId {[type]} -- [description]
         autoScalingGroupName {[type]} -- [description]
+
+    Keyword Arguments:
+        healthTracker {[ HealthTracker ]} -- [ tracker of the group shared between rebuilds ] (default: {None})
     
     Returns:
         [type] -- [description]
     """
-    autoscalingClient = boto3.client('autoscaling')
-    ec2Client = boto3.client('ec2')
+    autoscalingClient = get_client('autoscaling')
+    ec2Client = get_client('ec2')
 
-    # 1. detach instances
+    # 1. detach instances, without a replacement instance being launched
     autoscalingClient.detach_instances(
         InstanceIds=[
             instanceId
-        ]
+        ],
+        AutoScalingGroupName=autoScalingGroupName,
+        ShouldDecrementDesiredCapacity=True
     )
 
     # 2. reboot instance
@@ -172,9 +100,10 @@ def rebuild_instance_from_auto_scaling_group( instanceId, autoScalingGroupName )
     )
 
     # 4. wait for instance become health
-    instanceHealth=wait_resource( autoscalingClient.describe_auto_scaling_instances, check_autoscaling_instance_health, 10, InstanceIds=[ instanceId ] )
+    healthTracker = healthTracker or HealthTracker( autoScalingGroupName, autoscalingClient )
+    instanceHealth=healthTracker.wait_until_healthy( [ instanceId ], DEFAULT_WAIT_TIMEOUT )
 
-    if instanceHealth:
+    if instanceHealth.ready:
         return True
     else:
         raise Exception("Fails to wait for instance to become healthy, try to wait for more time")
@@ -185,7 +114,7 @@ def reboot_instances_in_autoscaling_group_one_by_one( autoScalingGroupName ):
     Arguments:
         autoScalingGroupName {[String]} -- [ autoScalingGroupName ]
     """
-    autoscalingClient = boto3.client('autoscaling')
+    autoscalingClient = get_client('autoscaling')
     res = autoscalingClient.describe_auto_scaling_groups(
         AutoScalingGroupNames=[
             autoScalingGroupName
@@ -201,11 +130,33 @@ def reboot_instances_in_autoscaling_group_one_by_one( autoScalingGroupName ):
     autoscaling = autoscalings[0]
 
     instances = autoscaling.get("Instances")
+    healthTracker = HealthTracker( autoScalingGroupName, autoscalingClient )
 
     for instance in instances:
-        rebuild_instance_from_auto_scaling_group( instance.get("InstanceId"), autoScalingGroupName )
+        rebuild_instance_from_auto_scaling_group( instance.get("InstanceId"), autoScalingGroupName, healthTracker )
 
-def task2_autoscaling( projectName ):
-    print( "LocalStack have not API point of Autoscaling, will use the real environment" )
-    print( "Make sure passing fake autoscaling group name or it will reboot all the instances" )
-    reboot_instances_in_autoscaling_group_one_by_one( projectName )
\ No newline at end of file
+def task2_autoscaling( projectName, maxBatchSize=MAX_BATCH_SIZE, minInService=MIN_INSTANCES_IN_SERVICE, maxFailures=DEFAULT_MAX_FAILURES, create=False ):
+    """[ rebuild the instances of the autoscaling group in rolling batches ]
+
+    Arguments:
+        projectName {[String]} -- [ autoscaling group name ]
+
+    Keyword Arguments:
+        maxBatchSize {int} -- [ instances rebuilt at once ] (default: {MAX_BATCH_SIZE})
+        minInService {int} -- [ instances kept in service ] (default: {MIN_INSTANCES_IN_SERVICE})
+        maxFailures {int} -- [ failed instances before the rebuild aborts ] (default: {DEFAULT_MAX_FAILURES})
+        create {bool} -- [ create the group first when it does not exist, see create_autoscaling_group ] (default: {False})
+
+    Returns:
+        [ bool ] -- [ True when every instance was rebuilt ]
+    """
+    if create:
+        create_autoscaling_group( projectName )
+    else:
+        print( "LocalStack have not API point of Autoscaling, will use the real environment" )
+        print( "Make sure passing fake autoscaling group name or it will reboot all the instances" )
+    rebuild = RollingRebuild( projectName, maxBatchSize, minInService, maxFailures )
+    try:
+        return rebuild.run()
+    finally:
+        rebuild.report()
\ No newline at end of file
@@ -0,0 +1,139 @@
+from troposphere import GetAZs, Join, Ref, Select, Tags, Template
+from troposphere.autoscaling import (
+    LaunchConfiguration,
+    AutoScalingGroup
+)
+from troposphere.ec2 import SecurityGroup, SecurityGroupRule
+from troposphere.policies import (
+    AutoScalingReplacingUpdate, AutoScalingRollingUpdate, UpdatePolicy
+)
+
+from src.utils import deploy_cloudformation_stack
+from src.task2.rollingRebuild import MAX_BATCH_SIZE, MIN_INSTANCES_IN_SERVICE
+from src.task2.autoscaling import MOCK_KEY_PAIR_NAME, MOCK_IMAGE_ID
+
+zone1 = Select( 0, GetAZs( Ref('AWS::Region')) )
+zone2 = Select( 1, GetAZs( Ref('AWS::Region')) )
+
+def create_security_group_rule( ipProtocol, fromPort, toPort, cidrIp ):
+    """[ create security group rule ]
+    
+    Arguments:
+        ipProtocol {[String]} -- [ ip protocol ]
+        fromPort {[Number]} -- [ start port]
+        toPort {[ Number]} -- [ end port ]
+        cidrIp {[ String ]} -- [ allow IP cidr ]
+    
+    Returns:
+        [ troposphere.Object ] -- [ SecurityGroupRule ]
+    """
+    return SecurityGroupRule(
+        IpProtocol=ipProtocol,
+        FromPort=fromPort,
+        ToPort=toPort,
+        CidrIp=cidrIp,
+    )
+
+def create_security_group_resource( name, securityGroupIngress, description ):
+    """[ create simple security group resource ]
+    
+    Arguments:
+        name {[String]} -- [ name ]
+        securityGroupIngress {[List<SecurityGroupRule>]} -- [ list of security group rules ]
+        description {[String]} -- [description]
+    
+    Returns:
+        [troposphere.resource] -- [ security group resource ]
+    """
+    return SecurityGroup(
+    name,
+    SecurityGroupIngress=securityGroupIngress, # must be array of security rules
+    GroupDescription=description,
+    Tags=Tags(
+        Application=Ref('AWS::StackId'),
+        Name=Join("", [Ref('AWS::StackName'), name])
+    )   
+)
+
+def create_launch_configuration_resource( name, securityGroups ):
+    """[create simple]
+    
+    Arguments:
+        name {[type]} -- [description]
+        securityGroups {[List<String>]} -- [ list of security refs ]
+    
+    Returns:
+        [ troposphere.resource ] -- [ LaunchConfiguration ]
+    """
+    return LaunchConfiguration(
+        name,
+        ImageId=MOCK_IMAGE_ID,
+        KeyName=MOCK_KEY_PAIR_NAME,
+        InstanceType="m1.small",
+        SecurityGroups=securityGroups,
+        Tags=Tags(
+            Application=Ref('AWS::StackId'),
+            Name=Join("", [Ref('AWS::StackName'), "-LaunchConfiguration"])
+        )
+    )
+
+def create_autoscaling_resource( name, launchConfig ):
+    """[ create simple autoscaling resource ]
+    
+    Arguments:
+        name {[String]} -- [ name ]
+        launchConfig {[LaunchConfiguration]} -- [description]
+    
+    Returns:
+        [ troposphere.resource ] -- [ AutoScalingGroup ]
+    """
+    return AutoScalingGroup(
+        name+"AutoScalingGroup",
+        DesiredCapacity=10,
+        AutoScalingGroupName=name,
+        LaunchConfigurationName=Ref(launchConfig),
+        MinSize=9,
+        MaxSize=10,
+        AvailabilityZones=[Ref(zone1), Ref(zone2)],
+        HealthCheckType="EC2",
+        UpdatePolicy=UpdatePolicy(
+            AutoScalingReplacingUpdate=AutoScalingReplacingUpdate(
+                WillReplace=True,
+            ),
+            AutoScalingRollingUpdate=AutoScalingRollingUpdate(
+                PauseTime='PT5M',
+                MinInstancesInService=str( MIN_INSTANCES_IN_SERVICE ),
+                MaxBatchSize=str( MAX_BATCH_SIZE ),
+                WaitOnResourceSignals=True
+            )
+        ),
+        Tags=Tags(
+            Application=Ref('AWS::StackId')
+        )
+    )
+
+def create_autoscaling_stack( projectName ):
+
+    t = Template()
+
+    t.set_version('2010-09-09')
+
+    t.set_description("LocalStackTests Task two cloud formation template of AutoScalingGroup ")
+
+    ssh_rule = create_security_group_rule( "tcp", "22", "22", "0.0.0.0/0" )
+    http_rule = create_security_group_rule( "tcp", "80", "80", "0.0.0.0/0" ) # assume we are ruing on 80 port 80
+    ec2SecurityGroup = create_security_group_resource( projectName+"EC2SecurityGroup", [ ssh_rule, http_rule ], "EC2 Security Group" )
+
+    launchConfigName=projectName + "LaunchConfiguration"
+
+    launchConfig = create_launch_configuration_resource( launchConfigName, [ Ref(ec2SecurityGroup) ] )
+
+    autoscaling = create_autoscaling_resource( projectName, launchConfig )
+ 
+    t.add_resource( ec2SecurityGroup )
+    t.add_resource( launchConfig )
+    t.add_resource( autoscaling )
+
+    stackName=projectName+'Task2'
+
+    return deploy_cloudformation_stack( stackName, t.to_yaml() )
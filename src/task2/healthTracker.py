@@ -0,0 +1,139 @@
+import threading
+from src import clock
+from src.clients import get_client
+from src.waiter import Waiter, WaitResult, DEFAULT_WAIT_TIMEOUT
+
+DEFAULT_MIN_REFRESH_INTERVAL = 1 # seconds, waiters polling more often share the last refresh
+TERMINAL_LIFECYCLE_STATES = { "Terminating", "Terminating:Wait", "Terminating:Proceed", "Terminated" }
+
+def is_instance_healthy( state ):
+    """[ check an instance state of the tracker is in service and healthy ]
+
+    Arguments:
+        state {[ dict ]} -- [ LifecycleState and HealthStatus ]
+
+    Returns:
+        [ Boolean ] -- [ healthy ]
+    """
+    return state is not None and state['LifecycleState'] == "InService" and state['HealthStatus'].upper() == "HEALTHY"
+
+class HealthTracker:
+    """In memory lifecycle and health state of every instance of autoscaling groups
+
+    refresh pages through describe_auto_scaling_groups once for all tracked groups,
+    so the number of calls grows with the number of pages, not of instances. Waiters
+    share the refreshes: a refresh younger than minRefreshInterval is reused, so any
+    number of concurrent wait_until_healthy calls cost one bulk poll per interval. A wait
+    only trusts refreshes started after the wait itself, never a state older than the
+    change it waits for. Instances missing from the groups, eg. detached, have no state"""
+
+    def __init__(self, autoScalingGroupNames, autoscalingClient=None, minRefreshInterval=DEFAULT_MIN_REFRESH_INTERVAL):
+        if isinstance( autoScalingGroupNames, str ):
+            autoScalingGroupNames = [ autoScalingGroupNames ]
+        self.autoScalingGroupNames = list( autoScalingGroupNames )
+        self.autoscalingClient = autoscalingClient or get_client('autoscaling')
+        self.minRefreshInterval = minRefreshInterval
+        self.states = {}
+        self.updatedAt = None
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def refresh(self, newerThan=None):
+        """[ reload the state of every instance of the groups, unless the last refresh is recent ]
+
+        Keyword Arguments:
+            newerThan {float} -- [ time the reused refresh must have started after ] (default: {None})
+
+        Returns:
+            [ dict ] -- [ instance id to LifecycleState, HealthStatus and AutoScalingGroupName ]
+        """
+        with self.lock:
+            now = clock.time()
+            if self.updatedAt is not None and self.updatedAt >= ( newerThan or 0 ) and now - self.updatedAt < self.minRefreshInterval:
+                return self.states
+            states = {}
+            paginator = self.autoscalingClient.get_paginator('describe_auto_scaling_groups')
+            for page in paginator.paginate( AutoScalingGroupNames=self.autoScalingGroupNames ):
+                self.calls += 1
+                for group in page.get('AutoScalingGroups', []):
+                    for instance in group.get('Instances', []):
+                        states[ instance['InstanceId'] ] = {
+                            'LifecycleState': instance.get('LifecycleState'),
+                            'HealthStatus': instance.get('HealthStatus', ""),
+                            'AutoScalingGroupName': group['AutoScalingGroupName']
+                        }
+            self.states = states
+            self.updatedAt = now
+            return states
+
+    def state(self, instanceId):
+        """[ last known state of an instance ]
+
+        Arguments:
+            instanceId {[String]} -- [ instance id ]
+
+        Returns:
+            [ dict ] -- [ LifecycleState, HealthStatus and AutoScalingGroupName, None when not in the groups ]
+        """
+        return self.states.get( instanceId )
+
+    def unhealthy(self, instanceIds):
+        """[ instances of a set which are not in service and healthy yet ]
+
+        Arguments:
+            instanceIds {[ iterable ]} -- [ instance ids ]
+
+        Returns:
+            [ List<String> ] -- [ instance ids ]
+        """
+        states = self.states
+        return [ instanceId for instanceId in instanceIds if not is_instance_healthy( states.get( instanceId ) ) ]
+
+    def wait_until_healthy(self, instanceIds, timeout=DEFAULT_WAIT_TIMEOUT):
+        """[ wait for every instance of a set to be in service and healthy ]
+
+        Arguments:
+            instanceIds {[ iterable ]} -- [ instance ids ]
+
+        Keyword Arguments:
+            timeout {int} -- [ seconds of wait time ] (default: {DEFAULT_WAIT_TIMEOUT})
+
+        Returns:
+            [ WaitResult ] -- [ ready, with the states of the set as response ]
+        """
+        instanceIds = list( instanceIds )
+        name = "health of {} instances".format( len( instanceIds ) )
+        start = clock.time()
+        attempts = 0
+        delays = Waiter( firstDelay=self.minRefreshInterval, maxDelay=max( self.minRefreshInterval, 5 ) ).delays()
+        error = None
+        response = None
+        while True:
+            attempts += 1
+            try:
+                states = self.refresh( start )
+            except Exception as e:
+                error = e
+            else:
+                pending = self.unhealthy( instanceIds )
+                response = { instanceId: states.get( instanceId ) for instanceId in instanceIds }
+                if not pending:
+                    return WaitResult( name, True, clock.time() - start, attempts, response, None )
+                terminated = [ instanceId for instanceId in pending if ( states.get( instanceId ) or {} ).get('LifecycleState') in TERMINAL_LIFECYCLE_STATES ]
+                if terminated:
+                    return WaitResult( name, False, clock.time() - start, attempts, response,
+                        Exception("Instances {} are terminating".format( ",".join( terminated ) )) )
+            remaining = timeout - ( clock.time() - start )
+            if remaining <= 0:
+                return WaitResult( name, False, clock.time() - start, attempts, response, error )
+            clock.sleep( min( next( delays ), remaining ) )
+
+    def report(self):
+        """print the instance count of each lifecycle state and health status"""
+        counts = {}
+        for state in self.states.values():
+            key = ( state['LifecycleState'], state['HealthStatus'] )
+            counts[ key ] = counts.get( key, 0 ) + 1
+        for ( lifecycleState, healthStatus ), count in sorted( counts.items() ):
+            print( "{} {} {} instances".format( lifecycleState, healthStatus, count ) )
+        print( "{} describe_auto_scaling_groups calls".format( self.calls ) )
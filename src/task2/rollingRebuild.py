@@ -0,0 +1,207 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src import clock
+from src.clients import get_client
+from src.waiter import DEFAULT_WAIT_TIMEOUT
+from src.task2.healthTracker import HealthTracker
+
+MAX_BATCH_SIZE = 1 # instances rebuilt at once, AutoScalingRollingUpdate MaxBatchSize of the template
+MIN_INSTANCES_IN_SERVICE = 1 # AutoScalingRollingUpdate MinInstancesInService of the template
+DEFAULT_MAX_FAILURES = 0 # instances allowed to fail before the rebuild aborts
+MAX_BOOTING_BATCHES = 1 # batches still booting when the next one is detached
+
+class RollingRebuild:
+    """Rebuilds the instances of an autoscaling group in batches
+
+    Each batch is detached from the group, rebuilt (rebooted, the rebuild script runs on boot)
+    and attached back, then waited for until healthy. Health waits share one HealthTracker
+    polling the whole group in bulk, they run in the background so
+    the next batch is detached while the previous one boots, as long as at least minInService
+    instances stay in service. At most MAX_BOOTING_BATCHES batches boot while the next one is
+    detached, so the group is never more than that many batches past maxBatchSize. Detaching decrements the desired capacity so the group does not
+    launch replacements, the group MinSize is lowered for the duration when needed and restored.
+
+    Once more than maxFailures instances failed no new batch starts, the batches in flight are
+    waited for and rollback, when given, is called with the instances already rebuilt"""
+
+    def __init__(self, autoScalingGroupName, maxBatchSize=MAX_BATCH_SIZE, minInService=MIN_INSTANCES_IN_SERVICE,
+                 maxFailures=DEFAULT_MAX_FAILURES, healthTimeout=DEFAULT_WAIT_TIMEOUT, rollback=None,
+                 autoscalingClient=None, ec2Client=None):
+        self.autoScalingGroupName = autoScalingGroupName
+        self.maxBatchSize = maxBatchSize
+        self.minInService = minInService
+        self.maxFailures = maxFailures
+        self.healthTimeout = healthTimeout
+        self.rollback = rollback
+        self.autoscalingClient = autoscalingClient or get_client('autoscaling')
+        self.ec2Client = ec2Client or get_client('ec2')
+        self.healthTracker = HealthTracker( autoScalingGroupName, self.autoscalingClient )
+        self.rebuilt = []
+        self.failures = {}
+        self.batchTimings = []
+        self.originalMinSize = None
+        self.aborted = False
+        self.startedAt = None
+        self.finishedAt = None
+
+    def describe_group(self):
+        """[ describe the autoscaling group ]
+
+        Raises:
+            Exception: [ no such group ]
+
+        Returns:
+            [ dict ] -- [ AutoScalingGroup ]
+        """
+        groups = self.autoscalingClient.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[ self.autoScalingGroupName ]
+        ).get('AutoScalingGroups')
+        if len( groups ) == 0:
+            raise Exception("There is no autoscaling group name as {}".format( self.autoScalingGroupName ))
+        return groups[0]
+
+    def lower_min_size(self, group, batchSize):
+        """[ let the desired capacity go batchSize below its current value while a batch is detached ]
+
+        Arguments:
+            group {[ dict ]} -- [ AutoScalingGroup ]
+            batchSize {[ int ]} -- [ instances detached at once ]
+        """
+        minSize = group['DesiredCapacity'] - batchSize
+        if minSize < group['MinSize']:
+            self.originalMinSize = group['MinSize']
+            self.autoscalingClient.update_auto_scaling_group( AutoScalingGroupName=self.autoScalingGroupName, MinSize=max( minSize, 0 ) )
+
+    def restore_min_size(self):
+        if self.originalMinSize is not None:
+            self.autoscalingClient.update_auto_scaling_group( AutoScalingGroupName=self.autoScalingGroupName, MinSize=self.originalMinSize )
+            self.originalMinSize = None
+
+    def take_out(self, instanceIds):
+        """[ detach, rebuild and re-attach a batch, the instances are attached back even when the rebuild fails ]
+
+        Arguments:
+            instanceIds {[ List<String> ]} -- [ batch ]
+        """
+        self.autoscalingClient.detach_instances(
+            InstanceIds=instanceIds,
+            AutoScalingGroupName=self.autoScalingGroupName,
+            ShouldDecrementDesiredCapacity=True
+        )
+        try:
+            self.ec2Client.reboot_instances( InstanceIds=instanceIds )
+        finally:
+            self.autoscalingClient.attach_instances(
+                InstanceIds=instanceIds,
+                AutoScalingGroupName=self.autoScalingGroupName
+            )
+
+    def wait_healthy(self, instanceIds):
+        """[ wait for a batch to be in service and healthy ]
+
+        Arguments:
+            instanceIds {[ List<String> ]} -- [ batch ]
+
+        Returns:
+            [ WaitResult ] -- [ wait result ]
+        """
+        return self.healthTracker.wait_until_healthy( instanceIds, self.healthTimeout )
+
+    def fail(self, instanceIds, reason):
+        for instanceId in instanceIds:
+            self.failures[ instanceId ] = reason
+        if len( self.failures ) > self.maxFailures and not self.aborted:
+            self.aborted = True
+            print( "Rolling rebuild of {} aborts after {} failed instances".format( self.autoScalingGroupName, len( self.failures ) ) )
+
+    def batch_done(self, future, timing):
+        """[ account for a finished health wait ]
+
+        Returns:
+            [ int ] -- [ instances back in service ]
+        """
+        timing['healthyAt'] = clock.time()
+        try:
+            result = future.result()
+        except Exception as e:
+            self.fail( timing['instanceIds'], str( e ) )
+            return 0
+        if not result.ready:
+            self.fail( timing['instanceIds'], str( result.error ) if result.error else "not healthy after {}s".format( self.healthTimeout ) )
+            return 0
+        self.rebuilt.extend( timing['instanceIds'] )
+        return len( timing['instanceIds'] )
+
+    def run(self):
+        """[ rebuild every in service instance of the group ]
+
+        Raises:
+            Exception: [ the group has too few instances to keep minInService ]
+
+        Returns:
+            [ bool ] -- [ True when every instance was rebuilt ]
+        """
+        group = self.describe_group()
+        instanceIds = [ instance['InstanceId'] for instance in group.get('Instances', []) if instance.get('LifecycleState') == "InService" ]
+        if not instanceIds:
+            print("There is no instance in autoscaling group {} no need to reboot".format( self.autoScalingGroupName ))
+            return True
+        budget = len( instanceIds ) - self.minInService
+        if budget <= 0:
+            raise Exception("Autoscaling group {} has {} instances in service, can not keep {} in service while rebuilding".format(
+                self.autoScalingGroupName, len( instanceIds ), self.minInService ))
+        batchSize = min( self.maxBatchSize, budget )
+        batches = [ instanceIds[ index:index + batchSize ] for index in range( 0, len( instanceIds ), batchSize ) ]
+
+        self.startedAt = clock.time()
+        self.lower_min_size( group, batchSize )
+        try:
+            outOfService = 0
+            inFlight = {}
+            with ThreadPoolExecutor( max( 1, min( budget // batchSize, MAX_BOOTING_BATCHES + 1 ) ) ) as executor:
+                for batch in batches:
+                    while inFlight and ( outOfService + len( batch ) > budget or len( inFlight ) > MAX_BOOTING_BATCHES ):
+                        done, _ = wait( inFlight, return_when=FIRST_COMPLETED )
+                        for future in done:
+                            outOfService -= self.batch_done( future, inFlight.pop( future ) )
+                    if not self.aborted and outOfService + len( batch ) > budget:
+                        self.aborted = True
+                        print( "Rolling rebuild of {} aborts, failed instances leave no room to keep {} in service".format(
+                            self.autoScalingGroupName, self.minInService ) )
+                    if self.aborted:
+                        break
+
+                    timing = { 'instanceIds': batch, 'startedAt': clock.time() }
+                    self.batchTimings.append( timing )
+                    try:
+                        self.take_out( batch )
+                    except Exception as e:
+                        self.fail( batch, str( e ) )
+                        continue
+                    timing['attachedAt'] = clock.time()
+                    outOfService += len( batch )
+                    inFlight[ executor.submit( self.wait_healthy, batch ) ] = timing
+
+                for future in list( inFlight ):
+                    self.batch_done( future, inFlight.pop( future ) )
+        finally:
+            self.restore_min_size()
+            self.finishedAt = clock.time()
+
+        if self.aborted and self.rollback and self.rebuilt:
+            print( "Rolling back {} rebuilt instances of {}".format( len( self.rebuilt ), self.autoScalingGroupName ) )
+            self.rollback( list( self.rebuilt ) )
+        return not self.aborted and not self.failures
+
+    def report(self):
+        """print the batches timeline and the failed instances"""
+        if self.startedAt is None:
+            return
+        for index, timing in enumerate( self.batchTimings ):
+            print( "batch {} {} detached {:.2f}s attached {} healthy {}".format( index, ",".join( timing['instanceIds'] ),
+                timing['startedAt'] - self.startedAt,
+                "{:.2f}s".format( timing['attachedAt'] - self.startedAt ) if 'attachedAt' in timing else "-",
+                "{:.2f}s".format( timing['healthyAt'] - self.startedAt ) if 'healthyAt' in timing else "-" ) )
+        for instanceId, reason in self.failures.items():
+            print( "{} failed: {}".format( instanceId, reason ) )
+        print( "rebuilt {} instances of {} in {:.2f}s, {} failed{}".format( len( self.rebuilt ), self.autoScalingGroupName,
+            self.finishedAt - self.startedAt, len( self.failures ), ", aborted" if self.aborted else "" ) )
@@ -0,0 +1,323 @@
+import functools
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+
+from src.backends import Backend, BACKENDS
+
+KINDS = [ "stream", "deliveryStream", "bucket", "stack" ]
+DEFAULT_WORKERS = 16
+DEFAULT_TEARDOWN_TIMEOUT = 300 # seconds to delete one resource and see it gone
+DELETE_OBJECTS_BATCH = 1000 # delete_objects hard limit of keys per call
+# error codes of a resource which is already gone
+NOT_FOUND_CODES = { 'ResourceNotFoundException', 'NoSuchBucket', '404', 'NotFound' }
+STACK_NOT_FOUND_MESSAGE = "does not exist"
+
+GONE = "GONE"
+
+def error_code( error ):
+    return getattr( error, 'response', {} ).get('Error', {}).get('Code')
+
+def is_not_found( error ):
+    """[ the error says the resource does not exist ]
+
+    Arguments:
+        error {[ Exception ]} -- [ exception raised by a describe or delete call ]
+
+    Returns:
+        [ Boolean ] -- [ gone ? ]
+    """
+    if error_code( error ) in NOT_FOUND_CODES:
+        return True
+    # cloudformation answers ValidationError for stacks which do not exist
+    return error_code( error ) == 'ValidationError' and STACK_NOT_FOUND_MESSAGE in str( error )
+
+def gone_when_not_found( function ):
+    """[ wrap a describe or delete call so a missing resource returns GONE instead of raising ]
+
+    Arguments:
+        function {[ function ]} -- [ boto3 client method ]
+
+    Returns:
+        [ function ] -- [ wrapped method, keeping its name for the waiter history ]
+    """
+    @functools.wraps( function )
+    def call( *args, **kwargs ):
+        try:
+            return function( *args, **kwargs )
+        except Exception as e:
+            if is_not_found( e ):
+                return GONE
+            raise
+    return call
+
+class Teardown:
+    """Finds every task1 resource whose name starts with a prefix and deletes it
+
+    Streams, delivery streams, buckets and stacks are listed and matched by name, buckets
+    case insensitively as their names are lower case. The buckets of the matched stacks are
+    taken from their stack resources as well, cloudformation truncates the stack name in the
+    bucket names it generates so they may not start with the prefix. Deletions run concurrently as a
+    ProvisioningGraph: buckets are purged of every object version with batched
+    delete_objects before they are deleted, stacks are deleted once the buckets and
+    delivery streams are gone so the stack deletion does not fail on a non empty bucket.
+    Each deletion is retried while the resource is busy, eg. a stream still CREATING, then
+    waited for until the resource is gone. A resource which could not be removed is kept
+    with its error in failures instead of ending the teardown"""
+
+    def __init__(self, prefix, kinds=KINDS, workers=DEFAULT_WORKERS, timeout=DEFAULT_TEARDOWN_TIMEOUT,
+                 kinesisClient=None, firehoseClient=None, s3Client=None, cloudformationClient=None ):
+        from src.clients import get_client
+
+        if not prefix:
+            raise Exception("A teardown needs a prefix, an empty one would match every resource")
+        self.prefix = prefix
+        self.kinds = kinds
+        self.workers = workers
+        self.timeout = timeout
+        self.kinesisClient = kinesisClient or get_client('kinesis')
+        self.firehoseClient = firehoseClient or get_client('firehose')
+        self.s3Client = s3Client or get_client('s3', maxPoolConnections=workers )
+        self.cloudformationClient = cloudformationClient or get_client('cloudformation')
+        self.results = []
+        self.purgedObjects = 0
+        self.deleteBatches = 0
+        self.lock = threading.Lock()
+
+    def matches(self, name, caseSensitive=True):
+        if caseSensitive:
+            return name.startswith( self.prefix )
+        return name.lower().startswith( self.prefix.lower() )
+
+    def list_streams(self):
+        names = []
+        for page in self.kinesisClient.get_paginator('list_streams').paginate():
+            names.extend( page['StreamNames'] )
+        return [ name for name in names if self.matches( name ) ]
+
+    def list_delivery_streams(self):
+        names = []
+        kwargs = {}
+        while True:
+            res = self.firehoseClient.list_delivery_streams( **kwargs )
+            names.extend( res['DeliveryStreamNames'] )
+            if not res.get('HasMoreDeliveryStreams') or not res['DeliveryStreamNames']:
+                break
+            kwargs['ExclusiveStartDeliveryStreamName'] = names[-1]
+        return [ name for name in names if self.matches( name ) ]
+
+    def list_buckets(self):
+        return [ bucket['Name'] for bucket in self.s3Client.list_buckets().get('Buckets', []) if self.matches( bucket['Name'], False ) ]
+
+    def list_stacks(self):
+        names = []
+        for page in self.cloudformationClient.get_paginator('describe_stacks').paginate():
+            names.extend( stack['StackName'] for stack in page['Stacks'] if stack['StackStatus'] != "DELETE_COMPLETE" )
+        return [ name for name in names if self.matches( name ) ]
+
+    def stack_buckets(self, stackNames):
+        """[ buckets created by stacks, whatever their name ]
+
+        Arguments:
+            stackNames {[ List<String> ]} -- [ stack names ]
+
+        Returns:
+            [ List<String> ] -- [ bucket names ]
+        """
+        names = []
+        for stackName in stackNames:
+            try:
+                for page in self.cloudformationClient.get_paginator('list_stack_resources').paginate( StackName=stackName ):
+                    names.extend( resource['PhysicalResourceId'] for resource in page['StackResourceSummaries']
+                        if resource['ResourceType'] == "AWS::S3::Bucket" and resource.get('PhysicalResourceId')
+                        and resource.get('ResourceStatus') != "DELETE_COMPLETE" )
+            except Exception as e:
+                if not is_not_found( e ):
+                    raise
+        return names
+
+    def discover(self):
+        """[ resources of each kind whose name starts with the prefix ]
+
+        Returns:
+            [ dict ] -- [ kind -> List<String> names ]
+        """
+        listers = {
+            'stream': self.list_streams,
+            'deliveryStream': self.list_delivery_streams,
+            'bucket': self.list_buckets,
+            'stack': self.list_stacks
+        }
+        resources = { kind: listers[ kind ]() for kind in self.kinds }
+        if "bucket" in resources:
+            stacks = resources['stack'] if "stack" in resources else self.list_stacks()
+            resources['bucket'] += [ name for name in self.stack_buckets( stacks ) if name not in resources['bucket'] ]
+        return resources
+
+    def delete_and_wait(self, delete, describe, isGone, **kwargs):
+        """[ delete a resource, retrying while it is busy, then wait until it is gone ]
+
+        Arguments:
+            delete {[ function ]} -- [ delete method ]
+            describe {[ function ]} -- [ describe method ]
+            isGone {[ function ]} -- [ check of the describe response, may raise WaitFatalError ]
+
+        Raises:
+            Exception: [ the resource is still there after timeout ]
+        """
+        from src.waiter import waiter
+
+        if not waiter.wait( gone_when_not_found( delete ), lambda response: True, self.timeout, **kwargs ).ready:
+            raise Exception("Deletion still refused after {}s".format( self.timeout ))
+        result = waiter.wait( gone_when_not_found( describe ), lambda response: response == GONE or isGone( response ), self.timeout, **kwargs )
+        if not result.ready:
+            raise Exception("Still there after {}s{}".format( self.timeout, ": {}".format( result.error ) if result.error else "" ))
+
+    def delete_stream(self, name):
+        from src.stateCache import stateCache
+
+        stateCache.invalidate( "streams/" + name )
+        self.delete_and_wait( self.kinesisClient.delete_stream, self.kinesisClient.describe_stream,
+            lambda response: False, StreamName=name )
+
+    def delete_delivery_stream(self, name):
+        self.delete_and_wait( self.firehoseClient.delete_delivery_stream, self.firehoseClient.describe_delivery_stream,
+            lambda response: False, DeliveryStreamName=name )
+
+    def purge_bucket(self, name):
+        """[ delete every object version and delete marker of a bucket, DELETE_OBJECTS_BATCH keys per call ]
+
+        Arguments:
+            name {[String]} -- [ bucket name ]
+
+        Raises:
+            Exception: [ some objects could not be deleted ]
+        """
+        while True:
+            # list from the start again after each batch, the markers of a page are not valid once its keys are deleted
+            page = self.s3Client.list_object_versions( Bucket=name, MaxKeys=DELETE_OBJECTS_BATCH )
+            batch = [ { 'Key': version['Key'], 'VersionId': version['VersionId'] }
+                for version in page.get('Versions', []) + page.get('DeleteMarkers', []) ][ :DELETE_OBJECTS_BATCH ]
+            if not batch:
+                return
+            res = self.s3Client.delete_objects( Bucket=name, Delete={ 'Objects': batch, 'Quiet': True } )
+            if res.get('Errors'):
+                error = res['Errors'][0]
+                raise Exception("Fails to delete {} objects, eg. {}: {}".format( len( res['Errors'] ), error['Key'], error.get('Message', error.get('Code')) ))
+            with self.lock:
+                self.purgedObjects += len( batch )
+                self.deleteBatches += 1
+
+    def delete_bucket(self, name):
+        try:
+            self.purge_bucket( name )
+        except Exception as e:
+            if is_not_found( e ):
+                return
+            raise
+        self.delete_and_wait( self.s3Client.delete_bucket, self.s3Client.head_bucket, lambda response: False, Bucket=name )
+
+    def delete_stack(self, name):
+        from src.stateCache import stateCache
+        from src.waiter import WaitFatalError
+
+        def is_deleted( response ):
+            stack = response['Stacks'][0]
+            if stack['StackStatus'] == "DELETE_FAILED":
+                raise WaitFatalError("{}: {}".format( stack['StackStatus'], stack.get('StackStatusReason', "") ))
+            return stack['StackStatus'] == "DELETE_COMPLETE"
+
+        stateCache.invalidate( "stacks/" + name )
+        self.delete_and_wait( self.cloudformationClient.delete_stack, self.cloudformationClient.describe_stacks, is_deleted, StackName=name )
+
+    def remove(self, kind, name):
+        """[ delete one resource, never raising ]
+
+        Arguments:
+            kind {[String]} -- [ kind of KINDS ]
+            name {[String]} -- [ resource name ]
+
+        Returns:
+            [ dict ] -- [ kind, name, seconds and error, None once deleted ]
+        """
+        deleters = {
+            'stream': self.delete_stream,
+            'deliveryStream': self.delete_delivery_stream,
+            'bucket': self.delete_bucket,
+            'stack': self.delete_stack
+        }
+        start = time.time()
+        error = None
+        try:
+            deleters[ kind ]( name )
+        except Exception as e:
+            error = str( e ) or type( e ).__name__
+        result = { 'kind': kind, 'name': name, 'seconds': time.time() - start, 'error': error }
+        with self.lock:
+            self.results.append( result )
+        return result
+
+    def run(self, resources=None):
+        """[ delete the resources concurrently, stacks after the buckets and delivery streams ]
+
+        Keyword Arguments:
+            resources {[ dict ]} -- [ kind -> names to delete, discovered when None ] (default: {None})
+
+        Returns:
+            [ List<dict> ] -- [ result of each resource, see remove ]
+        """
+        from src.provisioning import ProvisioningGraph
+
+        resources = resources if resources is not None else self.discover()
+        graph = ProvisioningGraph( self.workers )
+        contents = [ "{}:{}".format( kind, name ) for kind in [ "bucket", "deliveryStream" ] for name in resources.get( kind, [] ) ]
+        for kind in KINDS:
+            for name in resources.get( kind, [] ):
+                graph.add_node( "{}:{}".format( kind, name ), lambda results, kind=kind, name=name: self.remove( kind, name ),
+                    depends=contents if kind == "stack" else () )
+        graph.run()
+        return self.results
+
+    @property
+    def failures(self):
+        return [ result for result in self.results if result['error'] ]
+
+    def report(self):
+        """print the resources removed per kind and every resource left behind"""
+        for kind in KINDS:
+            results = [ result for result in self.results if result['kind'] == kind ]
+            if results:
+                print( "teardown {} {}: {} deleted, {} left, slowest {:.1f}s".format( self.prefix, kind,
+                    len( results ) - len( [ result for result in results if result['error'] ] ),
+                    len( [ result for result in results if result['error'] ] ), max( result['seconds'] for result in results ) ) )
+        if self.purgedObjects:
+            print( "teardown {} purged {} objects in {} delete_objects calls".format( self.prefix, self.purgedObjects, self.deleteBatches ) )
+        for result in self.failures:
+            print( "Fails to delete {} {}: {}".format( result['kind'], result['name'], result['error'] ) )
+
+if __name__ == '__main__':
+    parser = ArgumentParser( description="Delete every stream, delivery stream, bucket and stack whose name starts with a prefix" )
+    parser.add_argument( "prefix", help="Name prefix, eg. the --name of main.py or the prefix of a sweep" )
+    parser.add_argument( "--backend", choices=BACKENDS, default="localstack", help="Backend to clean up" )
+    parser.add_argument( "--kinds", default=",".join( KINDS ), help="Comma separated kinds among {}".format( ", ".join( KINDS ) ) )
+    parser.add_argument( "--workers", type=int, default=DEFAULT_WORKERS, help="Resources deleted at once" )
+    parser.add_argument( "--timeout", type=int, default=DEFAULT_TEARDOWN_TIMEOUT, help="Seconds to delete one resource and see it gone" )
+    parser.add_argument( "--dry-run", action="store_true", dest="dryRun", help="List the matching resources without deleting them" )
+    args = parser.parse_args()
+
+    backend = Backend( args.backend ).start()
+    try:
+        teardown = Teardown( args.prefix, args.kinds.split( "," ), args.workers, args.timeout )
+        resources = teardown.discover()
+        if args.dryRun:
+            for kind, names in resources.items():
+                for name in names:
+                    print( "{} {}".format( kind, name ) )
+        else:
+            teardown.run( resources )
+            teardown.report()
+    finally:
+        backend.stop()
+    if not args.dryRun and teardown.failures:
+        sys.exit( 1 )
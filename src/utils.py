@@ -1,45 +1,51 @@
-import sys, os, random, string
-from troposphere import Base64, FindInMap, GetAtt, Join, Output, Select, GetAZs
-from troposphere import Parameter, Ref, Tags, Template
+from troposphere import GetAtt, Join, Ref, Tags
 from troposphere.kinesis import Stream
 from troposphere.s3 import Bucket, PublicRead
 from troposphere.iam import PolicyType, Role
 from troposphere.firehose import (
     BufferingHints,
     KinesisStreamSourceConfiguration,
-    CopyCommand,
     DeliveryStream,
     S3DestinationConfiguration
 )
 
-from argparse import ArgumentParser
-import boto3
+from src.randomData import random_alphanumeric_bytes, random_alphanumeric # importable from src.utils as before
+from src.clients import get_client
+from src.waiter import waiter, WaitFatalError, DEFAULT_WAIT_TIMEOUT
+from src.stateCache import stateCache, template_fingerprint
 import time
 
-def random_alphanumeric(len):
-    """Generate random alphanumeric string based on len
-    
-    Arguments:
-        pass_len {[number]} -- [length of string]
-    
-    Returns:
-        [string] -- [ fix length random alphanumeric ]
-    """
-    symbols = string.printable.strip()
-    return ''.join(random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for _ in range(len))
+DEFAULT_BUFFERING_HINTS = { 'IntervalInSeconds': 60, 'SizeInMBs': 50 } # firehose flushes to S3 when either is reached
 
-def get_or_create_kinesis_stream_resource( name ):
+# stack statuses which never end in CREATE_COMPLETE
+FAILED_STACK_STATUSES = {
+    "CREATE_FAILED",
+    "ROLLBACK_IN_PROGRESS",
+    "ROLLBACK_FAILED",
+    "ROLLBACK_COMPLETE",
+    "DELETE_IN_PROGRESS",
+    "DELETE_FAILED",
+    "DELETE_COMPLETE",
+    "UPDATE_ROLLBACK_IN_PROGRESS",
+    "UPDATE_ROLLBACK_FAILED",
+    "UPDATE_ROLLBACK_COMPLETE"
+}
+
+def get_or_create_kinesis_stream_resource( name, shardCount=1 ):
     """Create Kinsis Stream resource
     
     Arguments:
         name {[String]} -- [ Name ]
+
+    Keyword Arguments:
+        shardCount {int} -- [ number of shards ] (default: {1})
     
     Returns:
         [troposphere.resource] -- [ Steam resource ]
     """
     return Stream(
         name,
-        ShardCount=1
+        ShardCount=shardCount
     )
 
 
@@ -116,7 +122,7 @@ def create_root_Policy( name, roles ):
         Roles=roles
     )
 
-def create_firehose_delivery_stream_resource( name, depends, kinesisStreamARN, s3bucket, role ):
+def create_firehose_delivery_stream_resource( name, depends, kinesisStreamARN, s3bucket, role, compressionFormat="UNCOMPRESSED", bufferingHints=None ):
     """[create firehose delievery stream resource which use s3 bucket as destination and kinesis stream as producer ]
     
     Arguments:
@@ -125,6 +131,10 @@ def create_firehose_delivery_stream_resource( name, depends, kinesisStreamARN, s
         kinesisStreamARN {[String]} -- [ arn of kinesisStream ]
         s3bucket {[troposphere.resource]} -- [ s3 bucket resource ]
         role {[troposphere.resource]} -- [ role resource ]
+
+    Keyword Arguments:
+        compressionFormat {String} -- [ format of the S3 objects, see compression.firehose_format ] (default: {"UNCOMPRESSED"})
+        bufferingHints {[ dict ]} -- [ IntervalInSeconds and / or SizeInMBs overriding DEFAULT_BUFFERING_HINTS ] (default: {None})
     
     Returns:
         [troposphere.resource] -- [ Firehose delivery resource ]
@@ -136,10 +146,9 @@ def create_firehose_delivery_stream_resource( name, depends, kinesisStreamARN, s
         S3DestinationConfiguration=S3DestinationConfiguration(
             BucketARN=GetAtt(s3bucket, "Arn"),
             BufferingHints=BufferingHints(
-                IntervalInSeconds=60,
-                SizeInMBs=50
+                **dict( DEFAULT_BUFFERING_HINTS, **( bufferingHints or {} ) )
             ),
-            CompressionFormat="UNCOMPRESSED",
+            CompressionFormat=compressionFormat,
             Prefix="firehose/",
             RoleARN=GetAtt(role, "Arn"),
         ),
@@ -149,71 +158,161 @@ def create_firehose_delivery_stream_resource( name, depends, kinesisStreamARN, s
         )
     )
 
-def create_security_group_rule( ipProtocol, fromPort, toPort, cidrIp ):
-    """[ create security group rule ]
+def wait_resource( listResource, checkcallback, timeout=DEFAULT_WAIT_TIMEOUT, *args, **kwargs ):
+    """[ wait function for list or describe boto3 functions, polls with exponential backoff and jitter ]
     
     Arguments:
-        ipProtocol {[String]} -- [ ip protocol ]
-        fromPort {[Number]} -- [ start port]
-        toPort {[ Number]} -- [ end port ]
-        cidrIp {[ String ]} -- [ allow IP cidr ]
+        listResource {[ function ]} -- [ list or describe function ]
+        checkcallback {[ function ]} -- [ status check function, may raise WaitFatalError ]
+    
+    Keyword Arguments:
+        timeout {int} -- [ seconds of wait time ] (default: {DEFAULT_WAIT_TIMEOUT})
+    
+    Raises:
+        WaitFatalError: [ resource can not become ready or the error is not retryable ]
     
     Returns:
-        [ troposphere.Object ] -- [ SecurityGroupRule ]
+        [Boolean -- [ is ready ? ]
     """
-    return SecurityGroupRule(
-        IpProtocol=ipProtocol,
-        FromPort=fromPort,
-        ToPort=toPort,
-        CidrIp=cidrIp,
-    )
+    return waiter.wait( listResource, checkcallback, timeout, *args, **kwargs ).ready
 
-def create_security_group_resource( name, securityGroupIngress, description ):
-    """[ create simple security group resource ]
+def check_cloudformation_stack_complete( cloudformationRespose ):
+    """[ cloudformation stack complete checker ]
     
     Arguments:
-        name {[String]} -- [ name ]
-        securityGroupIngress {[List<SecurityGroupRule>]} -- [ list of security group rules ]
-        description {[String]} -- [description]
+        cloudformationRespose {[ dict ]} -- [ cloudformation describe stack response ]
+    
+    Raises:
+        WaitFatalError: [ stack failed or rolled back ]
     
     Returns:
-        [troposphere.resource] -- [ security group resource ]
+        [Boolean] -- [ is cloudformation complete ]
     """
-    return SecurityGroup(
-    name,
-    SecurityGroupIngress=securityGroupIngress, # must be array of security rules
-    GroupDescription=description,
-    Tags=Tags(
-        Application=Ref('AWS::StackId'),
-        Name=Join("", [Ref('AWS::StackName'), name])
-    )   
-)
 
-def wait_resource( listResource, checkcallback, timeout, period=1, *args, **kwargs ):
-    """[ wait function for list or describe boto3 functions]
+    stacks = cloudformationRespose.get('Stacks')
+    status = stacks[0].get('StackStatus')
+    if status in FAILED_STACK_STATUSES:
+        raise WaitFatalError("Stack {} is {}".format( stacks[0].get('StackName'), status ))
+    return status == "CREATE_COMPLETE" or status == "UPDATE_COMPLETE"
+
+def check_cloudformation_stack_updated( cloudformationRespose ):
+    """[ cloudformation stack update checker, a stack still reading CREATE_COMPLETE has not started its update yet ]
     
     Arguments:
-        listResource {[ function ]} -- [ list or describe function ]
-        checkcallback {[ function ]} -- [ status check function ]
-        timeout {[ int ]} -- [ seconds of wait time ]
+        cloudformationRespose {[ dict ]} -- [ cloudformation describe stack response ]
     
-    Keyword Arguments:
-        period {int} -- [ wait period in seconds] (default: {1})
+    Raises:
+        WaitFatalError: [ update rolled back ]
     
     Returns:
-        [Boolean -- [ is ready ? ]
+        [Boolean] -- [ is cloudformation update complete ]
+    """
+    return check_cloudformation_stack_complete( cloudformationRespose ) and \
+        cloudformationRespose.get('Stacks')[0].get('StackStatus') == "UPDATE_COMPLETE"
+
+def check_cloudformation_change_set_created( changeSetResponse ):
+    """[ change set creation finished checker ]
+    
+    Arguments:
+        changeSetResponse {[ dict ]} -- [ cloudformation describe change set response ]
+    
+    Returns:
+        [Boolean] -- [ is change set CREATE_COMPLETE or FAILED ]
+    """
+    return changeSetResponse.get('Status') in ( "CREATE_COMPLETE", "FAILED" )
+
+def update_cloudformation_stack( cloudformationClient, stackName, templateBody ):
+    """[ update an existing stack through a change set, only the resources which changed are touched ]
+    
+    Arguments:
+        cloudformationClient {[ botocore.client ]} -- [ cloudformation client ]
+        stackName {[String]} -- [ stack name ]
+        templateBody {[String]} -- [ rendered template ]
+    
+    Raises:
+        Exception: [ change set creation failed ]
+    
+    Returns:
+        [ function ] -- [ status check to wait on, depending on the stack being updated or not ]
     """
-    mustend = time.time() + timeout
-    while time.time() < mustend:
-        try:
-            res = listResource( *args, **kwargs )
-            if checkcallback( res ) : return True
-        except Exception as e:
-            # TODO: dig into message to improve wait check
-            # print( e )
-            pass
-        time.sleep(period)
-    return False
+    changeSetName = "update-{}-{}".format( template_fingerprint( templateBody )[:12], int( time.time() ) )
+    cloudformationClient.create_change_set(
+        StackName=stackName,
+        ChangeSetName=changeSetName,
+        ChangeSetType="UPDATE",
+        TemplateBody=templateBody
+    )
+    wait_resource( cloudformationClient.describe_change_set, check_cloudformation_change_set_created, DEFAULT_WAIT_TIMEOUT,
+        StackName=stackName, ChangeSetName=changeSetName )
+    changeSet = cloudformationClient.describe_change_set( StackName=stackName, ChangeSetName=changeSetName )
+
+    if changeSet.get('Status') == "FAILED" or not changeSet.get('Changes'):
+        reason = changeSet.get('StatusReason') or ""
+        cloudformationClient.delete_change_set( StackName=stackName, ChangeSetName=changeSetName )
+        if changeSet.get('Status') == "FAILED" and "didn't contain changes" not in reason and "No updates" not in reason:
+            raise Exception("Fails to update stack {}: {}".format( stackName, reason ))
+        return check_cloudformation_stack_complete
+
+    cloudformationClient.execute_change_set( StackName=stackName, ChangeSetName=changeSetName )
+    return check_cloudformation_stack_updated
+
+def deploy_cloudformation_stack( stackName, templateBody ):
+    """[ create or get a stack, skipping every API call when the template did not change since the last deploy ]
+
+    A stack which exists with another template is updated through a change set
+    
+    Arguments:
+        stackName {[String]} -- [ stack name ]
+        templateBody {[String]} -- [ rendered template ]
+    
+    Raises:
+        Exception: [ timeout or unexpected exception ]
+    
+    Returns:
+        [ dict ] -- [ describe stack information ]
+    """
+    fingerprint = template_fingerprint( templateBody )
+    cacheKey = "stacks/" + stackName
+    cached = stateCache.get( cacheKey )
+    if cached and cached['fingerprint'] == fingerprint:
+        return cached['stack']
+
+    cloudformationClient = get_client('cloudformation')
+    try:
+        cloudformationClient.create_stack(
+            StackName=stackName,
+            TemplateBody=templateBody
+        )
+        check = check_cloudformation_stack_complete
+    except cloudformationClient.exceptions.AlreadyExistsException:
+        check = update_cloudformation_stack( cloudformationClient, stackName, templateBody )
+
+    stackReady=wait_resource( cloudformationClient.describe_stacks, check, DEFAULT_WAIT_TIMEOUT, StackName=stackName )
+
+    if stackReady:
+        stack = cloudformationClient.describe_stacks( StackName=stackName )['Stacks'][0]
+        stateCache.put( cacheKey, { 'fingerprint': fingerprint, 'stack': stack } )
+        return stack
+    else:
+        raise Exception("Fails to get recently created stack, try to wait for more time")
+
+def get_cloudformation_stack_output( stack, outputKey ):
+    """[ value of a stack output ]
+
+    Arguments:
+        stack {[ dict ]} -- [ describe stack information ]
+        outputKey {[String]} -- [ output name ]
+
+    Raises:
+        Exception: [ the stack has no such output ]
+
+    Returns:
+        [ String ] -- [ output value ]
+    """
+    for output in stack.get('Outputs', []):
+        if output['OutputKey'] == outputKey:
+            return output['OutputValue']
+    raise Exception("Stack {} has no output {}".format( stack.get('StackName'), outputKey ))
 
 def check_s3_bucket_has_content( response ):
     """ check s3 bucket has content
@@ -229,12 +328,12 @@ def wait_for_s3_bucket_has_content( bucket ):
     Raises:
         Exception: [ Stack setup error ]
     """
-    s3Client = boto3.client('s3', endpoint_url='http://localhost:4572', region_name='us-west-2')
+    s3Client = get_client('s3')
     res = s3Client.list_objects_v2(
         Bucket=bucket
     )
 
-    hasContent=wait_resource( s3Client.list_objects_v2, check_s3_bucket_has_content, 10, Bucket=bucket )
+    hasContent=wait_resource( s3Client.list_objects_v2, check_s3_bucket_has_content, DEFAULT_WAIT_TIMEOUT, Bucket=bucket )
 
     if hasContent:
         print("Stack works")
@@ -242,15 +341,13 @@ def wait_for_s3_bucket_has_content( bucket ):
         raise Exception("Stack fails, extend time or errors existed in the stack")
 
 def clean_up_cloudformation_stack( stackName ):
-    """[ clean up cloudformation stack ]
+    """[ start the deletion of a cloudformation stack, see src.teardown to delete and wait for every resource of a project ]
     
     Arguments:
         stackName {[String]} -- [ stack name ]
     """
-    try:
-        task1_stack=cloudformationClient.delete_stack(
-            StackName=stackName
-        )
-    except Exception as e:
-        # TODO: check other exceptions
-        pass
\ No newline at end of file
+    stateCache.invalidate( "stacks/" + stackName )
+    # delete_stack succeeds for stacks which do not exist, any error is a real failure
+    get_client('cloudformation').delete_stack(
+        StackName=stackName
+    )
\ No newline at end of file
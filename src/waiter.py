@@ -0,0 +1,145 @@
+import random
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError, NoCredentialsError, ParamValidationError
+from src import clock
+
+DEFAULT_WAIT_TIMEOUT = 60 # seconds, backoff keeps a long timeout cheap for resources which are ready early
+DEFAULT_FIRST_DELAY = 0.05
+DEFAULT_MAX_DELAY = 2
+DEFAULT_MULTIPLIER = 2
+
+# error codes which will not go away by polling again
+FATAL_ERROR_CODES = {
+    'AccessDenied',
+    'AccessDeniedException',
+    'UnrecognizedClientException',
+    'InvalidClientTokenId',
+    'SignatureDoesNotMatch',
+    'ExpiredToken'
+}
+
+# errors of the caller rather than of the resource
+FATAL_ERROR_TYPES = ( NoCredentialsError, ParamValidationError, NameError, TypeError, AttributeError )
+
+WaitResult = namedtuple('WaitResult', [ 'name', 'ready', 'elapsed', 'attempts', 'response', 'error' ])
+
+class WaitFatalError(Exception):
+    """Resource reached a state it will never leave, eg. a stack in ROLLBACK_COMPLETE"""
+    pass
+
+def is_retryable( error ):
+    """[ classify an exception raised while polling ]
+
+    Arguments:
+        error {[ Exception ]} -- [ exception raised by the describe or check function ]
+
+    Returns:
+        [ Boolean ] -- [ keep polling ? ]
+    """
+    if isinstance( error, ( WaitFatalError, ) + FATAL_ERROR_TYPES ):
+        return False
+    if isinstance( error, ClientError ):
+        return error.response.get('Error', {}).get('Code') not in FATAL_ERROR_CODES
+    return True
+
+class Waiter:
+    """Polls describe functions with exponential backoff and jitter
+
+    The first polls are fast so resources which are ready early are seen early, the delay
+    then grows by multiplier up to maxDelay. Each sleep is drawn between half and the full
+    delay so concurrent waiters do not poll in lockstep. Every wait is kept in history
+    with its elapsed time"""
+
+    def __init__(self, firstDelay=DEFAULT_FIRST_DELAY, maxDelay=DEFAULT_MAX_DELAY, multiplier=DEFAULT_MULTIPLIER):
+        self.firstDelay = firstDelay
+        self.maxDelay = maxDelay
+        self.multiplier = multiplier
+        self.history = []
+
+    def delays(self):
+        """[ jittered backoff delays ]
+
+        Yields:
+            [ float ] -- [ seconds to sleep before the next poll ]
+        """
+        delay = self.firstDelay
+        while True:
+            yield random.uniform( delay / 2, delay )
+            delay = min( delay * self.multiplier, self.maxDelay )
+
+    def wait(self, describe, check, timeout=DEFAULT_WAIT_TIMEOUT, *args, **kwargs):
+        """[ poll describe until check accepts its response ]
+
+        Arguments:
+            describe {[ function ]} -- [ list or describe function ]
+            check {[ function ]} -- [ status check function, may raise WaitFatalError ]
+
+        Keyword Arguments:
+            timeout {int} -- [ seconds of wait time ] (default: {DEFAULT_WAIT_TIMEOUT})
+
+        Raises:
+            WaitFatalError: [ resource can not become ready ]
+
+        Returns:
+            [ WaitResult ] -- [ ready, elapsed seconds, number of polls, last response and last error ]
+        """
+        name = getattr( describe, '__name__', str( describe ) )
+        start = clock.time()
+        mustend = start + timeout
+        attempts = 0
+        response = None
+        error = None
+        delays = self.delays()
+        while True:
+            attempts += 1
+            try:
+                response = describe( *args, **kwargs )
+                error = None
+                if check( response ):
+                    return self.record( WaitResult( name, True, clock.time() - start, attempts, response, None ) )
+            except Exception as e:
+                if not is_retryable( e ):
+                    self.record( WaitResult( name, False, clock.time() - start, attempts, response, e ) )
+                    if isinstance( e, WaitFatalError ):
+                        raise
+                    raise WaitFatalError("{} can not succeed: {}".format( name, e )) from e
+                error = e
+
+            remaining = mustend - clock.time()
+            if remaining <= 0:
+                return self.record( WaitResult( name, False, clock.time() - start, attempts, response, error ) )
+            clock.sleep( min( next( delays ), remaining ) )
+
+    def wait_all(self, waits, timeout=DEFAULT_WAIT_TIMEOUT):
+        """[ wait on several resources concurrently ]
+
+        Arguments:
+            waits {[ List<tuple> ]} -- [ ( describe, check, kwargs ) of each resource ]
+
+        Keyword Arguments:
+            timeout {int} -- [ seconds of wait time of each resource ] (default: {DEFAULT_WAIT_TIMEOUT})
+
+        Raises:
+            WaitFatalError: [ first resource which can not become ready ]
+
+        Returns:
+            [ List<WaitResult> ] -- [ results in the order of waits ]
+        """
+        if not waits:
+            return []
+        with ThreadPoolExecutor( len( waits ) ) as executor:
+            futures = [ executor.submit( self.wait, describe, check, timeout, **kwargs ) for describe, check, kwargs in waits ]
+            return [ future.result() for future in futures ]
+
+    def record(self, result):
+        self.history.append( result )
+        return result
+
+    def report(self):
+        """print how long each wait took"""
+        for result in self.history:
+            print( "waited {:.2f}s for {} in {} polls: {}".format(
+                result.elapsed, result.name, result.attempts, "ready" if result.ready else "not ready" ) )
+
+waiter = Waiter()
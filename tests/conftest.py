@@ -0,0 +1,39 @@
+import time
+import pytest
+import sharedStacks
+
+PHASES = [ "setup", "call", "teardown" ]
+
+phaseTimes = { phase: 0.0 for phase in PHASES }
+sharedTimings = { 'provisioning': 0.0, 'cleanup': 0.0 }
+sessionStartedAt = None
+
+def pytest_sessionstart( session ):
+    global sessionStartedAt
+    sessionStartedAt = time.time()
+
+def pytest_runtest_logreport( report ):
+    # with pytest-xdist the controller receives the reports of every worker
+    phaseTimes[ report.when ] += report.duration
+
+def pytest_sessionfinish( session ):
+    sharedStacks.tear_down()
+    if hasattr( session.config, 'workeroutput' ):
+        session.config.workeroutput['sharedTimings'] = dict( sharedStacks.timings )
+    else:
+        for phase, seconds in sharedStacks.timings.items():
+            sharedTimings[ phase ] += seconds
+
+@pytest.hookimpl( optionalhook=True )
+def pytest_testnodedown( node, error ):
+    for phase, seconds in getattr( node, 'workeroutput', {} ).get( 'sharedTimings', {} ).items():
+        sharedTimings[ phase ] += seconds
+
+def pytest_terminal_summary( terminalreporter ):
+    terminalreporter.section( "suite time per phase" )
+    # shared resources are provisioned by the first test using them, within its setup or call time
+    terminalreporter.write_line( "{:<30} {:>8.2f}s".format( "shared resources provisioning", sharedTimings['provisioning'] ) )
+    for phase in PHASES:
+        terminalreporter.write_line( "{:<30} {:>8.2f}s".format( "test " + phase, phaseTimes[ phase ] ) )
+    terminalreporter.write_line( "{:<30} {:>8.2f}s".format( "shared resources cleanup", sharedTimings['cleanup'] ) )
+    terminalreporter.write_line( "{:<30} {:>8.2f}s".format( "wall", time.time() - sessionStartedAt ) )
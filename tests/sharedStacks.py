@@ -0,0 +1,93 @@
+import atexit
+import os
+import threading
+import time
+
+from src.stateCache import stateCache
+from src.task1.kinesis import (
+    get_or_create_kinesis_stream,
+    get_or_create_kinesis_cloudformation_stack
+)
+from src.teardown import Teardown
+
+# pytest-xdist worker id eg. gw0, tests running in one process keep the plain names
+WORKER = os.environ.get( "PYTEST_XDIST_WORKER", "" )
+
+# the state cache of the tests only lives for the session, it never reads or overwrites the one of main.py
+stateCache.use_path( None )
+
+lock = threading.RLock()
+resources = {}
+cleanups = []
+timings = { 'provisioning': 0.0, 'cleanup': 0.0 }
+
+def resource_name( base ):
+    """[ name unique to the test worker, so workers running in parallel never share a resource ]
+
+    Arguments:
+        base {[String]} -- [ name used when the tests run in one process ]
+
+    Returns:
+        [ String ] -- [ resource name ]
+    """
+    return base + WORKER.capitalize()
+
+def shared( key, create, cleanup=None ):
+    """[ create a resource once per session and hand the same one to every test ]
+
+    Arguments:
+        key {[String]} -- [ resource key ]
+        create {[ function ]} -- [ provisions the resource and returns it ]
+
+    Keyword Arguments:
+        cleanup {[ function ]} -- [ deletes the resource at the end of the session ] (default: {None})
+
+    Returns:
+        [ object ] -- [ value returned by create ]
+    """
+    with lock:
+        if key not in resources:
+            start = time.time()
+            resources[ key ] = create()
+            timings['provisioning'] += time.time() - start
+            if cleanup is not None:
+                cleanups.append( cleanup )
+        return resources[ key ]
+
+def task1_stack():
+    """[ task1 stream and firehose stack of the worker, provisioned on first use ]
+
+    Returns:
+        [ dict ] -- [ projectName, stream StreamDescription and stack description ]
+    """
+    projectName = resource_name( "unitTestTask1" )
+
+    def create():
+        stream = get_or_create_kinesis_stream( projectName )
+        stack = get_or_create_kinesis_cloudformation_stack( projectName, stream['StreamARN'] )
+        return { 'projectName': projectName, 'stream': stream, 'stack': stack }
+
+    def cleanup():
+        teardown = Teardown( projectName )
+        teardown.run( { 'stream': [ projectName + "KinesisStream" ], 'stack': [ projectName + "Task1" ],
+            'bucket': teardown.stack_buckets( [ projectName + "Task1" ] ) } )
+        if teardown.failures:
+            teardown.report()
+
+    return shared( "task1", create, cleanup )
+
+def tear_down():
+    """delete the shared resources, last created first"""
+    with lock:
+        start = time.time()
+        while cleanups:
+            cleanup = cleanups.pop()
+            try:
+                cleanup()
+            except Exception as e:
+                print( "Fails to clean up shared test resource: {}".format( e ) )
+        resources.clear()
+        timings['cleanup'] += time.time() - start
+
+# unittest runs have no session hook
+atexit.register( tear_down )
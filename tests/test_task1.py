@@ -1,30 +1,68 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import warnings
+from botocore.stub import Stubber
 warnings.filterwarnings(action="ignore", message="unclosed", 
                          category=ResourceWarning)
 
+from src.clients import ClientRegistry, close_clients, get_client, LOCALSTACK_ENDPOINTS
+from src.backends import Backend
+from src.clock import VirtualClock
+from src.importTime import parse_import_time, TARGETS, ROOT
+from sharedStacks import task1_stack, resource_name
 from src.utils import (
-    clean_up_cloudformation_stack,
+    check_cloudformation_stack_complete,
     wait_resource
 )
+from src.waiter import Waiter, WaitFatalError
+from src.provisioning import ProvisioningGraph
+from src.stateCache import StateCache, stateCache, template_fingerprint
+from src.metrics import LatencyHistogram
+from src.instrumentation import Instrumentation
+from src.teardown import Teardown
 
 from src.task1.kinesis import (
     get_or_create_kinesis_stream,
     get_or_create_kinesis_cloudformation_stack,
-    clean_up_kinesis,
     task1_kinesis
 
 )
 
+from src.task1.kinesisProducer import KinesisProducer
+from src.task1.asyncKinesisProducer import AsyncKinesisProducer
+from src.task1.aggregation import RecordAggregator, deaggregate
+from src.task1.kinesisConsumer import FileCheckpointer, KinesisConsumer, ShardReader
+from src.task1.compression import Codec, decompress_record, decompress_stream, firehose_format, zstandard_module
+from src.task1.sweep import SweepRunner, ResourceBudget, parse_grid, grid_cells, cell_options, print_report as print_sweep_report
+from src.task1.payloadGenerator import PayloadGenerator, UniformSize, LogNormalSize, parse_header
+from src.task1.benchmark import payload_rates, PAYLOAD_PATHS
+from src.task1.lineSource import LineSource
+from src.task1.shardRouter import ShardRouter, FixedPartitionKey, HashKeySlice, MAX_HASH_KEY
+from src.task1.producerFleet import ProducerFleet
+from src.task1.shardThrottle import ShardThrottle
+from src.task1.deliveryVerifier import DeliveryVerifier
+from src.task1.rateControl import TokenBucket, RateController, parse_profile
+
+def tearDownModule():
+    close_clients()
+
 class TestTask1(unittest.TestCase):
+    """The stream and stack are provisioned once per session and worker, see sharedStacks"""
 
-    def setUp(self):
-        self.projectName="unitTestTask1"
+    @classmethod
+    def setUpClass(cls):
+        cls.shared = task1_stack()
+        cls.projectName = cls.shared['projectName']
 
-    def tearDown(self):
-        clean_up_kinesis( self.projectName )
-        clean_up_cloudformation_stack( self.projectName + 'Task1')
-        
     def test_kinesis_stream_created_by_boto3(self):
         kinesis = get_or_create_kinesis_stream( self.projectName )
 
@@ -33,8 +71,7 @@ class TestTask1(unittest.TestCase):
 
     def test_firehose_s3_cloudformation_stack(self):
         stackName = self.projectName + "Task1"
-        kinesis = get_or_create_kinesis_stream( self.projectName )
-        task1_stack = get_or_create_kinesis_cloudformation_stack( self.projectName, kinesis['StreamARN'] )
+        task1_stack = self.shared['stack']
 
         assert task1_stack.get('StackStatus') == 'CREATE_COMPLETE', "Expected status to be CREATE_COMPLETE"
         assert task1_stack.get('StackName') == stackName, "Expected name to be same"
@@ -47,3 +84,831 @@ class TestTask1(unittest.TestCase):
     def test_whole_stack_works_as_expected( self ):
         # FIXME: firehose process fails
         pass
+
+
+class TestKinesisProducerBatching(unittest.TestCase):
+
+    def setUp(self):
+        self.producer = KinesisProducer( "unitTestTask1KinesisStream", totalTimes=3, batchSize=2, lingerTime=60 )
+        self.stubber = Stubber( self.producer.kinesisClient )
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_flushes_when_batch_is_full(self):
+        self.stubber.add_response( 'put_records', {
+            'Records': [ { 'SequenceNumber': '1', 'ShardId': 'shardId-000000000000' } ] * 2
+        } )
+        self.producer.add_record( "a", "key" )
+        assert len( self.producer.buffer ) == 1, "Expected record to be buffered"
+        self.producer.add_record( "b", "key" )
+        assert len( self.producer.buffer ) == 0, "Expected full batch to be flushed"
+        self.stubber.assert_no_pending_responses()
+
+    def test_retries_only_failed_records(self):
+        ok = { 'SequenceNumber': '1', 'ShardId': 'shardId-000000000000' }
+        failed = { 'ErrorCode': 'ProvisionedThroughputExceededException', 'ErrorMessage': 'slow down' }
+        self.stubber.add_response( 'put_records', { 'FailedRecordCount': 1, 'Records': [ ok, failed ] } )
+        self.stubber.add_response( 'put_records', { 'Records': [ ok ] },
+            { 'StreamName': "unitTestTask1KinesisStream", 'Records': [ { 'Data': b"b", 'PartitionKey': "key" } ] } )
+
+        failedCount = self.producer.put_records_with_retry( [
+            { 'Data': b"a", 'PartitionKey': "key" },
+            { 'Data': b"b", 'PartitionKey': "key" }
+        ] )
+
+        assert failedCount == 0, "Expected failed record to be retried"
+        self.stubber.assert_no_pending_responses()
+
+
+class TestShardRouter(unittest.TestCase):
+
+    def setUp(self):
+        kinesisClient = KinesisProducer( "unitTestTask1KinesisStream" ).kinesisClient
+        self.stubber = Stubber( kinesisClient )
+        self.stubber.add_response( 'describe_stream', { 'StreamDescription': {
+            'StreamName': "unitTestTask1KinesisStream",
+            'StreamARN': "arn:aws:kinesis:us-west-2:000000000000:stream/unitTestTask1KinesisStream",
+            'StreamStatus': 'ACTIVE',
+            'Shards': [ {
+                'ShardId': 'shardId-00000000000{}'.format( index ),
+                'HashKeyRange': { 'StartingHashKey': str( start ), 'EndingHashKey': str( end ) },
+                'SequenceNumberRange': { 'StartingSequenceNumber': '0' }
+            } for index, ( start, end ) in enumerate( [ ( 0, 99 ), ( 100, 199 ) ] ) ],
+            'HasMoreShards': False,
+            'RetentionPeriodHours': 24,
+            'StreamCreationTimestamp': 0,
+            'EnhancedMonitoring': []
+        } } )
+        self.stubber.activate()
+        self.router = ShardRouter( kinesisClient, "unitTestTask1KinesisStream" )
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_round_robin_spreads_records_evenly(self):
+        routes = [ self.router.route( b"data" ) for _ in range( 4 ) ]
+
+        assert [ route[2] for route in routes ] == [ 'shardId-000000000000', 'shardId-000000000001' ] * 2
+        assert routes[1][1] == "149", "Expected hash key in the middle of the second shard"
+        assert self.router.hot_shards() == [], "Expected no hot shard"
+
+    def test_fixed_partition_key_reports_hot_shard(self):
+        self.router.strategy = FixedPartitionKey()
+        for _ in range( 4 ):
+            self.router.route( b"data" )
+
+        assert len( self.router.hot_shards() ) == 1, "Expected fixed partition key to make one hot shard"
+
+
+class TestAsyncKinesisProducer(unittest.TestCase):
+
+    def test_sends_every_record_with_bounded_in_flight_requests(self):
+        producer = AsyncKinesisProducer( "unitTestTask1KinesisStream", maxInFlight=2, totalTimes=5 )
+        stubber = Stubber( producer.kinesisClient )
+        for _ in range( 5 ):
+            stubber.add_response( 'put_record', { 'ShardId': 'shardId-000000000000', 'SequenceNumber': '1' } )
+
+        with stubber:
+            producer.run()
+
+        stubber.assert_no_pending_responses()
+        assert producer.errors == [], "Expected no failed request"
+
+
+class TestFileCheckpointer(unittest.TestCase):
+
+    def test_checkpoints_survive_restart(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join( tmpDir, "stream.checkpoint.json" )
+            FileCheckpointer( path ).save( 'shardId-000000000000', '42' )
+
+            checkpointer = FileCheckpointer( path )
+
+            assert checkpointer.get( 'shardId-000000000000' ) == '42', "Expected checkpoint to be reloaded"
+            assert checkpointer.get( 'shardId-000000000001' ) is None, "Expected unread shard to have no checkpoint"
+
+
+class TestRecordAggregation(unittest.TestCase):
+
+    def test_aggregated_record_round_trip(self):
+        aggregator = RecordAggregator()
+        aggregator.add_user_record( "key1", b"first", "123" )
+        aggregator.add_user_record( "key2", b"second" )
+        aggregator.add_user_record( "key1", b"third", "123" )
+
+        entry = aggregator.clear_and_get()
+        userRecords = deaggregate( entry['Data'] )
+
+        assert entry['PartitionKey'] == "key1" and entry['ExplicitHashKey'] == "123", "Expected keys of the first user record"
+        assert [ record['Data'] for record in userRecords ] == [ b"first", b"second", b"third" ]
+        assert [ record['PartitionKey'] for record in userRecords ] == [ "key1", "key2", "key1" ]
+        assert [ record['ExplicitHashKey'] for record in userRecords ] == [ "123", None, "123" ]
+        assert len( aggregator ) == 0, "Expected aggregator to be cleared"
+
+    def test_full_aggregated_record_is_returned(self):
+        aggregator = RecordAggregator( maxSize=100 )
+        full = None
+        while full is None:
+            full = aggregator.add_user_record( "key", b"0123456789" )
+
+        assert len( full['Data'] ) + len( full['PartitionKey'] ) <= 100, "Expected aggregated record to respect maxSize"
+        assert len( aggregator ) == 1, "Expected overflowing record to start the next aggregated record"
+
+    def test_plain_record_is_passed_through(self):
+        assert deaggregate( b"plain" ) == [ { 'Data': b"plain", 'PartitionKey': None, 'ExplicitHashKey': None } ]
+
+
+class TestClientRegistry(unittest.TestCase):
+
+    def test_clients_are_reused_until_closed(self):
+        registry = ClientRegistry()
+        kinesisClient = registry.get_client( 'kinesis' )
+
+        assert registry.get_client( 'kinesis' ) is kinesisClient, "Expected warm client to be reused"
+        assert registry.get_client( 'kinesis', maxPoolConnections=50 ) is not kinesisClient, "Expected pool size to key the client"
+        assert kinesisClient.meta.endpoint_url == 'http://localhost:4568', "Expected localstack endpoint by default"
+
+        registry.close()
+
+        assert registry.get_client( 'kinesis' ) is not kinesisClient, "Expected closed client to be rebuilt"
+
+
+class TestWaiter(unittest.TestCase):
+
+    def setUp(self):
+        self.waiter = Waiter( firstDelay=0.001, maxDelay=0.01 )
+
+    def test_retries_until_ready(self):
+        responses = iter( [ { 'ready': False }, { 'ready': False }, { 'ready': True } ] )
+
+        result = self.waiter.wait( lambda: next( responses ), lambda res: res['ready'], 1 )
+
+        assert result.ready and result.attempts == 3, "Expected ready after three polls"
+
+    def test_rolled_back_stack_fails_fast(self):
+        describe = lambda: { 'Stacks': [ { 'StackName': 'stack', 'StackStatus': 'ROLLBACK_COMPLETE' } ] }
+
+        with self.assertRaises( WaitFatalError ):
+            self.waiter.wait( describe, check_cloudformation_stack_complete, 10 )
+
+        assert self.waiter.history[-1].attempts == 1, "Expected no more polls after a fatal status"
+
+    def test_times_out(self):
+        result = self.waiter.wait( lambda: {}, lambda res: False, 0.05 )
+
+        assert not result.ready, "Expected wait to time out"
+
+    def test_waits_concurrently(self):
+        results = self.waiter.wait_all( [ ( lambda: True, bool, {} ), ( lambda: True, bool, {} ) ] )
+
+        assert all( result.ready for result in results ), "Expected every resource to be ready"
+
+
+class TestProvisioningGraph(unittest.TestCase):
+
+    def test_independent_nodes_run_concurrently(self):
+        graph = ProvisioningGraph()
+        graph.add_node( "slow1", lambda results: time.sleep( 0.2 ) or 1 )
+        graph.add_node( "slow2", lambda results: time.sleep( 0.2 ) or 2 )
+        graph.add_node( "sum", lambda results: results["slow1"] + results["slow2"], depends=[ "slow1", "slow2" ] )
+
+        start = time.time()
+        results = graph.run()
+
+        assert results["sum"] == 3, "Expected dependent node to see the results of its dependencies"
+        assert time.time() - start < 0.35, "Expected independent nodes to overlap"
+        assert graph.critical_path()[-1] == "sum"
+
+    def test_cycle_is_rejected(self):
+        graph = ProvisioningGraph()
+        graph.add_node( "a", lambda results: None, depends=[ "b" ] )
+        graph.add_node( "b", lambda results: None, depends=[ "a" ] )
+
+        with self.assertRaises( Exception ):
+            graph.run()
+
+    def test_failure_stops_dependent_nodes(self):
+        graph = ProvisioningGraph()
+        graph.add_node( "broken", lambda results: 1 / 0 )
+        graph.add_node( "after", lambda results: self.fail( "Expected node after a failure not to run" ), depends=[ "broken" ] )
+
+        with self.assertRaises( ZeroDivisionError ):
+            graph.run()
+
+
+class TestStateCache(unittest.TestCase):
+
+    def test_entries_survive_restart_until_invalidated(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join( tmpDir, "state.json" )
+            fingerprint = template_fingerprint( "Resources: {}" )
+            StateCache( path ).put( "stacks/stack", { 'fingerprint': fingerprint } )
+
+            cache = StateCache( path )
+            assert cache.get( "stacks/stack" ) == { 'fingerprint': fingerprint }, "Expected entry to be reloaded"
+            assert template_fingerprint( "Resources: {}" ) == fingerprint, "Expected stable fingerprint"
+            assert template_fingerprint( "Resources: { }" ) != fingerprint, "Expected changed template to change fingerprint"
+
+            cache.invalidate( "stacks/stack" )
+
+            assert StateCache( path ).get( "stacks/stack" ) is None, "Expected invalidated entry to be gone"
+
+    def test_stream_gone_from_the_backend_is_provisioned_again(self):
+        backend = Backend( "moto" ).start()
+        try:
+            name = resource_name( "unitTestTask1Stale" )
+            get_or_create_kinesis_stream( name )
+            stateCache.put( "stacks/" + name + "Task1", { 'fingerprint': "stale" } )
+            # the backend lost its resources but the state cache still has them
+            get_client( 'kinesis' ).delete_stream( StreamName=name + "KinesisStream" )
+
+            stream = get_or_create_kinesis_stream( name )
+
+            assert get_client( 'kinesis' ).describe_stream_summary( StreamName=stream['StreamName'] )
+            assert stateCache.get( "stacks/" + name + "Task1" ) is None, "Expected the stack entry invalidated with its stream"
+            get_client( 'kinesis' ).delete_stream( StreamName=stream['StreamName'] )
+        finally:
+            backend.stop()
+
+
+class TestPayloadGenerator(unittest.TestCase):
+
+    def test_fixed_size_alphanumeric_payloads(self):
+        payloads = PayloadGenerator( 10 ).batch( 100 ) + [ PayloadGenerator( 10 ).next() ]
+
+        assert all( len( payload ) == 10 and payload.isalnum() for payload in payloads ), "Expected 10 alphanumeric bytes"
+        assert len( set( payloads ) ) > 90, "Expected random payloads"
+
+    def test_header_carries_sequence_and_timestamp(self):
+        generator = PayloadGenerator( 64, header=True, delimiter=b"\n" )
+        payloads = [ generator.next() ] + generator.batch( 2 )
+
+        headers = [ parse_header( payload ) for payload in payloads ]
+
+        assert [ header[0] for header in headers ] == [ 0, 1, 2 ], "Expected consecutive sequence numbers"
+        assert all( abs( header[1] - time.time() ) < 60 for header in headers ), "Expected emission timestamps"
+        assert all( len( payload ) == 64 and payload.endswith( b"\n" ) for payload in payloads )
+
+    def test_size_distributions_stay_in_bounds(self):
+        for sizes in [ UniformSize( 5, 20 ), LogNormalSize( 100, minSize=50, maxSize=500 ) ]:
+            payloads = PayloadGenerator( sizes, seed=1 ).batch( 200 )
+            assert all( sizes.minSize <= len( payload ) <= sizes.maxSize for payload in payloads )
+
+    def test_ring_buffer_reuses_bodies(self):
+        generator = PayloadGenerator( 10, ringSize=3 )
+
+        assert generator.batch( 6 ) == generator.ring * 2, "Expected ring bodies to be cycled"
+
+    def test_header_payloads_fit_their_size(self):
+        self.assertRaises( Exception, PayloadGenerator, 10, header=True, delimiter=b"\n" )
+        payloads = PayloadGenerator( UniformSize( 1, 40 ), header=True, delimiter=b"\n", seed=1 ).batch( 50 )
+        assert len( payloads ) == 50 and all( parse_header( payload ) for payload in payloads ), "Expected small sizes rounded up"
+
+    def test_producer_takes_payloads_a_batch_at_a_time(self):
+        class CountingGenerator( PayloadGenerator ):
+            batches = 0
+            def batch( self, count ):
+                CountingGenerator.batches += 1
+                return super().batch( count )
+
+        producer = KinesisProducer( "unitTestTask1KinesisStream", 0, totalTimes=10, batchSize=4, payloads=CountingGenerator( 10 ), verbose=False )
+        stubber = Stubber( producer.kinesisClient )
+        for count in [ 4, 4, 2 ]:
+            stubber.add_response( 'put_records', { 'Records': [ { 'SequenceNumber': '1', 'ShardId': 'shardId-000000000000' } ] * count } )
+        with stubber:
+            producer.run()
+
+        stubber.assert_no_pending_responses()
+        assert producer.sentRecords == 10 and CountingGenerator.batches == 3
+
+    def test_benchmark_measures_every_payload_path(self):
+        rates = payload_rates( 10, count=1000, batchSize=100 )
+        assert sorted( rates ) == sorted( PAYLOAD_PATHS ) and all( rate > 0 for rate in rates.values() )
+
+
+class TestLineSource(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = [ b"line %d" % i for i in range( 1000 ) ]
+        self.data = b"\n".join( self.lines[:500] ) + b"\n\n" + b"x" * 300 + b"\n" + b"\n".join( self.lines[500:] )
+
+    def read_all(self, source):
+        payloads = []
+        payload = source.next()
+        while payload is not None:
+            payloads.append( payload )
+            payload = source.next()
+        return payloads
+
+    def test_mapped_file_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join( directory, "input.log" )
+            with open( path, "wb" ) as f:
+                f.write( self.data )
+            source = LineSource( path, queueSize=2, chunkBytes=256, maxRecordSize=100 )
+            payloads = self.read_all( source )
+
+        assert payloads == [ line + b"\n" for line in self.lines ], "Expected every line but the empty and oversized ones, newline terminated"
+        assert source.skippedLines == 1 and source.records == 1000 and source.readBytes == len( self.data )
+
+    def test_pipe_is_read_with_bounded_read_ahead(self):
+        readFd, writeFd = os.pipe()
+
+        def write():
+            with os.fdopen( writeFd, "wb" ) as f:
+                f.write( self.data )
+
+        writer = threading.Thread( target=write )
+        writer.start()
+        with os.fdopen( readFd, "rb" ) as stream:
+            source = LineSource( "-", queueSize=1, chunkBytes=64, maxRecordSize=100, keepNewline=False )
+            source.open_input = lambda: ( stream, None )
+            source.start()
+            time.sleep( 0.2 )
+            assert source.queue.qsize() <= 1, "Expected the reader to wait for the producer"
+            payloads = self.read_all( source )
+        writer.join()
+
+        assert payloads == self.lines and source.skippedLines == 1
+        assert source.readerBlocked > 0.1, "Expected the reader to be blocked on the full queue"
+
+    def test_task1_replays_input_on_moto(self):
+        backend = Backend( "moto" ).start()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join( directory, "input.log" )
+                with open( path, "wb" ) as f:
+                    f.write( self.data )
+                results = task1_kinesis( "unitTestTask1Input", batchSize=500, inputPath=path )
+            assert results["producer"].sentRecords == 1001, "Expected every non empty line, the long one fits a kinesis record"
+            assert results["producer"].failedRecords == 0
+        finally:
+            backend.stop()
+
+
+def zstd_available():
+    try:
+        zstandard_module()
+        return True
+    except Exception:
+        return False
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        aggregator = RecordAggregator()
+        for payload in PayloadGenerator( 100, header=True, delimiter=b"\n", seed=1 ).batch( 200 ):
+            aggregator.add_user_record( "key", payload )
+        self.aggregated = aggregator.clear_and_get()['Data']
+
+    def check_codec(self, codec):
+        frames = [ codec.compress( self.aggregated ), codec.compress( b"line\n" ) ]
+        stream = b"".join( frames )
+
+        assert decompress_record( frames[0] ) == self.aggregated, "Expected each frame to decompress on its own"
+        chunks = [ stream[ offset:offset + 7 ] for offset in range( 0, len( stream ), 7 ) ]
+        assert b"".join( decompress_stream( chunks ) ) == self.aggregated + b"line\n", "Expected concatenated frames to form one stream"
+        assert codec.frames == 2 and codec.ratio < 0.9 and codec.cpuSeconds > 0
+
+    def test_gzip_frames(self):
+        self.check_codec( Codec( "gzip" ) )
+
+    @unittest.skipUnless( zstd_available(), "zstandard is not installed" )
+    def test_zstd_frames(self):
+        self.check_codec( Codec( "zstd" ) )
+
+    def test_raw_data_is_passed_through(self):
+        assert decompress_record( b"\x1f\x8b not gzip" ) == b"\x1f\x8b not gzip"
+        assert b"".join( decompress_stream( [ b"", b"raw", b" data" ] ) ) == b"raw data"
+
+    def test_firehose_format(self):
+        assert firehose_format( "none", "GZIP" ) == "GZIP" and firehose_format( "gzip" ) == "UNCOMPRESSED"
+        self.assertRaises( Exception, firehose_format, "gzip", "GZIP" )
+
+    def test_consumer_decompresses_and_deaggregates(self):
+        received = []
+        with tempfile.TemporaryDirectory() as directory:
+            consumer = KinesisConsumer( "unitTestTask1KinesisStream", checkpointPath=os.path.join( directory, "checkpoint.json" ),
+                processRecord=lambda shardId, record: received.append( record['Data'] ) )
+            stubber = Stubber( consumer.kinesisClient )
+            stubber.add_response( 'get_records', { 'Records': [ { 'Data': Codec( "gzip" ).compress( self.aggregated ),
+                'PartitionKey': 'key', 'SequenceNumber': '1' } ], 'NextShardIterator': 'next', 'MillisBehindLatest': 0 } )
+            with stubber:
+                ShardReader( consumer, "shardId-000000000000" ).poll( "iterator" )
+
+        assert received == [ record['Data'] for record in deaggregate( self.aggregated ) ] and len( received ) == 200
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_within_relative_error(self):
+        histogram = LatencyHistogram()
+        values = [ index / 10000 for index in range( 1, 10001 ) ]
+        for value in values:
+            histogram.record( value )
+
+        for percent in [ 50, 95, 99 ]:
+            exact = values[ int( len( values ) * percent / 100 ) - 1 ]
+            assert abs( histogram.percentile( percent ) - exact ) <= exact * 0.04, "Expected {}th percentile near {}".format( percent, exact )
+
+    def test_merge_adds_counts(self):
+        first, second = LatencyHistogram(), LatencyHistogram()
+        first.record( 0.001 )
+        second.record( 0.5 )
+
+        first.merge( second )
+
+        assert first.to_dict()['count'] == 2
+        assert first.percentile( 100 ) == 0.5
+
+
+class TestRateControl(unittest.TestCase):
+
+    def test_token_bucket_paces_after_burst(self):
+        now = [ 0.0 ]
+        bucket = TokenBucket( 10, burst=2, clock=lambda: now[0] )
+
+        assert [ bucket.reserve() for _ in range( 2 ) ] == [ 0, 0 ], "Expected the burst to go through"
+        assert abs( bucket.reserve() - 0.1 ) < 1e-9, "Expected to wait one token at 10/s"
+        now[0] = 1.0
+        assert bucket.reserve() == 0, "Expected refilled tokens"
+
+    def test_token_bucket_holds_at_zero_rate(self):
+        bucket = TokenBucket( 0, burst=1, clock=lambda: 0.0 )
+
+        assert bucket.reserve() == 0
+        assert bucket.reserve() is None, "Expected nothing reserved at rate 0"
+
+    def test_profiles(self):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join( tmpdir, "profile.csv" )
+        with open( path, "w" ) as f:
+            f.write( "second,rate\n0,5\n10,50\n" )
+
+        assert parse_profile( None, 20 )( 100 ) == 20
+        assert parse_profile( "ramp:0:100:10" )( 5 ) == 50
+        assert parse_profile( "step:0=1,30=7" )( 31 ) == 7
+        assert abs( parse_profile( "sine:10:5:4" )( 1 ) - 15 ) < 1e-9
+        assert parse_profile( "csv:" + path )( 12 ) == 50
+        assert parse_profile( "csv:" + path + ":loop" )( 21 ) == 5
+        with self.assertRaises( Exception ):
+            parse_profile( "ramp:1" )
+
+    def test_producer_keeps_target_rate(self):
+        client = ClientRegistry().get_client( 'kinesis' )
+        stubber = Stubber( client )
+        for _ in range( 20 ):
+            stubber.add_response( 'put_record', { 'ShardId': 'shardId-000000000000', 'SequenceNumber': '1' } )
+        stubber.activate()
+        producer = KinesisProducer( "stream", totalTimes=20, kinesisClient=client, verbose=False,
+            rateController=RateController( parse_profile( "constant", 100 ), burstSeconds=0.01 ) )
+
+        start = time.time()
+        producer.run()
+
+        assert producer.sentRecords == 20
+        assert 0.15 < time.time() - start < 1, "Expected about 20 records at 100 records/s"
+
+
+class TestProducerFleet(unittest.TestCase):
+
+    def test_hash_key_slices_cover_the_key_space(self):
+        slices = [ HashKeySlice( index, 3 ) for index in range( 3 ) ]
+
+        assert slices[0].startingHashKey == 0 and slices[-1].endingHashKey == MAX_HASH_KEY
+        assert all( first.endingHashKey + 1 == second.startingHashKey for first, second in zip( slices, slices[1:] ) )
+        assert all( slices[1].startingHashKey <= int( slices[1]( None, b"" )[1] ) <= slices[1].endingHashKey for _ in range( 10 ) )
+
+    def test_fleet_spreads_records_over_workers(self):
+        kinesis = get_or_create_kinesis_stream( resource_name( "unitTestTask1Fleet" ), 2 )
+        fleet = ProducerFleet( kinesis, workers=2, totalTimes=21, verbose=False, batchSize=5 )
+
+        fleet.run()
+
+        assert fleet.sentRecords == 21 and fleet.failedRecords == 0
+        assert sorted( stats['sentRecords'] for stats in fleet.workerStats.values() ) == [ 10, 11 ]
+        assert fleet.stats()['latency'].count > 0, "Expected worker latency histograms to be merged"
+
+
+class TestShardThrottle(unittest.TestCase):
+
+    def setUp(self):
+        self.kinesisClient = ClientRegistry().get_client( 'kinesis' )
+        self.stubber = Stubber( self.kinesisClient )
+        self.stubber.activate()
+        self.router = ShardRouter( self.kinesisClient, "unitTestTask1KinesisStream", description={
+            'StreamName': "unitTestTask1KinesisStream",
+            'Shards': [ {
+                'ShardId': 'shardId-00000000000{}'.format( index ),
+                'HashKeyRange': { 'StartingHashKey': str( start ), 'EndingHashKey': str( end ) },
+                'SequenceNumberRange': { 'StartingSequenceNumber': '0' }
+            } for index, ( start, end ) in enumerate( [ ( 0, 99 ), ( 100, 199 ) ] ) ],
+            'HasMoreShards': False
+        } )
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_aimd_rate(self):
+        throttle = ShardThrottle( recordsPerSecond=10, increase=0.1 )
+
+        throttle.on_throttled( "shard" )
+        assert throttle.shard( "shard" ).fraction == 0.5, "Expected the rate to be halved"
+        assert throttle.reserve( "shard", 1, 10 ) > 0, "Expected the shard budget to be drained"
+        throttle.on_success( "shard" )
+        assert abs( throttle.shard( "shard" ).fraction - 0.6 ) < 1e-9, "Expected an additive increase"
+
+    def test_throttled_records_are_retried_on_their_shard(self):
+        throttle = ShardThrottle( retryDelay=0.01 )
+        producer = KinesisProducer( "unitTestTask1KinesisStream", 0, totalTimes=4, batchSize=4, router=self.router,
+            kinesisClient=self.kinesisClient, verbose=False, throttle=throttle )
+        self.stubber.add_response( 'put_records', { 'FailedRecordCount': 2, 'Records': [
+            { 'SequenceNumber': '1', 'ShardId': 'shardId-000000000000' },
+            { 'ErrorCode': 'ProvisionedThroughputExceededException', 'ErrorMessage': 'Rate exceeded' },
+            { 'SequenceNumber': '2', 'ShardId': 'shardId-000000000000' },
+            { 'ErrorCode': 'ProvisionedThroughputExceededException', 'ErrorMessage': 'Rate exceeded' }
+        ] } )
+        self.stubber.add_response( 'put_records', { 'Records': [
+            { 'SequenceNumber': '3', 'ShardId': 'shardId-000000000001' },
+            { 'SequenceNumber': '4', 'ShardId': 'shardId-000000000001' }
+        ] } )
+
+        producer.run()
+
+        self.stubber.assert_no_pending_responses()
+        assert producer.sentRecords == 4 and producer.failedRecords == 0
+        assert throttle.shard( 'shardId-000000000001' ).throttles == 1
+        assert throttle.shard( 'shardId-000000000000' ).throttles == 0, "Expected the healthy shard not to slow down"
+
+    def test_throttling_error_does_not_end_the_run(self):
+        producer = KinesisProducer( "unitTestTask1KinesisStream", 0, totalTimes=2, router=self.router,
+            kinesisClient=self.kinesisClient, verbose=False, throttle=ShardThrottle( retryDelay=0.01 ) )
+        self.stubber.add_client_error( 'put_record', 'ProvisionedThroughputExceededException' )
+        for index in range( 2 ):
+            self.stubber.add_response( 'put_record', { 'ShardId': 'shardId-00000000000{}'.format( index ), 'SequenceNumber': '1' } )
+
+        producer.run()
+
+        self.stubber.assert_no_pending_responses()
+        assert producer.sentRecords == 2 and producer.failedRecords == 0
+
+    def test_throttled_last_flush_is_sent(self):
+        producer = KinesisProducer( "unitTestTask1KinesisStream", 0, totalTimes=1, batchSize=1, router=self.router,
+            kinesisClient=self.kinesisClient, verbose=False, throttle=ShardThrottle( retryDelay=0.01 ) )
+        for _ in range( 2 ):
+            self.stubber.add_client_error( 'put_records', 'ProvisionedThroughputExceededException' )
+        self.stubber.add_response( 'put_records', { 'Records': [ { 'SequenceNumber': '1', 'ShardId': 'shardId-000000000001' } ] } )
+
+        producer.run()
+
+        self.stubber.assert_no_pending_responses()
+        assert producer.sentRecords == 1 and producer.failedRecords == 0
+        assert not any( producer.deferred.values() ), "Expected no record left deferred"
+
+    def test_retries_are_counted_per_record(self):
+        producer = AsyncKinesisProducer( "unitTestTask1KinesisStream", 0, totalTimes=1, batchSize=1, maxRetries=3, router=self.router,
+            kinesisClient=self.kinesisClient, verbose=False, throttle=ShardThrottle( retryDelay=0.01 ) )
+        for _ in range( 4 ):
+            self.stubber.add_response( 'put_records', { 'FailedRecordCount': 1, 'Records': [
+                { 'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Internal service failure' } ] } )
+
+        producer.run()
+
+        self.stubber.assert_no_pending_responses()
+        assert producer.sentRecords == 0 and producer.failedRecords == 1, "Expected the record to fail after one put and 3 retries"
+
+
+class TestDeliveryVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.s3Client = get_client( 's3' )
+        self.bucket = resource_name( "unittesttask1delivery" ).lower()
+        self.s3Client.create_bucket( Bucket=self.bucket, CreateBucketConfiguration={ 'LocationConstraint': 'us-west-2' } )
+        self.payloads = PayloadGenerator( 40, header=True, delimiter=b"\n" )
+
+    def tearDown(self):
+        for content in self.s3Client.list_objects_v2( Bucket=self.bucket ).get('Contents', []):
+            self.s3Client.delete_object( Bucket=self.bucket, Key=content['Key'] )
+        self.s3Client.delete_bucket( Bucket=self.bucket )
+
+    def deliver(self, key, payloads):
+        self.s3Client.put_object( Bucket=self.bucket, Key="firehose/2020/01/01/00/" + key, Body=b"".join( payloads ) )
+
+    def test_incremental_listing_and_completeness(self):
+        verifier = DeliveryVerifier( self.bucket, fetchWorkers=2 )
+        batch = self.payloads.batch( 6 )
+        self.deliver( "a", batch[:3] )
+
+        assert verifier.poll() == 3
+        self.deliver( "b", batch[3:5] + batch[:1] )
+        assert verifier.poll() == 2, "Expected only the new object to be read"
+        assert verifier.poll() == 0
+
+        assert verifier.objects == 2 and verifier.duplicates == 1
+        assert verifier.missing( range( 6 ) ) == [ 5 ]
+        assert not verifier.verify( 6, timeout=0 )
+        assert verifier.latency.count == 6
+
+    def test_compressed_objects(self):
+        verifier = DeliveryVerifier( self.bucket, fetchWorkers=2 )
+        codec = Codec( "gzip" )
+        batch = self.payloads.batch( 6 )
+        # records compressed by the producer, then an object compressed by firehose
+        self.deliver( "a", [ codec.compress( payload ) for payload in batch[:3] ] )
+        self.deliver( "b", [ gzip.compress( b"".join( batch[3:] ) ) ] )
+
+        assert verifier.poll() == 6 and verifier.unmatchedLines == 0
+        assert verifier.objectBytes < verifier.bytes
+
+    def test_aggregated_compressed_objects(self):
+        verifier = DeliveryVerifier( self.bucket, fetchWorkers=2, aggregated=True )
+        codec = Codec( "gzip" )
+        aggregator = RecordAggregator()
+        frames = []
+        for payloads in [ self.payloads.batch( 3 ), self.payloads.batch( 2 ) ]:
+            for payload in payloads:
+                aggregator.add_user_record( "8.8.8.8", payload )
+            frames.append( codec.compress( aggregator.clear_and_get()['Data'] ) )
+        self.deliver( "a", frames )
+
+        assert verifier.poll() == 5 and verifier.unmatchedLines == 0
+        assert verifier.missing( range( 5 ) ) == []
+        self.assertRaises( Exception, task1_kinesis, "unitTestTask1Verify", verify=True, aggregate=True )
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_records_calls_errors_and_latency(self):
+        instrumentation = Instrumentation()
+        registry = ClientRegistry( instrumentation=instrumentation )
+        kinesisClient = registry.get_client( 'kinesis' )
+
+        kinesisClient.list_streams()
+        with self.assertRaises( Exception ):
+            kinesisClient.describe_stream( StreamName="unitTestTask1MissingStream" )
+        registry.close()
+
+        stats = instrumentation.to_dict()
+        assert stats['operations']['kinesis.ListStreams']['calls'] == 1
+        assert stats['operations']['kinesis.ListStreams']['latency']['count'] == 1
+        assert stats['operations']['kinesis.DescribeStream']['errors'] == { 'ResourceNotFoundException': 1 }
+        assert stats['clients']['kinesis']['count'] == 1
+        json.dumps( stats )
+
+        text = instrumentation.to_prometheus()
+        assert 'aws_api_calls_total{service="kinesis",operation="ListStreams"} 1' in text
+        assert 'aws_api_errors_total{service="kinesis",operation="DescribeStream",code="ResourceNotFoundException"} 1' in text
+
+class TestBackend(unittest.TestCase):
+
+    def test_virtual_clock(self):
+        clock = VirtualClock( start=100 )
+        start = time.time()
+        clock.sleep( 60 )
+        assert clock.time() == 160 and clock.monotonic() == 60 and clock.slept == 60
+        event = threading.Event()
+        assert not clock.wait( event, 5 ) and clock.time() == 165
+        event.set()
+        assert clock.wait( event, 5 ) and clock.time() == 165, "Expected a set event to end the wait at once"
+        assert time.time() - start < 1
+
+    def test_task1_on_moto(self):
+        backend = Backend( "moto" ).start()
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout( output ):
+                results = task1_kinesis( "unitTestTask1Offline", 10 )
+            assert results["producer"].sentRecords == 10
+            assert backend.clock.slept > 1.9, "Expected the producer interval to be skipped"
+        finally:
+            backend.stop()
+        assert "critical path: stream -> deliveryStream -> producer" in output.getvalue(), "Expected the producer to wait for the delivery stream"
+        assert get_client('kinesis').meta.endpoint_url == LOCALSTACK_ENDPOINTS['kinesis'], "Expected the localstack endpoints back"
+
+    def test_consumer_catches_up_on_moto(self):
+        output = io.StringIO()
+        cwd = os.getcwd()
+        backend = Backend( "moto" ).start()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                # the consumer checkpoints in the working directory
+                os.chdir( directory )
+                with contextlib.redirect_stdout( output ):
+                    task1_kinesis( resource_name( "unitTestTask1Consume" ), 10, consume=True, verbose=False )
+        finally:
+            os.chdir( cwd )
+            backend.stop()
+
+        assert "did not catch up" not in output.getvalue()
+        assert "records 10 " in output.getvalue(), "Expected the 10 records consumed"
+
+class TestSweep(unittest.TestCase):
+
+    def test_grid_cells_and_options(self):
+        cells = grid_cells( parse_grid( [ "shards=1,2", "bufferingInterval=60,300", "aggregate=true" ] ) )
+
+        assert len( cells ) == 4 and cells[1] == { 'shards': 1, 'bufferingInterval': 300, 'aggregate': True }
+        assert cell_options( cells[1] ) == { 'shardCount': 1, 'bufferingHints': { 'IntervalInSeconds': 300 }, 'aggregate': True }
+        self.assertRaises( Exception, parse_grid, [ "unknown=1" ] )
+
+    def test_budget_bounds_cells_and_shards(self):
+        def run( budget, shards ):
+            def cell( count ):
+                budget.acquire( count )
+                time.sleep( 0.05 )
+                budget.release( count )
+            threads = [ threading.Thread( target=cell, args=( count, ) ) for count in shards ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return budget
+
+        assert run( ResourceBudget( 2, 8 ), [ 1, 1, 1, 1 ] ).peakCells == 2, "Expected two cells at once"
+        budget = run( ResourceBudget( 4, 3 ), [ 2, 2, 2, 5 ] )
+        assert budget.peakCells == 1 and budget.peakShards == 5, "Expected the shard budget to serialize the cells, the large one alone"
+
+    def test_sweep_on_moto(self):
+        backend = Backend( "moto" ).start()
+        try:
+            runner = SweepRunner( parse_grid( [ "shards=1,2", "batchSize=5" ] ), resource_name( "unitTestSweep" ), { 'totalTimes': 5 },
+                ResourceBudget( 2, 3 ) )
+            report = runner.run()
+        finally:
+            backend.stop()
+
+        assert [ result['error'] for result in report['results'] ] == [ None, None ]
+        assert [ result['records'] for result in report['results'] ] == [ 5, 5 ]
+        assert report['results'][1]['projectName'] == runner.prefix + "C1" and report['budget']['peakShards'] <= 3
+        assert report['left'] == [] and not any( Teardown( runner.prefix ).discover().values() ), "Expected every cell resource deleted"
+        print_sweep_report( report )
+
+
+class TestTeardown(unittest.TestCase):
+
+    def test_deletes_every_resource_of_the_prefix(self):
+        backend = Backend( "moto" ).start()
+        try:
+            # long enough for the stack bucket name to drop the prefix, short enough for a valid name with the worker suffix
+            prefix = resource_name( "unitTestTeardownOfALongName" )
+            kinesisClient = get_client( 'kinesis' )
+            s3Client = get_client( 's3' )
+            for name in [ prefix + "A", prefix + "B", "keep" + prefix ]:
+                kinesisClient.create_stream( StreamName=name, ShardCount=1 )
+            bucket = prefix.lower() + "-bucket"
+            s3Client.create_bucket( Bucket=bucket, CreateBucketConfiguration={ 'LocationConstraint': 'us-west-2' } )
+            for index in range( 1001 ):
+                s3Client.put_object( Bucket=bucket, Key="records/{}".format( index ), Body=b"x" )
+            stream = get_or_create_kinesis_stream( prefix )
+            get_or_create_kinesis_cloudformation_stack( prefix, stream['StreamARN'] )
+
+            teardown = Teardown( prefix )
+            resources = teardown.discover()
+            assert len( resources['stream'] ) == 3 and len( resources['bucket'] ) == 2 and resources['stack'] == [ prefix + "Task1" ]
+            teardown.run( resources )
+            teardown.report()
+
+            assert teardown.failures == [] and not any( teardown.discover().values() )
+            assert teardown.purgedObjects == 1001 and teardown.deleteBatches == 2, "Expected batches of 1000 keys"
+            kinesisClient.describe_stream( StreamName="keep" + prefix )
+            kinesisClient.delete_stream( StreamName="keep" + prefix )
+        finally:
+            backend.stop()
+
+    def test_reports_resources_left(self):
+        s3Client = get_client( 's3' )
+        stubber = Stubber( s3Client )
+        stubber.add_response( 'list_buckets', { 'Buckets': [ { 'Name': "unittestteardownstub" } ] } )
+        stubber.add_response( 'list_object_versions', { 'Versions': [ { 'Key': "a", 'VersionId': "1" } ] } )
+        stubber.add_response( 'delete_objects', { 'Errors': [ { 'Key': "a", 'Code': "AccessDenied", 'Message': "Access Denied" } ] } )
+        with stubber:
+            teardown = Teardown( "unitTestTeardownStub", kinds=[ "bucket" ], s3Client=s3Client )
+            teardown.run()
+
+        assert [ result['name'] for result in teardown.failures ] == [ "unittestteardownstub" ]
+        assert "Access Denied" in teardown.failures[0]['error']
+        self.assertRaises( Exception, Teardown, "" )
+
+
+class TestImportTime(unittest.TestCase):
+
+    def imported_modules(self, target):
+        process = subprocess.run( [ sys.executable, "-X", "importtime" ] + TARGETS[ target ], cwd=ROOT,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE )
+        return { module for module, selfUs, cumulativeUs, depth in parse_import_time( process.stderr.decode() ) }
+
+    def test_parse_import_time(self):
+        modules = parse_import_time( "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |     botocore.compat\n"
+            "import time:       300 |        420 |   botocore\n" )
+
+        assert modules == [ ( "botocore.compat", 120, 120, 2 ), ( "botocore", 300, 420, 1 ) ]
+
+    def test_cli_and_task2_do_not_import_unused_dependencies(self):
+        cli = self.imported_modules( "cli" )
+        assert "argparse" in cli
+        assert "boto3" not in cli and "troposphere" not in cli, "Expected --help to import no task dependency"
+        assert "troposphere" not in self.imported_modules( "task2" ), "Expected task2 to rebuild without troposphere"
@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+import warnings
+warnings.filterwarnings(action="ignore", message="unclosed",
+                         category=ResourceWarning)
+
+from src.clients import ClientRegistry
+from sharedStacks import resource_name, shared
+from src.backends import Backend
+from src.waiter import WaitResult
+from src.task2.rollingRebuild import RollingRebuild
+from src.task2.healthTracker import HealthTracker
+from src.task2.autoscaling import task2_autoscaling
+
+MOTO_ENDPOINT = "http://localhost:4568"
+MOTO_REGION = "us-west-2"
+
+class AutoscalingGroupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ClientRegistry()
+        self.autoscalingClient = self.registry.get_client( 'autoscaling', endpointUrl=MOTO_ENDPOINT, regionName=MOTO_REGION )
+        self.ec2Client = self.registry.get_client( 'ec2', endpointUrl=MOTO_ENDPOINT, regionName=MOTO_REGION )
+        self.groupName = resource_name( "unitTestTask2Group" ) + str( int( time.time() * 1000 ) )
+        imageId = shared( "imageId", lambda: self.ec2Client.describe_images( Owners=[ 'amazon' ] )['Images'][0]['ImageId'] )
+        self.autoscalingClient.create_launch_configuration( LaunchConfigurationName=self.groupName, ImageId=imageId, InstanceType="t2.micro" )
+        self.autoscalingClient.create_auto_scaling_group( AutoScalingGroupName=self.groupName, LaunchConfigurationName=self.groupName,
+            MinSize=5, MaxSize=6, DesiredCapacity=6, AvailabilityZones=[ MOTO_REGION + "a" ] )
+
+    def tearDown(self):
+        self.autoscalingClient.delete_auto_scaling_group( AutoScalingGroupName=self.groupName, ForceDelete=True )
+        self.autoscalingClient.delete_launch_configuration( LaunchConfigurationName=self.groupName )
+        self.registry.close()
+
+    def describe_group(self):
+        return self.autoscalingClient.describe_auto_scaling_groups( AutoScalingGroupNames=[ self.groupName ] )['AutoScalingGroups'][0]
+
+class TestRollingRebuild(AutoscalingGroupTestCase):
+
+    def rolling_rebuild(self, **kwargs):
+        return RollingRebuild( self.groupName, autoscalingClient=self.autoscalingClient, ec2Client=self.ec2Client, **kwargs )
+
+    def test_rebuild_in_batches(self):
+        rebuild = self.rolling_rebuild( maxBatchSize=2, minInService=2 )
+
+        assert rebuild.run(), "Expected every instance to be rebuilt"
+
+        group = self.describe_group()
+        assert len( rebuild.rebuilt ) == 6 and len( rebuild.batchTimings ) == 3
+        assert group['MinSize'] == 5 and group['DesiredCapacity'] == 6, "Expected the group capacity to be restored"
+        assert len( group['Instances'] ) == 6, "Expected no replacement instance"
+
+    def test_abort_and_rollback_after_failure(self):
+        failing = self.describe_group()['Instances'][2]['InstanceId']
+        failed = threading.Event()
+        rolledBack = []
+        rebuild = self.rolling_rebuild( maxBatchSize=2, minInService=2, rollback=rolledBack.extend )
+
+        def wait_healthy( batch ):
+            if failing in batch:
+                failed.set()
+                return WaitResult( "describe_auto_scaling_instances", False, 0, 1, None, None )
+            # the other batch is only healthy once the failure happened, whichever order the batches run in
+            failed.wait( 5 )
+            return WaitResult( "describe_auto_scaling_instances", True, 0, 1, None, None )
+
+        rebuild.wait_healthy = wait_healthy
+
+        assert not rebuild.run()
+        assert len( rebuild.batchTimings ) == 2, "Expected no batch to start after the failure"
+        failedBatch, rebuiltBatch = sorted( [ timing['instanceIds'] for timing in rebuild.batchTimings ], key=lambda batch: failing not in batch )
+        assert rebuild.aborted and sorted( rebuild.failures ) == sorted( failedBatch )
+        assert sorted( rolledBack ) == sorted( rebuiltBatch ), "Expected exactly the rebuilt instances to be rolled back"
+        assert self.describe_group()['MinSize'] == 5
+
+    def test_batches_booting_at_once_are_capped(self):
+        rebuild = self.rolling_rebuild( maxBatchSize=1, minInService=1 )
+        lock = threading.Lock()
+        outOfService = { 'now': 0, 'peak': 0 }
+        takeOut = rebuild.take_out
+
+        def take_out( batch ):
+            with lock:
+                outOfService['now'] += len( batch )
+                outOfService['peak'] = max( outOfService['peak'], outOfService['now'] )
+            takeOut( batch )
+
+        def wait_healthy( batch ):
+            time.sleep( 0.05 )
+            with lock:
+                outOfService['now'] -= len( batch )
+            return WaitResult( "describe_auto_scaling_instances", True, 0, 1, None, None )
+
+        rebuild.take_out = take_out
+        rebuild.wait_healthy = wait_healthy
+
+        assert rebuild.run() and len( rebuild.rebuilt ) == 6
+        assert outOfService['peak'] == 2, "Expected one batch booting while the next one is detached, not 5 of 6 instances out"
+
+    def test_refuses_to_go_below_min_in_service(self):
+        with self.assertRaises( Exception ):
+            self.rolling_rebuild( minInService=6 ).run()
+
+class TestHealthTracker(AutoscalingGroupTestCase):
+
+    def test_bulk_refresh(self):
+        tracker = HealthTracker( self.groupName, self.autoscalingClient, minRefreshInterval=60 )
+        instanceIds = [ instance['InstanceId'] for instance in self.describe_group()['Instances'] ]
+
+        result = tracker.wait_until_healthy( instanceIds, timeout=5 )
+
+        assert result.ready and sorted( result.response ) == sorted( instanceIds )
+        assert tracker.calls == 1, "Expected one bulk call for the whole group"
+        tracker.refresh()
+        assert tracker.calls == 1, "Expected a recent refresh to be reused"
+
+    def test_detached_instance_is_not_healthy(self):
+        tracker = HealthTracker( self.groupName, self.autoscalingClient, minRefreshInterval=0.1 )
+        instanceId = self.describe_group()['Instances'][0]['InstanceId']
+        self.autoscalingClient.detach_instances( InstanceIds=[ instanceId ], AutoScalingGroupName=self.groupName, ShouldDecrementDesiredCapacity=True )
+
+        result = tracker.wait_until_healthy( [ instanceId ], timeout=0.3 )
+
+        assert not result.ready and tracker.state( instanceId ) is None
+        assert tracker.unhealthy( [ instanceId ] ) == [ instanceId ]
+
+class TestTask2OnMoto(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = Backend( "moto" ).start()
+
+    def tearDown(self):
+        self.backend.stop()
+
+    def test_task2_creates_and_rebuilds_group(self):
+        assert task2_autoscaling( "unitTestTask2Offline", maxBatchSize=3, create=True )